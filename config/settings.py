@@ -56,6 +56,7 @@ SITE_VERSION = env_vars.get('SITE_VERSION', '4.0.27')
 # CONFIGURAÇÕES DE SCRAPING (não sensíveis)
 RECORDS_PER_PAGE = 25  # Produtos por página (máximo 25)
 DELAY_BETWEEN_REQUESTS = 2  # Segundos entre requisições
+PAGINAS_SIMULTANEAS = int(env_vars.get('SCRAPER_PAGINAS_SIMULTANEAS', 4))  # Páginas em paralelo após a 1ª (1 = sequencial)
 TIMEOUT_SECONDS = 30  # Timeout para requisições HTTP
 
 # CONFIGURAÇÕES AVANÇADAS (não sensíveis)
@@ -28,6 +28,9 @@ src_dir = current_dir / "src"
 if str(src_dir) not in sys.path:
     sys.path.insert(0, str(src_dir))
 
+from src.coleta import carregar_filtros
+from src.coleta import colunar
+
 # Imports condicionais
 try:
     from src.scrapy_wrapper import ScrapyServimedWrapper
@@ -48,7 +51,10 @@ def executar_nivel_1(args):
         print("Verifique se o Scrapy está instalado: pip install scrapy")
         return None
     
-    if args.filtro:
+    filtros = filtros_da_linha_de_comando(args)
+    if filtros:
+        print(f"Coletando produtos de {len(filtros)} filtros na mesma execucao: {', '.join(filtros)}")
+    elif args.filtro:
         print(f"Coletando produtos com filtro: '{args.filtro}'")
     else:
         print("Coletando produtos via Scrapy")
@@ -56,6 +62,18 @@ def executar_nivel_1(args):
     if args.max_pages:
         print(f"Limitando a {args.max_pages} paginas")
     
+    if args.resume:
+        print("Retomando coleta interrompida (somente paginas pendentes)")
+    
+    if args.delta:
+        print("Coleta incremental: somente produtos novos, alterados ou removidos")
+    
+    if args.exportar:
+        if not colunar.disponivel():
+            print("ERRO: --exportar requer pyarrow (pip install pyarrow)")
+            return None
+        print(f"Snapshot colunar: data/servimed_produtos_scrapy{colunar.FORMATOS[args.exportar]}")
+    
     print("Framework: Scrapy 2.13.3")
     print("Arquivo de saida: data/servimed_produtos_scrapy.json")
     print()
@@ -65,7 +83,11 @@ def executar_nivel_1(args):
         wrapper = ScrapyServimedWrapper()
         resultado = wrapper.run_spider(
             filtro=args.filtro or '', 
-            max_pages=args.max_pages or 1
+            max_pages=args.max_pages if args.max_pages is not None else 1,
+            resume=args.resume,
+            delta=args.delta,
+            filtros=filtros,
+            exportar=args.exportar or ''
         )
         
         if resultado:
@@ -94,6 +116,16 @@ def executar_nivel_1(args):
         return None
 
 
+def filtros_da_linha_de_comando(args):
+    """Termos de --filtros/--arquivo-filtros (None para a coleta de filtro único)"""
+    if not args.filtros and not args.arquivo_filtros:
+        return None
+    termos = [args.filtro] if args.filtro else []
+    if args.filtros:
+        termos.extend(args.filtros.split(','))
+    return carregar_filtros(termos, args.arquivo_filtros)
+
+
 def executar_nivel_2(args):
     """Execução via filas (Nível 2) - Sempre usando Scrapy"""
     print("EXECUTANDO NIVEL 2 - MODO FILAS")
@@ -150,8 +182,13 @@ def executar_nivel_2(args):
             senha=senha,
             callback_url=callback_url,
             filtro=args.filtro or "",
-            max_pages=args.max_pages or 1,
-            framework="scrapy"  # Sempre usar Scrapy
+            max_pages=args.max_pages if args.max_pages is not None else 1,
+            framework="scrapy",  # Sempre usar Scrapy
+            resume=args.resume,
+            delta=args.delta,
+            filtros=filtros_da_linha_de_comando(args),
+            exportar=args.exportar or "",
+            encadeado=args.encadeado
         )
         
         print(f"Tarefa Scrapy enfileirada com ID: {task_id}")
@@ -272,6 +309,11 @@ NIVEL 1 - Execução Direta com Scrapy:
   python main.py --nivel 1                             # Todos os produtos
   python main.py --nivel 1 --filtro "paracetamol"     # Filtrar por termo
   python main.py --nivel 1 --max-pages 10             # Limitar páginas
+  python main.py --nivel 1 --max-pages 0 --resume     # Continua coleta interrompida
+  python main.py --nivel 1 --max-pages 0 --delta      # Somente mudancas desde a ultima coleta
+  python main.py --nivel 1 --filtros "dipirona,paracetamol"  # Varios termos, sem repetir produtos
+  python main.py --nivel 1 --arquivo-filtros termos.txt      # Um termo por linha
+  python main.py --nivel 1 --max-pages 0 --exportar parquet  # Tambem grava snapshot Parquet
 
 NIVEL 2 - Sistema de Filas com Scrapy (PADRÃO: usa filas):
   python main.py --nivel 2                            # Enfileira tarefa (padrão)
@@ -309,11 +351,44 @@ Pré-requisitos para Níveis 2 e 3:
         help='Termo para filtrar produtos (ex: "paracetamol", "dipirona")'
     )
     
+    parser.add_argument(
+        '--filtros',
+        type=str,
+        default=None,
+        help='[Nivel 1/2] Varios termos separados por virgula, coletados na mesma execucao'
+    )
+    
+    parser.add_argument(
+        '--arquivo-filtros',
+        type=str,
+        default=None,
+        help='[Nivel 1/2] Arquivo com um termo por linha (linhas com # sao ignoradas)'
+    )
+    
     parser.add_argument(
         '--max-pages', '-p',
         type=int,
         default=None,
-        help='Numero maximo de paginas para processar (padrao: sem limite)'
+        help='Numero maximo de paginas para processar (0 = todas; padrao Scrapy/Nivel 2: 1)'
+    )
+    
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='[Nivel 1/2] Retoma a coleta interrompida, buscando somente as paginas pendentes'
+    )
+    
+    parser.add_argument(
+        '--delta',
+        action='store_true',
+        help='[Nivel 1/2] Exporta e envia apenas produtos novos, alterados ou removidos'
+    )
+    
+    parser.add_argument(
+        '--exportar',
+        choices=sorted(colunar.FORMATOS),
+        default=None,
+        help='[Nivel 1/2] Grava tambem um snapshot colunar (requer pyarrow; arrow = leitura sem copia)'
     )
     
     # Argumentos do Nível 2 (filas) - PADRÃO: usar filas
@@ -323,6 +398,12 @@ Pré-requisitos para Níveis 2 e 3:
         help='[Nivel 2] Executa modo direto (sem filas) - opcional'
     )
     
+    parser.add_argument(
+        '--encadeado',
+        action='store_true',
+        help='[Nivel 2] Coleta em fatias paralelas -> exportacao -> envio (sem --delta/--resume)'
+    )
+    
     parser.add_argument(
         '--status',
         type=str,
@@ -3,5 +3,7 @@ API Client Package
 """
 
 from .callback_client import CallbackAPIClient
+from .uploader import CallbackUploader
+from .token_cache import CacheToken
 
-__all__ = ["CallbackAPIClient"]
+__all__ = ["CallbackAPIClient", "CallbackUploader", "CacheToken"]
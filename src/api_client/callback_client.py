@@ -8,12 +8,54 @@ Cliente para autenticação e envio de produtos para a API de callback.
 import requests
 import json
 import os
-from typing import List, Dict, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Optional
 from dotenv import load_dotenv
 
+from ..rede import nova_sessao
+from .token_cache import cache_token, chave_token
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
+# Envio em lotes (send_products_chunked)
+CALLBACK_BATCH_SIZE = int(os.getenv('CALLBACK_BATCH_SIZE', '500'))
+CALLBACK_MAX_IN_FLIGHT = int(os.getenv('CALLBACK_MAX_IN_FLIGHT', '4'))
+CALLBACK_MAX_RETRIES = int(os.getenv('CALLBACK_MAX_RETRIES', '3'))
+CALLBACK_TIMEOUT = int(os.getenv('CALLBACK_TIMEOUT', '60'))
+CALLBACK_RETRY_BACKOFF = float(os.getenv('CALLBACK_RETRY_BACKOFF', '1'))
+
+
+def novo_relatorio() -> Dict:
+    """Relatório vazio de envio em lotes"""
+    return {
+        'success': False,
+        'total_produtos': 0,
+        'total_lotes': 0,
+        'lotes_ok': 0,
+        'lotes_falhos': 0,
+        'lotes_pulados': 0,
+        'lotes': []
+    }
+
+
+def resumir_relatorio(relatorio: Dict, inicio: float) -> Dict:
+    """Ordena os lotes do relatório e calcula os totais"""
+    relatorio['lotes'].sort(key=lambda lote: lote['lote'])
+    relatorio['total_lotes'] = len(relatorio['lotes'])
+    relatorio['lotes_ok'] = sum(1 for lote in relatorio['lotes'] if lote['status'] == 'ok')
+    relatorio['lotes_falhos'] = sum(1 for lote in relatorio['lotes'] if lote['status'] == 'erro')
+    relatorio['lotes_pulados'] = sum(1 for lote in relatorio['lotes'] if lote['status'] == 'pulado')
+    relatorio['success'] = relatorio['lotes_falhos'] == 0 and 'error' not in relatorio
+    relatorio['duracao'] = time.time() - inicio
+    
+    print(f"Envio em lotes: {relatorio['lotes_ok']}/{relatorio['total_lotes']} lotes ok, "
+          f"{relatorio['lotes_falhos']} falhos, {relatorio['total_produtos']} produtos "
+          f"em {relatorio['duracao']:.2f}s")
+    return relatorio
+
 
 class CallbackAPIClient:
     """Cliente para interagir com a API de callback"""
@@ -21,7 +63,13 @@ class CallbackAPIClient:
     def __init__(self, base_url: Optional[str] = None):
         self.base_url = (base_url or os.getenv('COTEFACIL_API_URL', 'https://desafio.cotefacil.net')).rstrip('/')
         self.access_token = None
-        self.session = requests.Session()
+        self.token_renovar_em = None
+        # Sessão própria (token) sobre o pool de conexões compartilhado do processo
+        self.session = nova_sessao()
+        
+        # Credenciais da última autenticação (renovação do token) e chave no cache
+        self._credenciais = None
+        self._chave_token = None
         
         # Configurar headers padrão
         self.session.headers.update({
@@ -34,6 +82,9 @@ class CallbackAPIClient:
         """
         Autentica via OAuth2PasswordBearer usando dados do .env
         
+        Um token ainda válido emitido para as mesmas credenciais (por esta ou
+        outra tarefa do worker) é reutilizado do cache sem chamar /oauth/token.
+        
         Returns:
             bool: True se autenticado com sucesso
         """
@@ -46,6 +97,35 @@ class CallbackAPIClient:
             print("ERRO: Credenciais OAuth2 incompletas no .env")
             return False
         
+        self._credenciais = (username, password, client_id, client_secret)
+        self._chave_token = chave_token(self.base_url, username, client_id)
+        
+        if self._usar_token_do_cache():
+            return True
+        
+        # Uma renovação por vez: quem esperou o lock aproveita o token recém-emitido
+        with cache_token.lock(self._chave_token):
+            if self._usar_token_do_cache():
+                return True
+            return self._solicitar_token(username, password, client_id, client_secret)
+    
+    def _usar_token_do_cache(self) -> bool:
+        registro = cache_token.obter(self._chave_token)
+        if not registro:
+            return False
+        self._usar_token(*registro)
+        print(f"Token OAuth2 reutilizado do cache (renovação em {registro[1] - time.time():.0f}s)")
+        return True
+    
+    def _usar_token(self, token: str, renovar_em: float):
+        self.access_token = token
+        self.token_renovar_em = renovar_em
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}"
+        })
+    
+    def _solicitar_token(self, username: str, password: str, client_id: str, client_secret: str) -> bool:
+        """POST /oauth/token (password flow); guarda o token no cache"""
         try:
             # Dados para OAuth2 password flow
             token_data = {
@@ -73,20 +153,19 @@ class CallbackAPIClient:
             )
             
             print(f"Status da autenticação: {response.status_code}")
-            print(f"Resposta: {response.text}")
             
             if response.status_code == 200:
                 token_info = response.json()
-                self.access_token = token_info.get("access_token")
+                access_token = token_info.get("access_token")
                 
-                if self.access_token:
+                if access_token:
                     # Atualizar headers da sessão com o token
-                    self.session.headers.update({
-                        "Authorization": f"Bearer {self.access_token}"
-                    })
+                    renovar_em = cache_token.guardar(self._chave_token, access_token, token_info.get("expires_in"))
+                    self._usar_token(access_token, renovar_em)
                     
                     print(f"Autenticação bem-sucedida!")
-                    print(f"Access token obtido: {self.access_token[:50]}...")
+                    print(f"Access token obtido: {access_token[:50]}... "
+                          f"(renovação em {renovar_em - time.time():.0f}s)")
                     return True
                 else:
                     print("Token de acesso não encontrado na resposta")
@@ -100,12 +179,51 @@ class CallbackAPIClient:
             print(f"Erro durante autenticação OAuth2: {e}")
             return False
     
-    def send_products(self, products: List[Dict]) -> bool:
+    def _renovar_token(self, token_rejeitado: Optional[str] = None) -> bool:
+        """Descarta o token rejeitado/vencendo e obtém outro (cache ou /oauth/token)"""
+        if not self._credenciais:
+            return False
+        cache_token.invalidar(self._chave_token, token_rejeitado)
+        return self.authenticate(*self._credenciais)
+    
+    def _garantir_token(self):
+        """Renova o token antes do vencimento (margem TOKEN_REFRESH_MARGEM)"""
+        if self._credenciais and self.token_renovar_em is not None \
+                and time.time() >= self.token_renovar_em:
+            print("Token OAuth2 perto do vencimento, renovando...")
+            self._renovar_token(self.access_token)
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Requisição autenticada à API
+        
+        Renova o token perto do vencimento e, se a API responder 401,
+        obtém um token novo e repete a requisição uma única vez.
+        
+        Args:
+            method: Método HTTP (GET, POST, PATCH...)
+            url: Caminho (/pedido) ou URL completa
+        """
+        if not url.startswith('http'):
+            url = f"{self.base_url}{url}"
+        kwargs.setdefault('timeout', 30)
+        enviar = getattr(self.session, method.lower())
+        
+        self._garantir_token()
+        token_usado = self.access_token
+        response = enviar(url, **kwargs)
+        
+        if response.status_code == 401 and self._renovar_token(token_usado):
+            print(f"401 em {method.upper()} {url}: repetindo com token renovado")
+            response = enviar(url, **kwargs)
+        return response
+    
+    def send_products(self, products: Iterable[Dict]) -> bool:
         """
         Envia lista de produtos para a API
         
         Args:
-            products: Lista de produtos no formato esperado pela API
+            products: Produtos no formato esperado pela API (lista ou gerador)
             
         Returns:
             bool: True se enviado com sucesso
@@ -116,21 +234,13 @@ class CallbackAPIClient:
         
         try:
             # Converter produtos para formato da API
-            api_products = []
-            for produto in products:
-                api_product = {
-                    "gtin": str(produto.get('gtin', produto.get('gtin_ean', ''))),
-                    "codigo": str(produto.get('codigo', '')),
-                    "descricao": str(produto.get('descricao', '')),
-                    "preco_fabrica": float(produto.get('preco_fabrica', 0.0)),
-                    "estoque": int(produto.get('estoque', 0))
-                }
-                api_products.append(api_product)
+            api_products = [self.converter_produto(produto) for produto in products]
             
             print(f"Enviando {len(api_products)} produtos para {self.base_url}/produto")
             
-            response = self.session.post(
-                f"{self.base_url}/produto",
+            response = self.request(
+                'POST',
+                "/produto",
                 json=api_products,
                 timeout=60
             )
@@ -156,6 +266,144 @@ class CallbackAPIClient:
             print(f"Erro ao enviar produtos: {e}")
             return False
     
+    @staticmethod
+    def converter_produto(produto: Dict) -> Dict:
+        """Converte um produto (Scrapy ou sistema original) para o formato da API"""
+        return {
+            "gtin": str(produto.get('gtin', produto.get('gtin_ean', ''))),
+            "codigo": str(produto.get('codigo', '')),
+            "descricao": str(produto.get('descricao', '')),
+            "preco_fabrica": float(produto.get('preco_fabrica', 0.0)),
+            "estoque": int(produto.get('estoque', 0))
+        }
+    
+    @classmethod
+    def converter_para_envio(cls, produto: Dict) -> Optional[Dict]:
+        """
+        Produto no formato da API, ou None se não puder ser convertido
+        
+        Regra única do envio em streaming (CallbackUploader) e do envio em
+        lotes: os dois ignoram os mesmos produtos, então os índices dos lotes
+        coincidem e o reenvio pode pular os lotes já aceitos.
+        """
+        try:
+            return cls.converter_produto(produto)
+        except (ValueError, TypeError) as e:
+            print(f"Produto ignorado no envio ({produto.get('codigo')}): {e}")
+            return None
+    
+    def _lotes(self, products: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+        """Agrupa os produtos em lotes já convertidos, sem materializar a entrada"""
+        iterador = (convertido for convertido in map(self.converter_para_envio, products) if convertido is not None)
+        while True:
+            lote = list(islice(iterador, batch_size))
+            if not lote:
+                return
+            yield lote
+    
+    def send_products_chunked(self, products: Iterable[Dict], batch_size: Optional[int] = None,
+                              max_in_flight: Optional[int] = None, max_retries: Optional[int] = None,
+                              pular_lotes: Optional[Iterable[int]] = None) -> Dict:
+        """
+        Envia produtos em lotes, com vários lotes em paralelo
+        
+        Cada lote é um POST independente em /produto com suas próprias
+        tentativas. A entrada é consumida sob demanda: no máximo
+        `max_in_flight` lotes ficam em memória/enviando ao mesmo tempo.
+        
+        Args:
+            products: Produtos (lista ou gerador)
+            batch_size: Produtos por lote (padrão CALLBACK_BATCH_SIZE)
+            max_in_flight: Lotes enviados em paralelo (padrão CALLBACK_MAX_IN_FLIGHT)
+            max_retries: Tentativas extras por lote (padrão CALLBACK_MAX_RETRIES)
+            pular_lotes: Índices de lotes já enviados (retomada de um envio anterior)
+            
+        Returns:
+            Dict: Relatório com o resultado de cada lote
+        """
+        batch_size = max(1, batch_size or CALLBACK_BATCH_SIZE)
+        max_in_flight = max(1, max_in_flight or CALLBACK_MAX_IN_FLIGHT)
+        max_retries = CALLBACK_MAX_RETRIES if max_retries is None else max_retries
+        pular_lotes = set(pular_lotes or [])
+        
+        relatorio = novo_relatorio()
+        
+        if not self.access_token:
+            print("Erro: Não autenticado. Execute authenticate() primeiro.")
+            relatorio['error'] = 'Não autenticado'
+            return relatorio
+        
+        inicio = time.time()
+        pendentes = set()
+        
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for indice, lote in enumerate(self._lotes(products, batch_size)):
+                relatorio['total_produtos'] += len(lote)
+                
+                if indice in pular_lotes:
+                    relatorio['lotes'].append({
+                        'lote': indice,
+                        'quantidade': len(lote),
+                        'status': 'pulado'
+                    })
+                    continue
+                
+                # Contrapressão: espera um lote terminar antes de montar o próximo
+                if len(pendentes) >= max_in_flight:
+                    concluidos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                    relatorio['lotes'].extend(f.result() for f in concluidos)
+                
+                pendentes.add(executor.submit(self.enviar_lote, indice, lote, max_retries))
+            
+            relatorio['lotes'].extend(f.result() for f in pendentes)
+        
+        return resumir_relatorio(relatorio, inicio)
+    
+    def enviar_lote(self, indice: int, lote: List[Dict], max_retries: int) -> Dict:
+        """Envia um lote com novas tentativas para erros de rede, 429 e 5xx"""
+        resultado = {
+            'lote': indice,
+            'quantidade': len(lote),
+            'status': 'erro',
+            'status_code': None,
+            'tentativas': 0,
+            'erro': None
+        }
+        inicio = time.time()
+        
+        for tentativa in range(max_retries + 1):
+            resultado['tentativas'] = tentativa + 1
+            try:
+                response = self.request(
+                    'POST',
+                    "/produto",
+                    json=lote,
+                    timeout=CALLBACK_TIMEOUT
+                )
+                resultado['status_code'] = response.status_code
+                
+                if response.status_code in (200, 201):
+                    resultado['status'] = 'ok'
+                    resultado['erro'] = None
+                    break
+                
+                resultado['erro'] = response.text[:200]
+                # Erros do cliente (exceto 429) não melhoram com nova tentativa
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+                    
+            except requests.RequestException as e:
+                resultado['erro'] = str(e)
+            
+            if tentativa < max_retries:
+                time.sleep(CALLBACK_RETRY_BACKOFF * (2 ** tentativa))
+        
+        resultado['duracao'] = time.time() - inicio
+        if resultado['status'] != 'ok':
+            print(f"Lote {indice} falhou após {resultado['tentativas']} tentativa(s): "
+                  f"{resultado['status_code']} {resultado['erro']}")
+        return resultado
+    
     def test_connection(self) -> bool:
         """Testa conexão com a API"""
         try:
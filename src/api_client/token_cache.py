@@ -0,0 +1,120 @@
+"""
+Cache do Token OAuth2
+=====================
+
+Guarda o bearer token da API de callback por (URL, usuário, client_id),
+para que as tarefas do worker reutilizem o mesmo token até perto do
+vencimento (`expires_in`) em vez de chamar /oauth/token a cada tarefa.
+
+O cache fica em memória no processo e, com TOKEN_CACHE_REDIS=true, também
+no Redis do Celery - assim todos os workers compartilham o token. Falhas
+do Redis não interrompem nada: o cache local continua valendo.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:  # Redis é opcional (Nível 1 não usa)
+    redis = None
+
+load_dotenv()
+
+TOKEN_CACHE_REDIS = os.getenv('TOKEN_CACHE_REDIS', 'false').lower() == 'true'
+TOKEN_CACHE_REDIS_URL = os.getenv('TOKEN_CACHE_REDIS_URL') or os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+# Renovação antecipada: o token é considerado vencido MARGEM segundos antes do fim
+TOKEN_REFRESH_MARGEM = int(os.getenv('TOKEN_REFRESH_MARGEM', '60'))
+# Validade assumida quando a resposta não informa expires_in
+TOKEN_TTL_PADRAO = int(os.getenv('TOKEN_TTL_PADRAO', '3600'))
+
+
+def chave_token(base_url: str, username: str, client_id: str) -> str:
+    """Chave do token (sem a senha)"""
+    bruto = f'{base_url}|{username}|{client_id}'.encode('utf-8')
+    return 'servimed:oauth:' + hashlib.sha1(bruto).hexdigest()
+
+
+class CacheToken:
+    """Tokens válidos por chave, em memória e opcionalmente no Redis"""
+
+    def __init__(self, usar_redis: bool = TOKEN_CACHE_REDIS, redis_url: str = TOKEN_CACHE_REDIS_URL,
+                 margem: int = TOKEN_REFRESH_MARGEM):
+        self.margem = margem
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        if usar_redis and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=2)
+            except Exception as e:
+                print(f"Cache de token no Redis indisponível: {e}")
+
+    def lock(self, chave: str) -> threading.Lock:
+        """Lock por chave: uma única renovação por vez no processo"""
+        with self._lock:
+            return self._locks.setdefault(chave, threading.Lock())
+
+    def obter(self, chave: str) -> Optional[Tuple[str, float]]:
+        """(token, renovar_em) ainda válido, ou None"""
+        agora = time.time()
+        registro = self._tokens.get(chave)
+        if registro and registro[1] > agora:
+            return registro
+
+        if self._redis is not None:
+            try:
+                valor = self._redis.get(chave)
+            except Exception:
+                valor = None
+            if valor:
+                dados = json.loads(valor)
+                registro = (dados['access_token'], dados['renovar_em'])
+                if registro[1] > agora:
+                    self._tokens[chave] = registro
+                    return registro
+        return None
+
+    def guardar(self, chave: str, token: str, expires_in: Optional[int] = None) -> float:
+        """Guarda o token; retorna o instante em que ele deve ser renovado"""
+        try:
+            validade = int(expires_in) if expires_in else TOKEN_TTL_PADRAO
+        except (TypeError, ValueError):
+            validade = TOKEN_TTL_PADRAO
+        # Tokens curtos renovam na metade da validade (nunca "já vencidos" ao chegar)
+        ttl = validade - min(self.margem, validade / 2)
+        renovar_em = time.time() + ttl
+        self._tokens[chave] = (token, renovar_em)
+
+        if self._redis is not None and int(ttl) > 0:
+            try:
+                self._redis.set(chave, json.dumps({'access_token': token, 'renovar_em': renovar_em}), ex=int(ttl))
+            except Exception as e:
+                print(f"Falha ao gravar token no Redis: {e}")
+        return renovar_em
+
+    def invalidar(self, chave: str, token: Optional[str] = None):
+        """Remove o token (somente se ainda for `token`, quando informado)"""
+        registro = self._tokens.get(chave)
+        if token is not None and registro and registro[0] != token:
+            return
+        self._tokens.pop(chave, None)
+        if self._redis is not None:
+            try:
+                valor = self._redis.get(chave)
+                # Outro worker pode já ter gravado um token novo
+                if valor and (token is None or json.loads(valor)['access_token'] == token):
+                    self._redis.delete(chave)
+            except Exception:
+                pass
+
+
+# Cache compartilhado pelos clientes do processo
+cache_token = CacheToken()
@@ -0,0 +1,115 @@
+"""
+Envio em Segundo Plano para API de Callback
+===========================================
+
+Recebe produtos um a um (enquanto a coleta ainda está rodando), agrupa em
+lotes e envia para /produto em uma thread própria, com vários lotes em
+paralelo. A fila é limitada: quando o envio fica para trás, quem produz os
+itens espera (contrapressão) em vez de acumular o catálogo em memória.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .callback_client import (
+    CallbackAPIClient,
+    CALLBACK_BATCH_SIZE,
+    CALLBACK_MAX_IN_FLIGHT,
+    CALLBACK_MAX_RETRIES,
+    novo_relatorio,
+    resumir_relatorio,
+)
+
+# Produtos aguardando envio (0 = 2 lotes por envio em paralelo)
+CALLBACK_MAX_FILA = int(os.getenv('CALLBACK_MAX_FILA', '0'))
+
+
+class CallbackUploader:
+    """Envia produtos para a API de callback em lotes, em segundo plano"""
+
+    _FIM = object()
+
+    def __init__(self, client: Optional[CallbackAPIClient] = None, batch_size: Optional[int] = None,
+                 max_in_flight: Optional[int] = None, max_fila: Optional[int] = None,
+                 max_retries: Optional[int] = None):
+        self.client = client or CallbackAPIClient()
+        self.batch_size = max(1, batch_size or CALLBACK_BATCH_SIZE)
+        self.max_in_flight = max(1, max_in_flight or CALLBACK_MAX_IN_FLIGHT)
+        self.max_retries = CALLBACK_MAX_RETRIES if max_retries is None else max_retries
+        max_fila = max_fila or CALLBACK_MAX_FILA or self.batch_size * self.max_in_flight * 2
+
+        self.fila = queue.Queue(maxsize=max_fila)
+        self.relatorio = novo_relatorio()
+        self._thread = threading.Thread(target=self._executar, name='callback-uploader', daemon=True)
+
+    def iniciar(self) -> 'CallbackUploader':
+        """Inicia a thread de envio"""
+        self._thread.start()
+        return self
+
+    def enviar(self, produto: Dict):
+        """Enfileira um produto, bloqueando enquanto a fila estiver cheia"""
+        self.fila.put(produto)
+
+    def enviar_sem_bloquear(self, produto: Dict) -> bool:
+        """Enfileira um produto se houver espaço; retorna False se a fila estiver cheia"""
+        try:
+            self.fila.put_nowait(produto)
+            return True
+        except queue.Full:
+            return False
+
+    def finalizar(self, timeout: Optional[float] = None) -> Dict:
+        """Envia o que restou, aguarda os lotes em andamento e retorna o relatório"""
+        self.fila.put(self._FIM)
+        self._thread.join(timeout)
+        return self.relatorio
+
+    def _executar(self):
+        inicio = time.time()
+
+        if not (self.client.access_token or self.client.authenticate()):
+            self.relatorio['error'] = 'Falha na autenticação OAuth2 com a API'
+            # Continua consumindo a fila para não travar quem produz os itens
+            while self.fila.get() is not self._FIM:
+                self.relatorio['total_produtos'] += 1
+            resumir_relatorio(self.relatorio, inicio)
+            return
+
+        # Limita os lotes em andamento; com o limite atingido a fila enche e o produtor espera
+        vagas = threading.BoundedSemaphore(self.max_in_flight)
+        futures = []
+        lote: List[Dict] = []
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+
+            def submeter(lote):
+                vagas.acquire()
+                future = executor.submit(self.client.enviar_lote, len(futures), lote, self.max_retries)
+                future.add_done_callback(lambda _: vagas.release())
+                futures.append(future)
+
+            while True:
+                produto = self.fila.get()
+                if produto is self._FIM:
+                    break
+
+                convertido = self.client.converter_para_envio(produto)
+                if convertido is None:
+                    continue
+                lote.append(convertido)
+
+                self.relatorio['total_produtos'] += 1
+                if len(lote) >= self.batch_size:
+                    submeter(lote)
+                    lote = []
+
+            if lote:
+                submeter(lote)
+
+        self.relatorio['lotes'] = [future.result() for future in futures]
+        resumir_relatorio(self.relatorio, inicio)
@@ -0,0 +1,12 @@
+"""
+Catálogo Local de Produtos
+==========================
+
+Índice persistente dos produtos coletados, consultado antes de qualquer scraping.
+"""
+
+from .indice import CatalogoIndex
+from .cache import CacheProdutos
+from .historico import HistoricoPrecos
+
+__all__ = ["CatalogoIndex", "CacheProdutos", "HistoricoPrecos"]
@@ -0,0 +1,191 @@
+"""
+Cache de Produtos
+=================
+
+Memoização das buscas de produto por chave (código ou gtin:...) usada pelo
+Nível 3 na frente do índice do catálogo e do scraping.
+
+- LRU: no máximo PRODUTO_CACHE_TAMANHO entradas em memória
+- TTL: produtos encontrados valem PRODUTO_CACHE_TTL segundos
+- Cache negativo: códigos não encontrados valem PRODUTO_CACHE_TTL_NEGATIVO
+  segundos (evita repetir uma coleta que já não achou nada)
+- Busca única: chamadas simultâneas para a mesma chave esperam a primeira
+
+Com PRODUTO_CACHE_REDIS=true as entradas também ficam no Redis do Celery,
+compartilhadas por todos os workers. Falhas de busca (exceções) não são
+guardadas.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:  # Redis é opcional (Nível 1 não usa)
+    redis = None
+
+load_dotenv()
+
+PRODUTO_CACHE_TAMANHO = int(os.getenv('PRODUTO_CACHE_TAMANHO', '1000'))
+PRODUTO_CACHE_TTL = int(os.getenv('PRODUTO_CACHE_TTL', '600'))
+PRODUTO_CACHE_TTL_NEGATIVO = int(os.getenv('PRODUTO_CACHE_TTL_NEGATIVO', '120'))
+PRODUTO_CACHE_REDIS = os.getenv('PRODUTO_CACHE_REDIS', 'false').lower() == 'true'
+PRODUTO_CACHE_REDIS_URL = os.getenv('PRODUTO_CACHE_REDIS_URL') or os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+
+PREFIXO_REDIS = 'servimed:produto:'
+
+
+class CacheProdutos:
+    """Cache LRU com TTL (positivo e negativo) de produtos por chave"""
+
+    def __init__(self, tamanho: int = PRODUTO_CACHE_TAMANHO, ttl: int = PRODUTO_CACHE_TTL,
+                 ttl_negativo: int = PRODUTO_CACHE_TTL_NEGATIVO, usar_redis: bool = PRODUTO_CACHE_REDIS,
+                 redis_url: str = PRODUTO_CACHE_REDIS_URL):
+        self.tamanho = max(1, tamanho)
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self._entradas: 'OrderedDict[str, Tuple[Optional[Dict], float]]' = OrderedDict()
+        self._buscas: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.contagem = {'hits': 0, 'hits_negativos': 0, 'misses': 0, 'expirados': 0,
+                         'removidos_lru': 0, 'hits_redis': 0}
+
+        self._redis = None
+        if usar_redis and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=2)
+            except Exception as e:
+                print(f"Cache de produtos no Redis indisponível: {e}")
+
+    def obter(self, chave: str) -> Tuple[bool, Optional[Dict]]:
+        """
+        Consulta o cache
+
+        Returns:
+            (encontrado, produto): produto None com encontrado=True é um
+            código sabidamente inexistente (cache negativo)
+        """
+        agora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if entrada[1] > agora:
+                    self._entradas.move_to_end(chave)
+                    self.contagem['hits' if entrada[0] is not None else 'hits_negativos'] += 1
+                    return True, entrada[0]
+                del self._entradas[chave]
+                self.contagem['expirados'] += 1
+
+        entrada = self._obter_redis(chave)
+        with self._lock:
+            if entrada is not None:
+                self.contagem['hits_redis'] += 1
+                self.contagem['hits' if entrada[0] is not None else 'hits_negativos'] += 1
+                self._inserir(chave, entrada)
+                return True, entrada[0]
+            self.contagem['misses'] += 1
+        return False, None
+
+    def guardar(self, chave: str, produto: Optional[Dict]):
+        """Guarda o produto (ou None = não encontrado) com o TTL correspondente"""
+        ttl = self.ttl if produto is not None else self.ttl_negativo
+        if ttl <= 0:
+            return
+        entrada = (produto, time.time() + ttl)
+        with self._lock:
+            self._inserir(chave, entrada)
+        if self._redis is not None:
+            try:
+                self._redis.set(PREFIXO_REDIS + chave, json.dumps(entrada[0], ensure_ascii=False), ex=int(ttl))
+            except Exception as e:
+                print(f"Falha ao gravar produto {chave} no Redis: {e}")
+
+    def obter_ou_buscar(self, chave: str, buscar: Callable[[], Optional[Dict]]) -> Optional[Dict]:
+        """
+        Produto do cache ou resultado de `buscar()` (guardado no cache)
+
+        Apenas uma busca por chave roda por vez no processo; as demais
+        chamadas aguardam e reaproveitam o resultado.
+        """
+        while True:
+            encontrado, produto = self.obter(chave)
+            if encontrado:
+                return produto
+
+            with self._lock:
+                evento = self._buscas.get(chave)
+                if evento is None:
+                    evento = self._buscas[chave] = threading.Event()
+                    responsavel = True
+                else:
+                    responsavel = False
+
+            if not responsavel:
+                evento.wait()
+                # Se a busca falhou (exceção) nada foi guardado: tenta de novo
+                encontrado, produto = self.obter(chave)
+                if encontrado:
+                    return produto
+                continue
+
+            try:
+                produto = buscar()
+                self.guardar(chave, produto)
+                return produto
+            finally:
+                with self._lock:
+                    self._buscas.pop(chave, None)
+                evento.set()
+
+    def invalidar(self, chave: str):
+        """Remove a chave (ex.: produto alterado por uma nova coleta)"""
+        with self._lock:
+            self._entradas.pop(chave, None)
+        if self._redis is not None:
+            try:
+                self._redis.delete(PREFIXO_REDIS + chave)
+            except Exception:
+                pass
+
+    def estatisticas(self) -> Dict:
+        """Contadores de acerto/erro e ocupação"""
+        with self._lock:
+            consultas = self.contagem['hits'] + self.contagem['hits_negativos'] + self.contagem['misses']
+            acertos = consultas - self.contagem['misses']
+            return {
+                **self.contagem,
+                'entradas': len(self._entradas),
+                'taxa_acerto': round(acertos / consultas, 3) if consultas else 0.0
+            }
+
+    def _inserir(self, chave: str, entrada: Tuple[Optional[Dict], float]):
+        # Chamado com self._lock
+        self._entradas[chave] = entrada
+        self._entradas.move_to_end(chave)
+        while len(self._entradas) > self.tamanho:
+            self._entradas.popitem(last=False)
+            self.contagem['removidos_lru'] += 1
+
+    def _obter_redis(self, chave: str) -> Optional[Tuple[Optional[Dict], float]]:
+        if self._redis is None:
+            return None
+        try:
+            pipe = self._redis.pipeline()
+            pipe.get(PREFIXO_REDIS + chave)
+            pipe.ttl(PREFIXO_REDIS + chave)
+            valor, ttl = pipe.execute()
+        except Exception:
+            return None
+        if valor is None or ttl is None or ttl <= 0:
+            return None
+        return json.loads(valor), time.time() + ttl
+
+
+# Cache compartilhado pelos clientes de pedido do processo
+cache_produtos = CacheProdutos()
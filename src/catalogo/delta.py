@@ -0,0 +1,280 @@
+"""
+Coleta Incremental (Delta)
+==========================
+
+Guarda um hash do conteúdo de cada produto da última coleta (por escopo,
+ou seja, por filtro) para que a coleta seguinte exporte e envie somente o
+que é novo, alterado ou removido. As mudanças são registradas num log
+compacto em JSON Lines.
+
+Quando os produtos ainda vão ser enviados para a API, a coleta só prepara
+as mudanças (`DeltaStore.preparar`); quem envia chama `confirmar_delta`
+depois do envio bem-sucedido (ou `descartar_delta`), para que um envio
+falho não esconda as mudanças da próxima coleta.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Diretório raiz do projeto
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+DELTA_DB = Path(os.getenv('DELTA_DB', str(PROJECT_ROOT / 'data' / 'catalogo.db')))
+DELTA_LOG = Path(os.getenv('DELTA_LOG', str(PROJECT_ROOT / 'data' / 'servimed_delta.jsonl')))
+# Mudanças preparadas e nunca confirmadas (tarefa interrompida) são apagadas depois deste prazo
+DELTA_PREPARO_VALIDADE = float(os.getenv('DELTA_PREPARO_VALIDADE', str(7 * 24 * 3600)))
+
+NOVO = 'novo'
+ALTERADO = 'alterado'
+REMOVIDO = 'removido'
+
+
+def normalizar_produto(produto: Dict) -> Dict:
+    """Campos exportados com tipos estáveis (base do hash)"""
+    try:
+        preco = round(float(produto.get('preco_fabrica') or 0.0), 4)
+    except (ValueError, TypeError):
+        preco = 0.0
+    try:
+        estoque = int(produto.get('estoque') or 0)
+    except (ValueError, TypeError):
+        estoque = 0
+
+    return {
+        'gtin': str(produto.get('gtin') or produto.get('gtin_ean') or ''),
+        'codigo': str(produto.get('codigo') or ''),
+        'descricao': produto.get('descricao') or '',
+        'preco_fabrica': preco,
+        'estoque': estoque
+    }
+
+
+def hash_produto(produto: Dict) -> str:
+    """Hash do conteúdo normalizado do produto"""
+    conteudo = json.dumps(normalizar_produto(produto), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(conteudo.encode('utf-8')).hexdigest()
+
+
+def _conectar(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS delta_hashes (
+                escopo TEXT NOT NULL,
+                codigo TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                produto TEXT NOT NULL,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (escopo, codigo)
+            )
+        """)
+        # Mudanças de uma coleta aguardando confirmação (hash NULL = produto removido)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS delta_preparos (
+                preparo TEXT NOT NULL,
+                escopo TEXT NOT NULL,
+                codigo TEXT NOT NULL,
+                hash TEXT,
+                produto TEXT,
+                mudanca TEXT NOT NULL,
+                criado_em REAL NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_delta_preparos ON delta_preparos (preparo)')
+    return conn
+
+
+def _confirmar(conn: sqlite3.Connection, preparo: str, log_path: Path) -> int:
+    agora = time.time()
+    with conn:
+        registros = conn.execute(
+            'SELECT escopo, codigo, hash, produto, mudanca FROM delta_preparos WHERE preparo = ? ORDER BY rowid',
+            (preparo,)
+        ).fetchall()
+        conn.executemany(
+            'INSERT OR REPLACE INTO delta_hashes (escopo, codigo, hash, produto, atualizado_em) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(escopo, codigo, hash_, produto, agora)
+             for escopo, codigo, hash_, produto, _ in registros if hash_ is not None]
+        )
+        conn.executemany(
+            'DELETE FROM delta_hashes WHERE escopo = ? AND codigo = ?',
+            [(escopo, codigo) for escopo, codigo, hash_, _, _ in registros if hash_ is None]
+        )
+        conn.execute('DELETE FROM delta_preparos WHERE preparo = ?', (preparo,))
+
+    mudancas = [mudanca for *_, mudanca in registros if mudanca]
+    if mudancas:
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.writelines(mudanca + '\n' for mudanca in mudancas)
+    return len(registros)
+
+
+def confirmar_delta(preparo: str, db_path: Optional[Path] = None, log_path: Optional[Path] = None) -> int:
+    """
+    Aplica as mudanças preparadas por uma coleta (envio concluído)
+
+    Returns:
+        int: Produtos gravados ou removidos da referência
+    """
+    conn = _conectar(Path(db_path or DELTA_DB))
+    try:
+        return _confirmar(conn, preparo, Path(log_path or DELTA_LOG))
+    finally:
+        conn.close()
+
+
+def descartar_delta(preparo: str, db_path: Optional[Path] = None):
+    """Descarta as mudanças preparadas (envio falhou: a próxima coleta as detecta de novo)"""
+    conn = _conectar(Path(db_path or DELTA_DB))
+    try:
+        with conn:
+            conn.execute('DELETE FROM delta_preparos WHERE preparo = ?', (preparo,))
+    finally:
+        conn.close()
+
+
+class DeltaStore:
+    """
+    Hashes da última coleta de um escopo
+
+    Os hashes do escopo são carregados em memória no início; as alterações
+    só são gravadas em `salvar()` (ou `preparar()` + `confirmar_delta`), de
+    modo que uma coleta interrompida não altera a referência da próxima
+    execução.
+    """
+
+    def __init__(self, escopo: str = '', db_path: Optional[Path] = None, log_path: Optional[Path] = None):
+        self.escopo = escopo or ''
+        self.db_path = Path(db_path or DELTA_DB)
+        self.log_path = Path(log_path or DELTA_LOG)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.anteriores: Dict[str, Tuple[str, Dict]] = {}
+        self.vistos = set()
+        self.pendentes: Dict[str, Tuple[str, Dict]] = {}
+        self.removidos: List[str] = []
+        self.mudancas: List[Dict] = []
+        self.contagem = {NOVO: 0, ALTERADO: 0, REMOVIDO: 0, 'inalterado': 0}
+        self.execucao = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.preparo = uuid.uuid4().hex
+        self._lock = threading.Lock()
+
+        self._conn = _conectar(self.db_path)
+        self._carregar()
+
+    def _carregar(self):
+        for codigo, hash_, produto in self._conn.execute(
+            'SELECT codigo, hash, produto FROM delta_hashes WHERE escopo = ?', (self.escopo,)
+        ):
+            self.anteriores[codigo] = (hash_, json.loads(produto))
+
+    def classificar(self, produto: Dict) -> Optional[str]:
+        """
+        Compara o produto com a última coleta
+
+        Returns:
+            'novo', 'alterado' ou None (inalterado)
+        """
+        atual = normalizar_produto(produto)
+        codigo = atual['codigo']
+        if not codigo:
+            return NOVO
+
+        hash_ = hash_produto(atual)
+        with self._lock:
+            if codigo in self.vistos:
+                return None
+            self.vistos.add(codigo)
+
+            anterior = self.anteriores.get(codigo)
+            if anterior is not None and anterior[0] == hash_:
+                self.contagem['inalterado'] += 1
+                return None
+
+            alteracao = NOVO if anterior is None else ALTERADO
+            self.pendentes[codigo] = (hash_, atual)
+            self.contagem[alteracao] += 1
+            self._registrar_mudanca(alteracao, anterior[1] if anterior else None, atual)
+            return alteracao
+
+    def produtos_removidos(self) -> List[Dict]:
+        """
+        Produtos da última coleta que não apareceram nesta (estoque zerado)
+
+        Só deve ser chamado quando a coleta percorreu o escopo inteiro.
+        """
+        removidos = []
+        with self._lock:
+            for codigo, (_, produto) in self.anteriores.items():
+                if codigo in self.vistos or codigo in self.removidos:
+                    continue
+                removido = dict(produto, estoque=0)
+                self.removidos.append(codigo)
+                self.contagem[REMOVIDO] += 1
+                self._registrar_mudanca(REMOVIDO, produto, removido)
+                removidos.append(removido)
+        return removidos
+
+    def _registrar_mudanca(self, alteracao: str, antes: Optional[Dict], depois: Dict):
+        # Log compacto: apenas os campos que mudaram
+        mudanca = {'execucao': self.execucao, 'escopo': self.escopo,
+                   'codigo': depois['codigo'], 'alteracao': alteracao}
+        if antes is None:
+            mudanca['depois'] = depois
+        else:
+            campos = [campo for campo in depois if depois[campo] != antes.get(campo)]
+            mudanca['antes'] = {campo: antes.get(campo) for campo in campos}
+            mudanca['depois'] = {campo: depois[campo] for campo in campos}
+        self.mudancas.append(mudanca)
+
+    def preparar(self) -> str:
+        """
+        Grava as mudanças desta coleta como pendentes, sem alterar a referência
+
+        Returns:
+            str: Identificador a passar para `confirmar_delta` / `descartar_delta`
+        """
+        agora = time.time()
+        with self._lock:
+            linhas = {m['codigo']: json.dumps(m, ensure_ascii=False) for m in self.mudancas}
+            registros = [(self.preparo, self.escopo, codigo, hash_, json.dumps(produto, ensure_ascii=False),
+                          linhas.get(codigo, ''), agora)
+                         for codigo, (hash_, produto) in self.pendentes.items()]
+            registros += [(self.preparo, self.escopo, codigo, None, None, linhas.get(codigo, ''), agora)
+                          for codigo in self.removidos]
+            with self._conn:
+                self._conn.execute('DELETE FROM delta_preparos WHERE criado_em < ?',
+                                   (agora - DELTA_PREPARO_VALIDADE,))
+                self._conn.executemany(
+                    'INSERT INTO delta_preparos (preparo, escopo, codigo, hash, produto, mudanca, criado_em) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    registros
+                )
+            return self.preparo
+
+    def salvar(self) -> Dict:
+        """Grava os novos hashes e o log de mudanças; retorna a contagem"""
+        _confirmar(self._conn, self.preparar(), self.log_path)
+        with self._lock:
+            for codigo, registro in self.pendentes.items():
+                self.anteriores[codigo] = registro
+            for codigo in self.removidos:
+                self.anteriores.pop(codigo, None)
+            self.pendentes = {}
+            self.removidos = []
+            self.mudancas = []
+            self.preparo = uuid.uuid4().hex
+            return dict(self.contagem)
+
+    def fechar(self):
+        self._conn.close()
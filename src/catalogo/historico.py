@@ -0,0 +1,291 @@
+"""
+Histórico de Preço e Estoque
+============================
+
+Guarda, a cada coleta, o preço e o estoque de cada produto visto
+(codigo, preco_fabrica, estoque, ts), sem sobrescrever coletas anteriores.
+
+Organização (HISTORICO_DIR, padrão data/historico/):
+- AAAA-MM-DD.db: partição do dia, só recebe inserções. Tabela `snapshots`
+  com chave (codigo, coleta_id), ordenada por código
+- indice.db: coletas realizadas, última observação de cada produto e um
+  índice das mudanças de preço/estoque entre observações consecutivas
+
+Consultas:
+- historico(codigo): busca pela chave em cada partição do período
+- estoque_alterado(ultimas=N) / preco_alterado(ultimas=N): lidas do índice
+  de mudanças das N últimas coletas, sem reler os snapshots
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Diretório raiz do projeto
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+HISTORICO_ENABLED = os.getenv('HISTORICO', 'true').lower() == 'true'
+HISTORICO_DIR = Path(os.getenv('HISTORICO_DIR', str(PROJECT_ROOT / 'data' / 'historico')))
+
+# Limite de parâmetros por consulta IN (...) do SQLite
+LOTE_CONSULTA = 500
+
+
+def _conectar(caminho: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(caminho), timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _valores(produto) -> Optional[Tuple[str, Optional[float], Optional[int]]]:
+    """(codigo, preco_fabrica, estoque) com tipos estáveis; None sem código"""
+    codigo = str(produto.get('codigo') or '')
+    if not codigo:
+        return None
+    try:
+        preco = round(float(produto.get('preco_fabrica')), 4)
+    except (TypeError, ValueError):
+        preco = None
+    try:
+        estoque = int(produto.get('estoque'))
+    except (TypeError, ValueError):
+        estoque = None
+    return codigo, preco, estoque
+
+
+class HistoricoPrecos:
+    """Snapshots de preço/estoque por coleta, particionados por dia"""
+
+    def __init__(self, diretorio: Optional[Path] = None):
+        self.diretorio = Path(diretorio or HISTORICO_DIR)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+
+        self.coleta_id = None
+        self.ts = None
+        self.particao = None
+        self.total = 0
+        self._conn_particao = None
+        self._lock = threading.Lock()
+
+        self._indice = _conectar(self.diretorio / 'indice.db')
+        with self._indice:
+            self._indice.execute("""
+                CREATE TABLE IF NOT EXISTS coletas (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    escopo TEXT NOT NULL,
+                    particao TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    concluida INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._indice.execute('CREATE INDEX IF NOT EXISTS idx_coletas_escopo ON coletas (escopo, id)')
+            self._indice.execute("""
+                CREATE TABLE IF NOT EXISTS ultimo (
+                    codigo TEXT PRIMARY KEY,
+                    preco_fabrica REAL,
+                    estoque INTEGER,
+                    coleta_id INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._indice.execute("""
+                CREATE TABLE IF NOT EXISTS mudancas (
+                    coleta_id INTEGER NOT NULL,
+                    codigo TEXT NOT NULL,
+                    preco_anterior REAL,
+                    preco_fabrica REAL,
+                    estoque_anterior INTEGER,
+                    estoque INTEGER,
+                    PRIMARY KEY (coleta_id, codigo)
+                ) WITHOUT ROWID
+            """)
+            self._indice.execute('CREATE INDEX IF NOT EXISTS idx_mudancas_codigo ON mudancas (codigo, coleta_id)')
+
+    def _abrir_particao(self, data: str) -> sqlite3.Connection:
+        conn = _conectar(self.diretorio / f'{data}.db')
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    codigo TEXT NOT NULL,
+                    coleta_id INTEGER NOT NULL,
+                    preco_fabrica REAL,
+                    estoque INTEGER,
+                    ts REAL NOT NULL,
+                    PRIMARY KEY (codigo, coleta_id)
+                ) WITHOUT ROWID
+            """)
+        return conn
+
+    # Gravação
+
+    def iniciar_coleta(self, escopo: str = '') -> int:
+        """Abre uma nova coleta na partição do dia; retorna o id da coleta"""
+        with self._lock:
+            self.ts = time.time()
+            self.particao = time.strftime('%Y-%m-%d', time.localtime(self.ts))
+            self.total = 0
+            with self._indice:
+                cursor = self._indice.execute(
+                    'INSERT INTO coletas (escopo, particao, ts) VALUES (?, ?, ?)',
+                    (escopo or '', self.particao, self.ts)
+                )
+            self.coleta_id = cursor.lastrowid
+            if self._conn_particao is not None:
+                self._conn_particao.close()
+            self._conn_particao = self._abrir_particao(self.particao)
+            return self.coleta_id
+
+    def registrar(self, produtos: Iterable) -> int:
+        """
+        Acrescenta um lote de produtos à coleta atual
+
+        Cada produto entra uma vez por coleta. Mudanças de preço ou estoque
+        em relação à última observação do código vão para o índice.
+
+        Returns:
+            int: Produtos gravados
+        """
+        if self.coleta_id is None:
+            raise RuntimeError('iniciar_coleta() não foi chamado')
+
+        linhas = {}
+        for produto in produtos:
+            valores = _valores(produto)
+            if valores is not None:
+                linhas.setdefault(valores[0], valores)
+        if not linhas:
+            return 0
+
+        with self._lock:
+            with self._conn_particao:
+                gravados = self._conn_particao.executemany(
+                    'INSERT OR IGNORE INTO snapshots (codigo, coleta_id, preco_fabrica, estoque, ts) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(codigo, self.coleta_id, preco, estoque, self.ts)
+                     for codigo, preco, estoque in linhas.values()]
+                ).rowcount
+
+            # Última observação de cada código (consulta pela chave primária)
+            anteriores = {}
+            codigos = list(linhas)
+            for inicio in range(0, len(codigos), LOTE_CONSULTA):
+                parte = codigos[inicio:inicio + LOTE_CONSULTA]
+                marcadores = ','.join('?' * len(parte))
+                for codigo, preco, estoque in self._indice.execute(
+                    f'SELECT codigo, preco_fabrica, estoque FROM ultimo WHERE codigo IN ({marcadores})', parte
+                ):
+                    anteriores[codigo] = (preco, estoque)
+
+            mudancas = []
+            for codigo, preco, estoque in linhas.values():
+                anterior = anteriores.get(codigo)
+                if anterior is not None and anterior != (preco, estoque):
+                    mudancas.append((self.coleta_id, codigo, anterior[0], preco, anterior[1], estoque))
+
+            with self._indice:
+                self._indice.executemany(
+                    'INSERT OR IGNORE INTO mudancas (coleta_id, codigo, preco_anterior, preco_fabrica, '
+                    'estoque_anterior, estoque) VALUES (?, ?, ?, ?, ?, ?)', mudancas
+                )
+                self._indice.executemany(
+                    'INSERT OR REPLACE INTO ultimo (codigo, preco_fabrica, estoque, coleta_id) VALUES (?, ?, ?, ?)',
+                    [(codigo, preco, estoque, self.coleta_id) for codigo, preco, estoque in linhas.values()]
+                )
+                self._indice.execute('UPDATE coletas SET total = total + ? WHERE id = ?', (gravados, self.coleta_id))
+            self.total += gravados
+            return gravados
+
+    def concluir_coleta(self) -> Dict:
+        """Fecha a coleta atual; retorna o resumo"""
+        with self._lock:
+            with self._indice:
+                self._indice.execute('UPDATE coletas SET concluida = 1 WHERE id = ?', (self.coleta_id,))
+            return {'coleta': self.coleta_id, 'particao': self.particao, 'produtos': self.total}
+
+    # Consultas
+
+    def historico(self, codigo: str, desde: Optional[str] = None, ate: Optional[str] = None) -> List[Dict]:
+        """
+        Série de preço/estoque de um produto, uma linha por coleta em que apareceu
+
+        Args:
+            codigo: Código do produto
+            desde, ate: Datas AAAA-MM-DD (inclusive) que limitam as partições lidas
+        """
+        serie = []
+        for arquivo in sorted(self.diretorio.glob('????-??-??.db')):
+            data = arquivo.stem
+            if (desde and data < desde) or (ate and data > ate):
+                continue
+            conn = _conectar(arquivo)
+            try:
+                linhas = conn.execute(
+                    'SELECT coleta_id, preco_fabrica, estoque, ts FROM snapshots WHERE codigo = ? ORDER BY coleta_id',
+                    (str(codigo),)
+                ).fetchall()
+            except sqlite3.OperationalError:
+                linhas = []
+            finally:
+                conn.close()
+            serie.extend({'coleta': coleta, 'data': data, 'ts': ts, 'preco_fabrica': preco, 'estoque': estoque}
+                         for coleta, preco, estoque, ts in linhas)
+        return serie
+
+    def estoque_alterado(self, ultimas: int = 1, escopo: Optional[str] = None) -> List[Dict]:
+        """Produtos cujo estoque mudou em alguma das `ultimas` coletas"""
+        return self._alterados('estoque', ultimas, escopo)
+
+    def preco_alterado(self, ultimas: int = 1, escopo: Optional[str] = None) -> List[Dict]:
+        """Produtos cujo preço de fábrica mudou em alguma das `ultimas` coletas"""
+        return self._alterados('preco_fabrica', ultimas, escopo)
+
+    def _alterados(self, campo: str, ultimas: int, escopo: Optional[str]) -> List[Dict]:
+        anterior = 'estoque_anterior' if campo == 'estoque' else 'preco_anterior'
+        with self._lock:
+            if escopo is None:
+                ids = self._indice.execute('SELECT id FROM coletas ORDER BY id DESC LIMIT ?', (ultimas,)).fetchall()
+            else:
+                ids = self._indice.execute(
+                    'SELECT id FROM coletas WHERE escopo = ? ORDER BY id DESC LIMIT ?', (escopo, ultimas)
+                ).fetchall()
+            ids = [linha[0] for linha in ids]
+            if not ids:
+                return []
+            marcadores = ','.join('?' * len(ids))
+            linhas = self._indice.execute(
+                f'SELECT m.codigo, m.coleta_id, c.ts, m.{anterior}, m.{campo} FROM mudancas m '
+                f'JOIN coletas c ON c.id = m.coleta_id '
+                f'WHERE m.coleta_id IN ({marcadores}) AND m.{anterior} IS NOT m.{campo} '
+                f'ORDER BY m.codigo, m.coleta_id', ids
+            ).fetchall()
+
+        produtos = {}
+        for codigo, coleta, ts, de, para in linhas:
+            produto = produtos.setdefault(codigo, {'codigo': codigo, 'alteracoes': []})
+            produto['alteracoes'].append({'coleta': coleta, 'ts': ts, 'de': de, 'para': para})
+            produto[campo] = para
+        return list(produtos.values())
+
+    def coletas(self, limite: int = 10) -> List[Dict]:
+        """Coletas mais recentes"""
+        with self._lock:
+            linhas = self._indice.execute(
+                'SELECT id, escopo, particao, ts, total, concluida FROM coletas ORDER BY id DESC LIMIT ?', (limite,)
+            ).fetchall()
+        return [{'coleta': coleta, 'escopo': escopo, 'particao': particao, 'ts': ts, 'total': total,
+                 'concluida': bool(concluida)} for coleta, escopo, particao, ts, total, concluida in linhas]
+
+    def fechar(self):
+        with self._lock:
+            if self._conn_particao is not None:
+                self._conn_particao.close()
+                self._conn_particao = None
+            self._indice.close()
@@ -0,0 +1,159 @@
+"""
+Índice do Catálogo
+==================
+
+Índice SQLite de produtos por código e GTIN. As coletas dos Níveis 1/2
+preenchem o índice e o Nível 3 consulta nele antes de fazer scraping:
+somente entradas ausentes ou mais antigas que o TTL disparam nova coleta.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+# Diretório raiz do projeto
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+# Arquivo do índice e validade das entradas (segundos)
+CATALOGO_DB = Path(os.getenv('CATALOGO_DB', str(PROJECT_ROOT / 'data' / 'catalogo.db')))
+CATALOGO_TTL = int(os.getenv('CATALOGO_TTL_SEGUNDOS', '3600'))
+
+CAMPOS = ('gtin', 'codigo', 'descricao', 'preco_fabrica', 'estoque', 'atualizado_em')
+
+
+class CatalogoIndex:
+    """Índice persistente de produtos por codigo/gtin com validade configurável"""
+    
+    def __init__(self, db_path: Optional[Path] = None, ttl: Optional[int] = None):
+        self.db_path = Path(db_path or CATALOGO_DB)
+        self.ttl = CATALOGO_TTL if ttl is None else ttl
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Conexões SQLite não podem ser compartilhadas entre threads
+        self._local = threading.local()
+        self._criar_tabelas()
+    
+    def _conexao(self) -> sqlite3.Connection:
+        """Retorna a conexão da thread atual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def _criar_tabelas(self):
+        conn = self._conexao()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS produtos (
+                    codigo TEXT PRIMARY KEY,
+                    gtin TEXT,
+                    descricao TEXT,
+                    preco_fabrica REAL,
+                    estoque INTEGER,
+                    atualizado_em REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_produtos_gtin ON produtos (gtin)')
+    
+    @staticmethod
+    def _normalizar(produto: Dict, agora: float) -> Optional[tuple]:
+        """Converte produto (Scrapy ou sistema original) em linha do índice"""
+        codigo = produto.get('codigo')
+        if codigo in (None, ''):
+            return None
+        
+        gtin = produto.get('gtin') or produto.get('gtin_ean') or ''
+        
+        try:
+            preco = float(produto.get('preco_fabrica') or 0.0)
+        except (ValueError, TypeError):
+            preco = 0.0
+        try:
+            estoque = int(produto.get('estoque') or 0)
+        except (ValueError, TypeError):
+            estoque = 0
+        
+        return (str(gtin), str(codigo), produto.get('descricao') or '', preco, estoque, agora)
+    
+    def atualizar(self, produtos: Iterable[Dict]) -> int:
+        """
+        Insere ou atualiza produtos no índice
+        
+        Args:
+            produtos: Produtos no formato do Scrapy ou do sistema original
+            
+        Returns:
+            int: Quantidade de produtos gravados
+        """
+        agora = time.time()
+        linhas = [linha for linha in (self._normalizar(p, agora) for p in produtos) if linha]
+        
+        if not linhas:
+            return 0
+        
+        conn = self._conexao()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO produtos (gtin, codigo, descricao, preco_fabrica, estoque, atualizado_em) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                linhas
+            )
+        return len(linhas)
+    
+    def remover(self, codigos: Iterable[str]) -> int:
+        """
+        Remove do índice produtos que saíram do catálogo
+        
+        Returns:
+            int: Quantidade de produtos removidos
+        """
+        codigos = [(str(codigo),) for codigo in codigos if codigo not in (None, '')]
+        if not codigos:
+            return 0
+        
+        conn = self._conexao()
+        with conn:
+            cursor = conn.executemany('DELETE FROM produtos WHERE codigo = ?', codigos)
+        return cursor.rowcount
+    
+    def _buscar(self, coluna: str, valor: str, ttl: Optional[int]) -> Optional[Dict]:
+        if not valor:
+            return None
+        
+        row = self._conexao().execute(
+            f'SELECT {", ".join(CAMPOS)} FROM produtos WHERE {coluna} = ? LIMIT 1',
+            (str(valor),)
+        ).fetchone()
+        
+        if row is None:
+            return None
+        
+        # Entrada vencida conta como ausente
+        ttl = self.ttl if ttl is None else ttl
+        if ttl and time.time() - row['atualizado_em'] > ttl:
+            return None
+        
+        return dict(row)
+    
+    def buscar_por_codigo(self, codigo: str, ttl: Optional[int] = None) -> Optional[Dict]:
+        """Busca produto válido (dentro do TTL) pelo código"""
+        return self._buscar('codigo', codigo, ttl)
+    
+    def buscar_por_gtin(self, gtin: str, ttl: Optional[int] = None) -> Optional[Dict]:
+        """Busca produto válido (dentro do TTL) pelo GTIN"""
+        return self._buscar('gtin', gtin, ttl)
+    
+    def buscar(self, codigo: str = '', gtin: str = '', ttl: Optional[int] = None) -> Optional[Dict]:
+        """Busca pelo código e, se não encontrar, pelo GTIN"""
+        return self.buscar_por_codigo(codigo, ttl) or self.buscar_por_gtin(gtin, ttl)
+    
+    def total(self) -> int:
+        """Quantidade de produtos no índice"""
+        return self._conexao().execute('SELECT COUNT(*) FROM produtos').fetchone()[0]
@@ -0,0 +1,13 @@
+"""
+Controle de Coleta
+==================
+
+Estado compartilhado pelos dois motores de coleta (Scrapy e sistema original).
+"""
+
+from .arquivos import iter_produtos
+from .checkpoint import CheckpointColeta
+from .filtros import carregar_filtros
+from .produto import Produto, ProdutoOriginal, para_json
+
+__all__ = ["iter_produtos", "CheckpointColeta", "carregar_filtros", "Produto", "ProdutoOriginal", "para_json"]
@@ -0,0 +1,38 @@
+"""
+Arquivos de Resultados
+======================
+
+Leitura dos arquivos de produtos gravados pelas coletas (.json do sistema
+original e do ServimedPipeline, .jsonl do modo streaming). Não depende do
+Scrapy: é usada também pelas tarefas do Nível 2 no fallback e nas etapas de
+exportação e envio.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, Iterator
+
+
+def iter_produtos(caminho) -> Iterator[Dict]:
+    """
+    Itera os produtos de um arquivo de resultados sem depender do formato
+    
+    Arquivos .jsonl são lidos linha a linha (memória constante); arquivos
+    .json (documento com 'produtos') são carregados e percorridos.
+    
+    Args:
+        caminho: Arquivo .json ou .jsonl
+        
+    Yields:
+        dict: Um produto por vez
+    """
+    caminho = Path(caminho)
+    
+    with open(caminho, 'r', encoding='utf-8') as f:
+        if caminho.suffix == '.jsonl':
+            for linha in f:
+                linha = linha.strip()
+                if linha:
+                    yield json.loads(linha)
+        else:
+            yield from json.load(f).get('produtos', [])
@@ -0,0 +1,243 @@
+"""
+Checkpoint de Coleta
+====================
+
+Registra as páginas já concluídas de uma coleta e o cursor da paginação
+(filtro, registros por página e totalRegistros), para que uma coleta
+interrompida (token expirado, worker reiniciado) continue apenas as páginas
+que faltam.
+
+Cada execução usa dois arquivos próprios em CHECKPOINT_DIR (chave =
+motor + filtro + execução), de modo que coletas simultâneas do mesmo filtro
+não apagam o checkpoint uma da outra:
+- <chave>.json: cursor da paginação, gravado com rename atômico
+- <chave>.jsonl: uma linha por página concluída com os produtos da página;
+  uma linha truncada por queda do processo é ignorada na leitura
+
+A retomada (`carregar`) adota a execução interrompida mais recente do
+motor + filtro. Buscas de uma página usam `persistente=False`: as páginas
+ficam só em memória, sem arquivos.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from .produto import para_json
+
+# Diretório raiz do projeto
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+CHECKPOINT_DIR = Path(os.getenv('CHECKPOINT_DIR', str(PROJECT_ROOT / 'data' / 'checkpoints')))
+
+
+class CheckpointColeta:
+    """Páginas concluídas + cursor de uma execução da coleta (motor + filtro)"""
+
+    def __init__(self, motor: str, filtro: str = '', diretorio: Optional[Path] = None,
+                 execucao: Optional[str] = None, persistente: bool = True):
+        """
+        Args:
+            motor: Motor de coleta ('scrapy', 'original', ...)
+            filtro: Termo coletado
+            diretorio: Diretório dos arquivos (padrão CHECKPOINT_DIR)
+            execucao: Identificador da execução; sem ele cada instância é uma
+                execução nova e `carregar` procura a interrompida mais recente
+            persistente: False mantém as páginas só em memória (buscas de uma página)
+        """
+        self.motor = motor
+        self.filtro = filtro or ''
+        self.diretorio = Path(diretorio or CHECKPOINT_DIR)
+        self.persistente = persistente
+        self.execucao_fixa = execucao is not None
+        self.iniciado_em = time.time()
+
+        self.slug = re.sub(r'[^a-zA-Z0-9_-]+', '_', self.filtro).strip('_') or 'todos'
+        self._definir_execucao(execucao or f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}")
+
+        self.cursor: Dict = {}
+        self.paginas_concluidas = set()
+        self._lock = threading.Lock()
+
+    def _definir_execucao(self, execucao: str):
+        self.execucao = execucao
+        self.arquivo_cursor = self.diretorio / f'{self.motor}_{self.slug}.{execucao}.json'
+        self.arquivo_paginas = self.diretorio / f'{self.motor}_{self.slug}.{execucao}.jsonl'
+
+    def _execucoes(self) -> List[Path]:
+        """Arquivos de páginas das execuções deste motor + filtro, do mais recente ao mais antigo"""
+        arquivos = []
+        for arquivo in self.diretorio.glob(f'{self.motor}_{self.slug}.*.jsonl'):
+            try:
+                arquivos.append((arquivo.stat().st_mtime, arquivo))
+            except OSError:
+                continue
+        return [arquivo for _, arquivo in sorted(arquivos, reverse=True)]
+
+    def carregar(self) -> bool:
+        """
+        Carrega um checkpoint existente
+
+        Sem execução informada, adota a execução interrompida mais recente
+        do motor + filtro (as páginas seguintes vão para os mesmos arquivos).
+
+        Returns:
+            bool: True se havia páginas concluídas para retomar
+        """
+        self.cursor = {}
+        self.paginas_concluidas = set()
+
+        if not self.persistente:
+            return False
+        if not self.execucao_fixa:
+            anteriores = self._execucoes()
+            if anteriores:
+                # <motor>_<slug>.<execucao>.jsonl
+                self._definir_execucao(anteriores[0].name[:-len('.jsonl')].rsplit('.', 1)[1])
+
+        if self.arquivo_cursor.exists():
+            try:
+                with open(self.arquivo_cursor, 'r', encoding='utf-8') as f:
+                    self.cursor = json.load(f)
+            except (OSError, ValueError):
+                self.cursor = {}
+
+        for pagina, _ in self._ler_paginas():
+            self.paginas_concluidas.add(pagina)
+
+        return bool(self.paginas_concluidas)
+
+    def definir_cursor(self, registros_por_pagina: int, total_registros: int):
+        """
+        Registra a paginação informada pela API
+
+        Se o tamanho de página mudou desde o checkpoint, as páginas antigas
+        não correspondem mais aos mesmos produtos e são descartadas.
+        """
+        with self._lock:
+            anterior = self.cursor.get('registros_por_pagina')
+            if anterior is not None and anterior != registros_por_pagina:
+                print(f"Checkpoint {self.arquivo_cursor.name}: tamanho de página mudou "
+                      f"({anterior} -> {registros_por_pagina}), recomeçando")
+                self._remover_arquivos()
+                self.paginas_concluidas = set()
+            elif self.cursor.get('total_registros') not in (None, total_registros):
+                print(f"Checkpoint {self.arquivo_cursor.name}: totalRegistros mudou "
+                      f"({self.cursor['total_registros']} -> {total_registros})")
+
+            novo = {
+                'motor': self.motor,
+                'filtro': self.filtro,
+                'registros_por_pagina': registros_por_pagina,
+                'total_registros': total_registros,
+                'criado_em': self.cursor.get('criado_em') or time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            if {k: v for k, v in self.cursor.items() if k != 'atualizado_em'} == novo:
+                return
+
+            novo['atualizado_em'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.cursor = novo
+            if not self.persistente:
+                return
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+            tmp = self.arquivo_cursor.with_suffix('.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.cursor, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.arquivo_cursor)
+
+    def registrar_pagina(self, pagina: int, produtos: List[Dict]):
+        """Marca uma página como concluída, gravando seus produtos"""
+        if not self.persistente:
+            with self._lock:
+                self.paginas_concluidas.add(pagina)
+            return
+
+        linha = json.dumps({'pagina': pagina, 'produtos': produtos}, ensure_ascii=False, default=para_json)
+        with self._lock:
+            if pagina in self.paginas_concluidas:
+                return
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+            with open(self.arquivo_paginas, 'a', encoding='utf-8') as f:
+                f.write(linha + '\n')
+            self.paginas_concluidas.add(pagina)
+
+    def total_paginas(self) -> Optional[int]:
+        """Total de páginas segundo o cursor (None se ainda desconhecido)"""
+        total = self.cursor.get('total_registros')
+        por_pagina = self.cursor.get('registros_por_pagina')
+        if total is None or not por_pagina:
+            return None
+        return (total + por_pagina - 1) // por_pagina
+
+    def paginas_pendentes(self, ultima_pagina: int, primeira_pagina: int = 1) -> List[int]:
+        """Páginas de `primeira_pagina` até `ultima_pagina` ainda não concluídas"""
+        return [p for p in range(primeira_pagina, ultima_pagina + 1) if p not in self.paginas_concluidas]
+
+    def produtos(self) -> Iterator[Dict]:
+        """Produtos das páginas concluídas, em ordem de página"""
+        paginas = self.produtos_por_pagina()
+        for pagina in sorted(paginas):
+            yield from paginas[pagina]
+
+    def produtos_por_pagina(self) -> Dict[int, List[Dict]]:
+        """Produtos das páginas concluídas, por número de página"""
+        paginas = {}
+        for pagina, produtos in self._ler_paginas():
+            paginas.setdefault(pagina, produtos)
+        return paginas
+
+    def concluir(self):
+        """
+        Coleta completa: o checkpoint não é mais necessário
+
+        Execuções interrompidas do mesmo motor + filtro paradas desde antes
+        desta começar também são removidas - a coleta completa as substitui.
+        Execuções ainda em andamento (gravando) não são tocadas.
+        """
+        with self._lock:
+            self._remover_arquivos()
+            if self.persistente and not self.execucao_fixa:
+                for arquivo in self._execucoes():
+                    try:
+                        parada = arquivo.stat().st_mtime < self.iniciado_em
+                    except OSError:
+                        continue
+                    if parada:
+                        for antigo in (arquivo, arquivo.with_suffix('.json')):
+                            try:
+                                antigo.unlink()
+                            except FileNotFoundError:
+                                pass
+            self.cursor = {}
+            self.paginas_concluidas = set()
+
+    def descartar(self):
+        """Remove os arquivos desta execução (recomeço pedido explicitamente)"""
+        with self._lock:
+            self._remover_arquivos()
+            self.cursor = {}
+            self.paginas_concluidas = set()
+
+    def _ler_paginas(self):
+        if not self.arquivo_paginas.exists():
+            return
+        with open(self.arquivo_paginas, 'r', encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    # Última linha incompleta (processo interrompido durante a escrita)
+                    continue
+                yield registro['pagina'], registro.get('produtos', [])
+
+    def _remover_arquivos(self):
+        for arquivo in (self.arquivo_cursor, self.arquivo_paginas):
+            try:
+                arquivo.unlink()
+            except FileNotFoundError:
+                pass
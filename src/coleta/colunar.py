@@ -0,0 +1,140 @@
+"""
+Exportação Colunar
+==================
+
+Grava os produtos coletados em Parquet ou Arrow IPC (Feather v2), com
+colunas tipadas, para as análises de preço:
+
+- gtin, codigo, descricao: string
+- preco_fabrica: float64 (nulo quando ausente)
+- estoque: int64 (nulo quando ausente)
+- coletado_em: timestamp UTC do snapshot (mesmo valor para toda a coleta)
+
+Os produtos são acumulados em colunas e gravados em lotes (row groups /
+record batches) de EXPORT_COLUNAR_LOTE linhas; o arquivo é escrito num
+temporário e publicado com rename atômico ao final.
+
+O Arrow IPC é gravado sem compressão para leitura sem cópia:
+
+    import pyarrow as pa
+    tabela = pa.ipc.open_file(pa.memory_map('data/servimed_produtos_scrapy.arrow')).read_all()
+
+Requer pyarrow (opcional: `pip install pyarrow`).
+"""
+
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional (só para exportação colunar)
+    pa = None
+    pq = None
+
+load_dotenv()
+
+EXPORT_COLUNAR_LOTE = int(os.getenv('EXPORT_COLUNAR_LOTE', '10000'))
+
+FORMATOS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def disponivel() -> bool:
+    """True se o pyarrow está instalado"""
+    return pa is not None
+
+
+def esquema():
+    """Esquema Arrow dos snapshots de produtos"""
+    return pa.schema([
+        ('gtin', pa.string()),
+        ('codigo', pa.string()),
+        ('descricao', pa.string()),
+        ('preco_fabrica', pa.float64()),
+        ('estoque', pa.int64()),
+        ('coletado_em', pa.timestamp('ms', tz='UTC')),
+    ])
+
+
+def _texto(valor) -> Optional[str]:
+    return None if valor is None else str(valor)
+
+
+def _numero(valor, tipo):
+    try:
+        return None if valor is None or valor == '' else tipo(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+class ExportadorColunar:
+    """Escreve um snapshot de produtos em Parquet ou Arrow IPC, em lotes"""
+
+    def __init__(self, caminho, formato: str = 'parquet', lote: int = EXPORT_COLUNAR_LOTE,
+                 coletado_em: Optional[datetime] = None):
+        if pa is None:
+            raise RuntimeError('pyarrow não instalado - exportação colunar indisponível')
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato colunar desconhecido: {formato}')
+
+        self.caminho = Path(caminho)
+        self.formato = formato
+        self.lote = max(1, lote)
+        self.coletado_em = coletado_em or datetime.now(timezone.utc)
+        self.esquema = esquema()
+        self.total = 0
+
+        self._colunas: Dict[str, list] = {campo: [] for campo in self.esquema.names if campo != 'coletado_em'}
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self.caminho_tmp = self.caminho.with_name(f'{self.caminho.name}.{os.getpid()}.{id(self)}.tmp')
+        if formato == 'parquet':
+            self._escritor = pq.ParquetWriter(str(self.caminho_tmp), self.esquema, compression='zstd')
+        else:
+            self._arquivo = pa.OSFile(str(self.caminho_tmp), 'wb')
+            self._escritor = pa.ipc.new_file(self._arquivo, self.esquema)
+
+    def adicionar(self, produto):
+        """Acrescenta um produto (dict, item ou registro; aceita gtin ou gtin_ean)"""
+        gtin = produto.get('gtin')
+        self._colunas['gtin'].append(_texto(gtin if gtin is not None else produto.get('gtin_ean')))
+        self._colunas['codigo'].append(_texto(produto.get('codigo')))
+        self._colunas['descricao'].append(_texto(produto.get('descricao')))
+        self._colunas['preco_fabrica'].append(_numero(produto.get('preco_fabrica'), float))
+        self._colunas['estoque'].append(_numero(produto.get('estoque'), int))
+        if len(self._colunas['codigo']) >= self.lote:
+            self.flush()
+
+    def flush(self):
+        """Grava as linhas pendentes como um row group / record batch"""
+        quantidade = len(self._colunas['codigo'])
+        if not quantidade:
+            return
+        colunas = [pa.array(self._colunas[campo.name], type=campo.type) if campo.name != 'coletado_em'
+                   else pa.array([self.coletado_em] * quantidade, type=campo.type)
+                   for campo in self.esquema]
+        self._escritor.write_batch(pa.RecordBatch.from_arrays(colunas, schema=self.esquema))
+        self.total += quantidade
+        for valores in self._colunas.values():
+            valores.clear()
+
+    def fechar(self) -> Path:
+        """Grava o restante e publica o arquivo final"""
+        self.flush()
+        self._escritor.close()
+        if self.formato == 'arrow':
+            self._arquivo.close()
+        os.replace(self.caminho_tmp, self.caminho)
+        return self.caminho
+
+    def descartar(self):
+        """Fecha e remove o temporário (coleta com erro)"""
+        try:
+            self._escritor.close()
+            if self.formato == 'arrow':
+                self._arquivo.close()
+        finally:
+            self.caminho_tmp.unlink(missing_ok=True)
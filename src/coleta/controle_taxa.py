@@ -0,0 +1,158 @@
+"""
+Controle Adaptativo de Taxa
+===========================
+
+Controlador AIMD (aumento aditivo, redução multiplicativa) compartilhado
+pelos dois motores de coleta para cada host do Servimed.
+
+Em vez de um atraso fixo entre requisições, o controlador ajusta dois
+parâmetros a partir das respostas:
+- concorrência: requisições simultâneas permitidas
+- intervalo: espaçamento mínimo entre o início de duas requisições
+
+Respostas rápidas e sem erro aumentam a concorrência aos poucos e reduzem
+o intervalo; 403/429/5xx ou erros de rede cortam a concorrência pela
+metade e dobram o intervalo. Latência acima do alvo interrompe o aumento
+e reduz levemente a concorrência. Um cabeçalho Retry-After pausa o host.
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONTROLE_TAXA_ENABLED = os.getenv('CONTROLE_TAXA', 'true').lower() == 'true'
+TAXA_CONCORRENCIA_INICIAL = float(os.getenv('TAXA_CONCORRENCIA_INICIAL', '2'))
+TAXA_CONCORRENCIA_MIN = float(os.getenv('TAXA_CONCORRENCIA_MIN', '1'))
+TAXA_CONCORRENCIA_MAX = float(os.getenv('TAXA_CONCORRENCIA_MAX', '8'))
+TAXA_INTERVALO_INICIAL = float(os.getenv('TAXA_INTERVALO_INICIAL', '0.5'))
+TAXA_INTERVALO_MAX = float(os.getenv('TAXA_INTERVALO_MAX', '30'))
+TAXA_LATENCIA_ALVO = float(os.getenv('TAXA_LATENCIA_ALVO', '3'))
+
+# Respostas que indicam bloqueio ou sobrecarga do servidor
+STATUS_RECUO = {403, 429}
+
+# Fatores do AIMD
+FATOR_REDUCAO = 0.5
+FATOR_LATENCIA = 0.9
+FATOR_INTERVALO = 0.8
+
+
+def status_de_recuo(status: Optional[int]) -> bool:
+    """True para erro de rede (None), 403, 429 e 5xx"""
+    return status is None or status in STATUS_RECUO or status >= 500
+
+
+class ControladorTaxa:
+    """Concorrência e intervalo adaptativos de um host (thread-safe)"""
+
+    def __init__(self, host: str = '', concorrencia: float = TAXA_CONCORRENCIA_INICIAL,
+                 minimo: float = TAXA_CONCORRENCIA_MIN, maximo: float = TAXA_CONCORRENCIA_MAX,
+                 intervalo: float = TAXA_INTERVALO_INICIAL, intervalo_max: float = TAXA_INTERVALO_MAX,
+                 latencia_alvo: float = TAXA_LATENCIA_ALVO):
+        self.host = host
+        self.minimo = max(1.0, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.concorrencia = min(max(concorrencia, self.minimo), self.maximo)
+        self.intervalo = intervalo
+        self.intervalo_inicial = intervalo
+        self.intervalo_max = intervalo_max
+        self.latencia_alvo = latencia_alvo
+
+        self.em_voo = 0
+        self.proximo_inicio = 0.0
+        self.latencia_media = None
+        self.contagem = {'ok': 0, 'recuo': 0, 'lenta': 0}
+        self._cond = threading.Condition()
+
+    def adquirir(self) -> float:
+        """
+        Aguarda uma vaga de concorrência e o intervalo mínimo
+
+        Returns:
+            float: Instante de início, a ser passado para `liberar()`
+        """
+        with self._cond:
+            while True:
+                agora = time.monotonic()
+                if self.em_voo < int(self.concorrencia) and agora >= self.proximo_inicio:
+                    break
+                espera = self.proximo_inicio - agora if self.em_voo < int(self.concorrencia) else None
+                self._cond.wait(espera)
+
+            self.em_voo += 1
+            self.proximo_inicio = agora + self.intervalo
+            return agora
+
+    def liberar(self, inicio: float, status: Optional[int], retry_after: Optional[str] = None):
+        """
+        Registra o resultado da requisição e ajusta concorrência e intervalo
+
+        Args:
+            inicio: Valor retornado por `adquirir()`
+            status: Status HTTP (None para erro de rede/timeout)
+            retry_after: Cabeçalho Retry-After da resposta, se houver
+        """
+        latencia = time.monotonic() - inicio
+        with self._cond:
+            self.em_voo = max(0, self.em_voo - 1)
+
+            if status_de_recuo(status):
+                self.contagem['recuo'] += 1
+                self.concorrencia = max(self.minimo, self.concorrencia * FATOR_REDUCAO)
+                self.intervalo = min(self.intervalo_max,
+                                     max(self.intervalo * 2, self.intervalo_inicial, 0.1))
+                pausa = _segundos_retry_after(retry_after)
+                self.proximo_inicio = max(self.proximo_inicio, time.monotonic() + max(pausa, self.intervalo))
+            else:
+                self.latencia_media = latencia if self.latencia_media is None \
+                    else 0.8 * self.latencia_media + 0.2 * latencia
+                if self.latencia_media > self.latencia_alvo:
+                    self.contagem['lenta'] += 1
+                    self.concorrencia = max(self.minimo, self.concorrencia * FATOR_LATENCIA)
+                else:
+                    self.contagem['ok'] += 1
+                    # +1 a cada "janela" completa de respostas saudáveis
+                    self.concorrencia = min(self.maximo, self.concorrencia + 1.0 / self.concorrencia)
+                    self.intervalo = self.intervalo * FATOR_INTERVALO if self.intervalo > 0.01 else 0.0
+
+            self._cond.notify_all()
+
+    def estatisticas(self) -> Dict:
+        """Estado atual do controlador"""
+        with self._cond:
+            return {
+                'host': self.host,
+                'concorrencia': round(self.concorrencia, 2),
+                'intervalo': round(self.intervalo, 3),
+                'latencia_media': round(self.latencia_media, 3) if self.latencia_media is not None else None,
+                'em_voo': self.em_voo,
+                **self.contagem
+            }
+
+
+def _segundos_retry_after(valor: Optional[str]) -> float:
+    """Retry-After em segundos (datas HTTP não são suportadas pela API)"""
+    try:
+        return max(0.0, float(valor)) if valor else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+_controladores: Dict[str, ControladorTaxa] = {}
+_lock = threading.Lock()
+
+
+def controlador_para(url: str) -> ControladorTaxa:
+    """Controlador do host da URL, compartilhado por todo o processo"""
+    host = urlsplit(url).netloc or url
+    with _lock:
+        controlador = _controladores.get(host)
+        if controlador is None:
+            controlador = _controladores[host] = ControladorTaxa(host)
+        return controlador
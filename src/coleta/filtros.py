@@ -0,0 +1,33 @@
+"""
+Termos de Busca
+===============
+
+Lista de termos de uma coleta com vários filtros, vinda da linha de comando
+(separados por vírgula), de um arquivo (um termo por linha) ou de uma
+tarefa enfileirada. Termos repetidos são ignorados, mantendo a ordem.
+"""
+
+from typing import Iterable, List, Optional, Union
+
+
+def carregar_filtros(filtros: Union[str, Iterable[str], None] = None,
+                     arquivo_filtros: Optional[str] = None, filtro: str = '') -> List[str]:
+    """
+    Lista de termos de busca sem repetição, na ordem informada
+
+    Args:
+        filtros: Lista ou string separada por vírgula/quebra de linha
+        arquivo_filtros: Arquivo com um termo por linha (# inicia comentário)
+        filtro: Termo único (usado quando nenhuma lista é informada)
+    """
+    termos = []
+    if isinstance(filtros, str):
+        filtros = filtros.split('\n') if '\n' in filtros else filtros.split(',')
+    termos.extend(filtros or [])
+
+    if arquivo_filtros:
+        with open(arquivo_filtros, 'r', encoding='utf-8') as f:
+            termos.extend(linha for linha in f if not linha.lstrip().startswith('#'))
+
+    termos = list(dict.fromkeys(t.strip() for t in termos if t and t.strip()))
+    return termos or [filtro or '']
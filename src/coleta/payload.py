@@ -0,0 +1,111 @@
+"""
+Payload da Busca de Produtos
+============================
+
+Corpo da requisição /api/carrinho/oculto montado uma única vez por coleta.
+
+Dos 22 campos da busca só `filtro` e `pagina` mudam entre requisições: o
+restante é serializado no construtor e cada página apenas concatena os
+bytes (mesma ordem de campos capturada no DevTools). Os identificadores da
+conta (clienteId, codigoUsuario, users) vêm do .env ou são informados
+explicitamente - um mesmo processo pode ter um payload por conta.
+"""
+
+import os
+import json
+from typing import Dict, Iterable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REGISTROS_POR_PAGINA = 25
+SITE_VERSION = os.getenv('SITE_VERSION', '4.0.27')
+API_ENDPOINT = os.getenv('API_ENDPOINT', '/api/carrinho/oculto')
+
+
+def _ids_usuarios(valor) -> list:
+    """Converte '1,2' ou [1, 2] em lista de inteiros"""
+    if isinstance(valor, str):
+        valor = valor.split(',')
+    return [int(str(u).strip()) for u in valor or [] if str(u).strip().isdigit()]
+
+
+class PayloadBusca:
+    """Fábrica do corpo da busca de produtos, pré-codificado por conta"""
+
+    def __init__(self, cliente_id: int, codigo_usuario: int, users: Iterable[int],
+                 registros_por_pagina: int = REGISTROS_POR_PAGINA):
+        self.cliente_id = int(cliente_id)
+        self.codigo_usuario = int(codigo_usuario)
+        self.users = _ids_usuarios(users)
+        self.registros_por_pagina = registros_por_pagina
+
+        # Campos após "pagina", na ordem original; serializados uma vez
+        restante = {
+            "registrosPorPagina": registros_por_pagina,
+            "ordenarDecrescente": False,
+            "colunaOrdenacao": "nenhuma",
+            "clienteId": self.cliente_id,
+            "tipoVendaId": 1,
+            "fabricanteIdFiltro": 0,
+            "pIIdFiltro": 0,
+            "cestaPPFiltro": False,
+            "codigoExterno": 0,
+            "codigoUsuario": self.codigo_usuario,
+            "promocaoSelecionada": "",
+            "indicadorTipoUsuario": "CLI",
+            "kindUser": 0,
+            "xlsx": [],
+            "principioAtivo": "",
+            "master": False,
+            "kindSeller": 0,
+            "grupoEconomico": "",
+            "users": self.users,
+            "list": True
+        }
+        self._sufixo = b',' + json.dumps(restante, separators=(',', ':')).encode('utf-8')[1:]
+        self._prefixos: Dict[str, bytes] = {}
+
+    @classmethod
+    def do_ambiente(cls, cliente_id=None, codigo_usuario=None, users=None,
+                    registros_por_pagina: int = REGISTROS_POR_PAGINA) -> 'PayloadBusca':
+        """
+        Payload da conta configurada no .env (CLIENT_ID, LOGGED_USER, USERS)
+
+        Raises:
+            ValueError: Identificador da conta ausente (nem informado nem no .env) -
+                uma busca com conta 0 só falharia depois, na API
+        """
+        cliente_id = cliente_id or os.getenv('CLIENT_ID')
+        codigo_usuario = codigo_usuario or os.getenv('LOGGED_USER')
+        users = users if users is not None else os.getenv('USERS')
+
+        faltando = [nome for nome, valor in (('CLIENT_ID', cliente_id), ('LOGGED_USER', codigo_usuario),
+                                             ('USERS', users)) if not valor]
+        if faltando:
+            raise ValueError(f"Conta da busca incompleta no .env: {', '.join(faltando)}")
+
+        return cls(
+            cliente_id=cliente_id,
+            codigo_usuario=codigo_usuario,
+            users=users,
+            registros_por_pagina=registros_por_pagina
+        )
+
+    def corpo(self, pagina: int, filtro: str = '') -> bytes:
+        """Corpo JSON (bytes) da página informada"""
+        prefixo = self._prefixos.get(filtro)
+        if prefixo is None:
+            prefixo = b'{"filtro":' + json.dumps(filtro).encode('utf-8') + b',"pagina":'
+            self._prefixos[filtro] = prefixo
+        return prefixo + str(int(pagina)).encode('ascii') + self._sufixo
+
+    def dados(self, pagina: int, filtro: str = '') -> Dict:
+        """Payload como dicionário (logs e depuração)"""
+        return json.loads(self.corpo(pagina, filtro))
+
+
+def url_busca(base_url: str) -> str:
+    """URL da busca de produtos para a base informada"""
+    return f'{base_url}{API_ENDPOINT}?siteVersion={SITE_VERSION}'
@@ -0,0 +1,118 @@
+"""
+Registro Compacto de Produto
+============================
+
+Representação em memória dos produtos coletados, usada pelos dois motores:
+lista do sistema original (`todos_produtos`), ServimedPipeline,
+CeleryPipeline e coletor do wrapper.
+
+Cada produto como dict custa algumas centenas de bytes, e uma coleta
+completa mantinha várias cópias de cada um. O registro usa __slots__ (sem
+__dict__ por instância) e interna descrições e datas de coleta, que se
+repetem entre produtos, páginas e listas.
+
+Continua acessível como mapping (`produto['codigo']`, `produto.get(...)`,
+`dict(produto)`, `{**produto}`); para gravar em JSON use `default=para_json`.
+"""
+
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional
+
+
+def _internar(valor):
+    return sys.intern(valor) if type(valor) is str else valor
+
+
+class Produto(Mapping):
+    """Produto no formato do Scrapy / API de callback"""
+
+    __slots__ = ('gtin', 'codigo', 'descricao', 'preco_fabrica', 'estoque',
+                 'data_coleta', 'filtros', 'alteracao')
+
+    # Nome do campo de código de barras na exportação
+    CHAVE_GTIN = 'gtin'
+    # Campos que só aparecem no mapping quando preenchidos
+    OPCIONAIS = ('data_coleta', 'filtros', 'alteracao')
+
+    def __init__(self, gtin: Any = '', codigo: Any = '', descricao: Any = '', preco_fabrica: Any = 0.0,
+                 estoque: Any = 0, data_coleta: Optional[str] = None, filtros: Optional[list] = None,
+                 alteracao: Optional[str] = None):
+        self.gtin = gtin
+        self.codigo = codigo
+        self.descricao = _internar(descricao)
+        self.preco_fabrica = preco_fabrica
+        self.estoque = estoque
+        self.data_coleta = _internar(data_coleta)
+        # A lista não é copiada: o spider acrescenta termos que acharem o código depois
+        self.filtros = filtros or None
+        self.alteracao = alteracao
+
+    @classmethod
+    def de_mapping(cls, dados) -> 'Produto':
+        """Registro a partir de um item ou dict (aceita gtin ou gtin_ean)"""
+        return cls(
+            gtin=dados.get('gtin', dados.get('gtin_ean', '')),
+            codigo=dados.get('codigo', ''),
+            descricao=dados.get('descricao', ''),
+            preco_fabrica=dados.get('preco_fabrica', 0.0),
+            estoque=dados.get('estoque', 0),
+            data_coleta=dados.get('data_coleta'),
+            filtros=dados.get('filtros'),
+            alteracao=dados.get('alteracao')
+        )
+
+    def _chaves(self) -> Iterator[str]:
+        yield self.CHAVE_GTIN
+        yield from ('codigo', 'descricao', 'preco_fabrica', 'estoque')
+        for campo in self.OPCIONAIS:
+            if getattr(self, campo) is not None:
+                yield campo
+
+    def __getitem__(self, chave: str):
+        if chave in ('gtin', 'gtin_ean'):
+            return self.gtin
+        if chave not in Produto.__slots__:
+            raise KeyError(chave)
+        valor = getattr(self, chave)
+        if valor is None and chave in self.OPCIONAIS:
+            raise KeyError(chave)
+        return valor
+
+    def __setitem__(self, chave: str, valor):
+        if chave == 'gtin_ean':
+            chave = 'gtin'
+        if chave not in Produto.__slots__:
+            raise KeyError(chave)
+        setattr(self, chave, _internar(valor) if chave in ('descricao', 'data_coleta') else valor)
+
+    def __iter__(self) -> Iterator[str]:
+        return self._chaves()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._chaves())
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    def para_dict(self) -> Dict:
+        """Cópia em dict (com a lista de filtros copiada)"""
+        dados = dict(self)
+        if 'filtros' in dados:
+            dados['filtros'] = list(dados['filtros'])
+        return dados
+
+
+class ProdutoOriginal(Produto):
+    """Produto do sistema original: exporta `gtin_ean` e `data_coleta`"""
+
+    __slots__ = ()
+
+    CHAVE_GTIN = 'gtin_ean'
+
+
+def para_json(objeto):
+    """`default` do json.dump/json.dumps para listas com registros"""
+    if isinstance(objeto, Produto):
+        return objeto.para_dict()
+    raise TypeError(f'Objeto do tipo {type(objeto).__name__} não é serializável em JSON')
@@ -32,12 +32,18 @@ except Exception as e:
 # Configuração Redis
 REDIS_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 
+# Filas das etapas da coleta encadeada (src/nivel2/etapas.py) - por padrão
+# todas na fila 'celery'; filas próprias permitem workers dimensionados por etapa
+FILA_COLETA = os.getenv('CELERY_FILA_COLETA', 'celery')
+FILA_EXPORTACAO = os.getenv('CELERY_FILA_EXPORTACAO', 'celery')
+FILA_ENVIO = os.getenv('CELERY_FILA_ENVIO', 'celery')
+
 # Criar app Celery
 app = Celery(
     'servimed_scraper_simple',
     broker=REDIS_URL,
     backend=REDIS_URL,
-    include=['src.nivel2.tasks', 'src.nivel3.tasks'] 
+    include=['src.nivel2.tasks', 'src.nivel2.etapas', 'src.nivel3.tasks']
 )
 
 # Configurações otimizadas para Windows
@@ -53,6 +59,12 @@ app.conf.update(
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=50,
     result_expires=3600,  # 1 hora
+    task_routes={
+        'src.nivel2.etapas.processar_coleta_encadeada': {'queue': FILA_COLETA},
+        'src.nivel2.etapas.coletar_fatia': {'queue': FILA_COLETA},
+        'src.nivel2.etapas.exportar_coleta': {'queue': FILA_EXPORTACAO},
+        'src.nivel2.etapas.enviar_coleta': {'queue': FILA_ENVIO},
+    },
     worker_log_format='[%(asctime)s: %(levelname)s/%(processName)s] %(message)s',
     worker_task_log_format='[%(asctime)s: %(levelname)s/%(processName)s][%(task_name)s(%(task_id)s)] %(message)s',
 )
@@ -0,0 +1,443 @@
+"""
+Coleta em Etapas Encadeadas
+===========================
+
+Versão da tarefa de scraping do Nível 2 dividida em etapas independentes,
+ligadas por um chord do Celery:
+
+    processar_coleta_encadeada -> [coletar_fatia x N] -> exportar_coleta -> enviar_coleta
+
+- processar_coleta_encadeada: coordenador; lê a primeira página de cada
+  termo, calcula o total de páginas a partir de totalRegistros e divide as
+  páginas em fatias, dimensionadas pelas vagas dos workers da fila de
+  coleta (entre COLETA_PAGINAS_MIN_FATIA e COLETA_PAGINAS_POR_FATIA)
+- coletar_fatia: coleta um intervalo de páginas com o Scrapy (sistema
+  original como fallback) e grava os produtos no arquivo da fatia (etapa
+  de rede)
+- exportar_coleta: junta as fatias sem repetir códigos e grava o arquivo
+  consolidado, o snapshot colunar e o histórico de preços (CPU e disco)
+- enviar_coleta: envia o arquivo consolidado em lotes para a API de
+  callback (etapa de rede)
+
+As etapas trocam apenas caminhos de arquivo (em COLETA_ARTEFATOS_DIR, que
+precisa ser visível para todos os workers) e cada uma repete só o próprio
+trabalho: uma fatia refaz apenas as páginas que faltam (checkpoint) e o
+envio reenvia apenas os lotes que falharam.
+
+A cadeia é opcional: TaskQueueClient.enqueue_scraping_task(encadeado=True)
+ou `main.py --nivel 2 --encadeado`. Coletas com delta ou resume seguem na
+tarefa única (processar_scraping_simple).
+
+Cada etapa tem sua fila (CELERY_FILA_COLETA, CELERY_FILA_EXPORTACAO,
+CELERY_FILA_ENVIO - ver task_routes em celery_app), para workers dedicados:
+
+    celery -A src.nivel2.celery_app worker -Q coleta -c 8 -n coleta@%h
+    celery -A src.nivel2.celery_app worker -Q exportacao -c 2 -n exportacao@%h
+
+As fatias são confirmadas só ao terminar (acks_late): com prefetch 1, um
+worker ocupado não reserva a próxima fatia, que fica para quem estiver
+livre - novos nós passam a dividir a coleta assim que sobem. A taxa somada
+de todos eles é limitada pelo orçamento do cluster no Redis
+(COLETA_ORCAMENTO_RPS, ver src/rede/orcamento.py).
+"""
+
+import os
+import json
+import time
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from celery import chord, group
+from dotenv import load_dotenv
+
+from src.nivel2.celery_app import app, FILA_COLETA
+from src.coleta import Produto, carregar_filtros, iter_produtos
+from src.rede import estatisticas_conexoes
+
+load_dotenv()
+
+# Diretório raiz do projeto
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+COLETA_PAGINAS_POR_FATIA = int(os.getenv('COLETA_PAGINAS_POR_FATIA', '20'))
+COLETA_PAGINAS_MIN_FATIA = int(os.getenv('COLETA_PAGINAS_MIN_FATIA', '5'))
+COLETA_ARTEFATOS_DIR = Path(os.getenv('COLETA_ARTEFATOS_DIR', str(PROJECT_ROOT / 'data' / 'coletas')))
+
+# Tentativas de cada etapa (segundos entre tentativas)
+TENTATIVAS_ETAPA = 2
+INTERVALO_TENTATIVA = 30
+
+
+class ColetaSemProdutos(RuntimeError):
+    """Todas as fatias falharam: não há o que exportar nem enviar"""
+
+
+def dividir_paginas(total_paginas: int, max_pages: Optional[int],
+                    paginas_por_fatia: int = COLETA_PAGINAS_POR_FATIA) -> List[List[int]]:
+    """
+    Intervalos [inicio, fim] de páginas de cada fatia
+
+    Args:
+        total_paginas: Páginas do termo segundo a API
+        max_pages: Última página coletada (None/0 = todas)
+        paginas_por_fatia: Páginas por fatia
+    """
+    ultima = min(total_paginas, max_pages) if max_pages else total_paginas
+    passo = max(1, paginas_por_fatia)
+    return [[inicio, min(inicio + passo - 1, ultima)] for inicio in range(1, ultima + 1, passo)]
+
+
+def paginas_por_fatia(paginas: int, vagas: int) -> int:
+    """
+    Tamanho das fatias para ocupar todas as vagas de coleta
+
+    Divide as páginas igualmente entre as vagas, sem passar de
+    COLETA_PAGINAS_POR_FATIA nem ficar abaixo de COLETA_PAGINAS_MIN_FATIA
+    (cada fatia paga a partida de um crawler).
+    """
+    por_vaga = -(-paginas // max(1, vagas))
+    return max(1, min(COLETA_PAGINAS_POR_FATIA, max(COLETA_PAGINAS_MIN_FATIA, por_vaga)))
+
+
+def vagas_coleta(timeout: float = 1.0) -> int:
+    """Processos de worker consumindo a fila de coleta (1 se nenhum responder)"""
+    try:
+        inspecao = app.control.inspect(timeout=timeout)
+        filas = inspecao.active_queues() or {}
+        estatisticas = inspecao.stats() or {}
+    except Exception as e:
+        print(f"Aviso: não foi possível consultar os workers ({e})")
+        return 1
+
+    vagas = 0
+    for worker, consumidas in filas.items():
+        if any(fila.get('name') == FILA_COLETA for fila in consumidas):
+            vagas += estatisticas.get(worker, {}).get('pool', {}).get('max-concurrency', 1)
+    return max(1, vagas)
+
+
+def total_paginas(scraper, filtro: str) -> int:
+    """Total de páginas do termo, lido da primeira página da busca"""
+    dados = scraper.search_products(filtro, 1)
+    if dados is None:
+        raise RuntimeError(f'Falha ao ler a paginação de "{filtro}"')
+    total = dados.get('totalRegistros', 0)
+    por_pagina = dados.get('registrosPorPagina') or 25
+    return max(1, (total + por_pagina - 1) // por_pagina)
+
+
+def gravar_artefato(caminho: Path, produtos: Iterable) -> int:
+    """Grava produtos em JSONL (temporário + rename atômico); retorna a quantidade"""
+    from src.scrapy_servimed.pipelines import limpar_produto
+
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    tmp = caminho.with_name(f'{caminho.name}.{os.getpid()}.tmp')
+    total = 0
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for produto in produtos:
+            f.write(json.dumps(limpar_produto(produto), ensure_ascii=False) + '\n')
+            total += 1
+    os.replace(tmp, caminho)
+    return total
+
+
+def motivo_tarefa_unica(task_data: Dict) -> str:
+    """
+    Por que a coleta precisa da tarefa única (processar_scraping_simple)
+
+    Retorna '' quando a coleta pode ser encadeada. Delta compara a coleta
+    inteira num único spider e o resume retoma o checkpoint de uma coleta
+    anterior, que a cadeia (checkpoints por coleta_id) não conhece.
+    """
+    if task_data.get('delta'):
+        return 'delta compara a coleta inteira num único spider'
+    if task_data.get('resume'):
+        return 'resume retoma o checkpoint da coleta interrompida'
+    return ''
+
+
+def coletar_paginas_original(filtro: str, inicio: int, fim: int) -> List[Produto]:
+    """Páginas inicio..fim pelo sistema original (sem Scrapy); erro se alguma página falhar"""
+    from src.servimed_scraper.scraper import ServimedScraperCompleto
+
+    scraper = ServimedScraperCompleto()
+    produtos = []
+    for pagina in range(inicio, fim + 1):
+        dados = scraper.search_products(filtro, pagina)
+        if not dados or 'lista' not in dados:
+            raise RuntimeError(f'falha na página {pagina}')
+        for dado in dados['lista']:
+            produto = Produto.de_mapping(scraper.processar_produto(dado))
+            # Mesmo formato dos itens do Scrapy: as fatias são juntadas por código
+            produto['codigo'] = str(produto['codigo'])
+            produto['filtros'] = [filtro]
+            produtos.append(produto)
+        if not dados['lista']:
+            break
+    return produtos
+
+
+def montar_cadeia(task_data: Dict, fatias: List[Dict], coleta_id: str):
+    """Chord das fatias -> exportação -> envio"""
+    filtros = list(dict.fromkeys(fatia['filtro'] for fatia in fatias))
+    escopo = '|'.join(sorted(filtros)) if len(filtros) > 1 else filtros[0]
+
+    framework = task_data.get('framework') or 'scrapy'
+    cabecalho = group(coletar_fatia.s(fatia, framework=framework) for fatia in fatias)
+    exportacao = exportar_coleta.s(coleta_id=coleta_id, escopo=escopo, exportar=task_data.get('exportar', ''))
+    envio = enviar_coleta.s(callback_url=task_data.get('callback_url', 'https://desafio.cotefacil.net'))
+    return chord(cabecalho, exportacao) | envio
+
+
+@app.task(bind=True, name='src.nivel2.etapas.processar_coleta_encadeada',
+          autoretry_for=(Exception,), retry_kwargs={'max_retries': TENTATIVAS_ETAPA, 'countdown': INTERVALO_TENTATIVA})
+def processar_coleta_encadeada(self, task_data):
+    """
+    Planeja a coleta em fatias e se substitui pela cadeia de etapas
+
+    Aceita o mesmo task_data de processar_scraping_simple; com `delta` ou
+    `resume` (ver motivo_tarefa_unica) se substitui pela tarefa única. O
+    resultado final fica no id desta tarefa.
+    """
+    from src.servimed_scraper.scraper import ServimedScraperCompleto
+
+    coleta_id = self.request.id
+    motivo = motivo_tarefa_unica(task_data)
+    if motivo:
+        print(f"[{coleta_id}] Coleta não encadeada ({motivo}) - usando a tarefa única")
+        return self.replace(app.signature('src.nivel2.tasks.processar_scraping_simple', args=[task_data]))
+
+    filtros = carregar_filtros(task_data.get('filtros'), None, task_data.get('filtro', ''))
+    diretorio = COLETA_ARTEFATOS_DIR / coleta_id
+
+    scraper = ServimedScraperCompleto()
+    max_pages = task_data.get('max_pages', 1)
+    paginas = {}
+    for filtro in filtros:
+        paginas[filtro] = total_paginas(scraper, filtro)
+        if max_pages:
+            paginas[filtro] = min(paginas[filtro], max_pages)
+
+    vagas = vagas_coleta()
+    tamanho = paginas_por_fatia(sum(paginas.values()), vagas)
+    fatias = []
+    for filtro in filtros:
+        for inicio, fim in dividir_paginas(paginas[filtro], None, tamanho):
+            fatias.append({
+                'filtro': filtro,
+                'inicio': inicio,
+                'fim': fim,
+                'arquivo': str(diretorio / f'fatia_{len(fatias):04d}.jsonl')
+            })
+
+    print(f"[{coleta_id}] Coleta encadeada: {len(filtros)} termo(s), {sum(paginas.values())} páginas, "
+          f"{len(fatias)} fatia(s) de até {tamanho} páginas para {vagas} vaga(s) de coleta")
+    return self.replace(montar_cadeia(task_data, fatias, coleta_id))
+
+
+@app.task(bind=True, name='src.nivel2.etapas.coletar_fatia', max_retries=TENTATIVAS_ETAPA,
+          acks_late=True, reject_on_worker_lost=True)
+def coletar_fatia(self, fatia: Dict, framework: str = 'scrapy') -> Dict:
+    """
+    Coleta as páginas inicio..fim de um termo e grava os produtos da fatia
+
+    O checkpoint fica no diretório da coleta, identificado pela fatia: novas
+    tentativas (e a reentrega após a queda de um worker) retomam só as
+    páginas que faltam, sem tocar nas fatias de outras coletas. Como na
+    tarefa única, se o Scrapy ainda falha na última tentativa a fatia é
+    coletada pelo sistema original (framework 'original' usa só ele). Sem
+    nenhum dos dois, a fatia segue vazia e incompleta, com o erro.
+    """
+    from src.scrapy_wrapper import ScrapyServimedWrapper
+
+    task_id = self.request.id
+    print(f"[{task_id}] Fatia \"{fatia['filtro']}\" páginas {fatia['inicio']}-{fatia['fim']} "
+          f"(tentativa {self.request.retries + 1}, {framework})")
+
+    arquivo = Path(fatia['arquivo'])
+    erro = None
+    if framework != 'original':
+        resultados = ScrapyServimedWrapper().crawl(
+            filtro=fatia['filtro'],
+            max_pages=fatia['fim'],
+            pagina_inicial=fatia['inicio'],
+            fatia=True,
+            resume=True,
+            diretorio_checkpoint=arquivo.parent / 'checkpoints',
+            execucao=arquivo.stem,
+            arquivo_resultados=False
+        )
+        if resultados['success']:
+            total = gravar_artefato(arquivo, resultados['produtos'])
+            pendentes = resultados.get('stats', {}).get('coleta/paginas_pendentes', 0)
+            if pendentes and self.request.retries < self.max_retries:
+                raise self.retry(exc=RuntimeError(f'{pendentes} página(s) pendente(s)'),
+                                 countdown=INTERVALO_TENTATIVA)
+
+            print(f"[{task_id}] Fatia concluída: {total} produtos"
+                  + (f", {pendentes} páginas pendentes" if pendentes else ""))
+            return {**fatia, 'total': total, 'paginas_pendentes': pendentes, 'completa': not pendentes}
+
+        erro = f"Erro no Scrapy: {resultados.get('error')}"
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=RuntimeError(erro), countdown=INTERVALO_TENTATIVA)
+        print(f"[{task_id}] {erro} - fallback para sistema original...")
+
+    try:
+        produtos = coletar_paginas_original(fatia['filtro'], fatia['inicio'], fatia['fim'])
+    except Exception as e:
+        erro = '; '.join(filter(None, [erro, f'Erro no sistema original: {e}']))
+        if framework == 'original' and self.request.retries < self.max_retries:
+            raise self.retry(exc=RuntimeError(erro), countdown=INTERVALO_TENTATIVA)
+        print(f"[{task_id}] Fatia sem produtos após {self.request.retries + 1} tentativas: {erro}")
+        gravar_artefato(arquivo, [])
+        return {**fatia, 'total': 0, 'paginas_pendentes': fatia['fim'] - fatia['inicio'] + 1,
+                'completa': False, 'erro': erro}
+
+    total = gravar_artefato(arquivo, produtos)
+    print(f"[{task_id}] Fatia concluída pelo sistema original: {total} produtos")
+    return {**fatia, 'total': total, 'paginas_pendentes': 0, 'completa': True, 'framework': 'original'}
+
+
+@app.task(bind=True, name='src.nivel2.etapas.exportar_coleta',
+          autoretry_for=(Exception,), dont_autoretry_for=(ColetaSemProdutos,),
+          retry_kwargs={'max_retries': TENTATIVAS_ETAPA, 'countdown': INTERVALO_TENTATIVA})
+def exportar_coleta(self, fatias: List[Dict], coleta_id: str, escopo: str = '', exportar: str = '') -> Dict:
+    """
+    Junta as fatias (na ordem de página, sem repetir códigos) e exporta
+
+    Grava o JSONL consolidado e, se pedido, o snapshot colunar; registra a
+    coleta no histórico de preços só quando todas as fatias estão completas
+    (uma coleta parcial não é um snapshot do catálogo). Se nenhuma fatia foi
+    coletada, falha a cadeia (ColetaSemProdutos) em vez de enviar nada. Os
+    arquivos das fatias são removidos ao final.
+    """
+    from src.catalogo import HistoricoPrecos
+    from src.catalogo.historico import HISTORICO_ENABLED
+    from src.coleta import colunar
+
+    inicio = time.time()
+    diretorio = COLETA_ARTEFATOS_DIR / coleta_id
+
+    erros = [fatia['erro'] for fatia in fatias if fatia.get('erro')]
+    if erros and len(erros) == len(fatias):
+        raise ColetaSemProdutos(f'Nenhuma das {len(fatias)} fatias foi coletada: {erros[0]}')
+    incompletas = sum(1 for fatia in fatias if not fatia.get('completa', True))
+
+    # Códigos repetidos entre fatias (páginas que deslizaram) ou termos: uma
+    # entrada por código, com os termos que o encontraram
+    produtos: Dict[str, Produto] = {}
+    for fatia in fatias:
+        for produto in iter_produtos(fatia['arquivo']):
+            codigo = produto.get('codigo')
+            if not codigo:
+                continue
+            existente = produtos.get(codigo)
+            if existente is None:
+                produtos[codigo] = Produto.de_mapping(produto)
+                continue
+            termos = existente.get('filtros') or []
+            novos = [termo for termo in produto.get('filtros') or [] if termo not in termos]
+            if novos:
+                existente['filtros'] = termos + novos
+
+    arquivo = diretorio / 'produtos.jsonl'
+    total = gravar_artefato(arquivo, produtos.values())
+
+    arquivo_colunar = None
+    if exportar:
+        if colunar.disponivel():
+            exportador = colunar.ExportadorColunar(diretorio / f'produtos{colunar.FORMATOS[exportar]}', exportar)
+            try:
+                for produto in produtos.values():
+                    exportador.adicionar(produto)
+                arquivo_colunar = str(exportador.fechar())
+            except Exception:
+                exportador.descartar()
+                raise
+        else:
+            print(f"[{coleta_id}] pyarrow não instalado - exportação {exportar} ignorada")
+
+    historico = None
+    if HISTORICO_ENABLED and incompletas:
+        print(f"[{coleta_id}] Coleta parcial - histórico de preços não registrado")
+    elif HISTORICO_ENABLED:
+        precos = HistoricoPrecos()
+        try:
+            precos.iniciar_coleta(escopo)
+            precos.registrar(produtos.values())
+            historico = precos.concluir_coleta()
+        finally:
+            precos.fechar()
+
+    for fatia in fatias:
+        Path(fatia['arquivo']).unlink(missing_ok=True)
+    # Checkpoints que sobraram das fatias incompletas
+    shutil.rmtree(diretorio / 'checkpoints', ignore_errors=True)
+
+    print(f"[{coleta_id}] Exportação: {total} produtos de {len(fatias)} fatias em {time.time() - inicio:.2f}s"
+          + (f" ({incompletas} fatias incompletas)" if incompletas else ""))
+
+    return {
+        'coleta_id': coleta_id,
+        'arquivo': str(arquivo),
+        'total': total,
+        'fatias': len(fatias),
+        'fatias_incompletas': incompletas,
+        'arquivo_colunar': arquivo_colunar,
+        'historico': historico
+    }
+
+
+@app.task(bind=True, name='src.nivel2.etapas.enviar_coleta', max_retries=TENTATIVAS_ETAPA + 1)
+def enviar_coleta(self, exportacao: Dict, callback_url: str = 'https://desafio.cotefacil.net',
+                  lotes_enviados: Optional[List[int]] = None) -> Dict:
+    """
+    Envia o arquivo consolidado em lotes para a API de callback
+
+    Uma nova tentativa pula os lotes já aceitos (`lotes_enviados`). Com
+    fatias incompletas o envio bem-sucedido termina como 'partial'.
+    """
+    from src.api_client.callback_client import CallbackAPIClient
+
+    task_id = self.request.id
+    enviados = set(lotes_enviados or [])
+
+    api_client = CallbackAPIClient(base_url=callback_url)
+    if not api_client.authenticate():
+        relatorio = {'success': False, 'error': 'Falha na autenticação OAuth2 com a API'}
+    else:
+        print(f"[{task_id}] Enviando {exportacao['total']} produtos "
+              f"({len(enviados)} lotes já enviados)...")
+        relatorio = api_client.send_products_chunked(iter_produtos(exportacao['arquivo']), pular_lotes=enviados)
+        enviados = enviados | {lote['lote'] for lote in relatorio['lotes'] if lote['status'] == 'ok'}
+
+    if not relatorio['success'] and self.request.retries < self.max_retries:
+        print(f"[{task_id}] Envio incompleto ({relatorio.get('error', 'lotes com falha')}) - nova tentativa")
+        raise self.retry(args=[exportacao], kwargs={'callback_url': callback_url,
+                                                    'lotes_enviados': sorted(enviados)},
+                         countdown=INTERVALO_TENTATIVA)
+
+    if not relatorio['success']:
+        status = 'error'
+    else:
+        status = 'partial' if exportacao['fatias_incompletas'] else 'success'
+
+    return {
+        'status': status,
+        'task_id': task_id,
+        'coleta_id': exportacao['coleta_id'],
+        'produtos_coletados': exportacao['total'],
+        'fatias': exportacao['fatias'],
+        'fatias_incompletas': exportacao['fatias_incompletas'],
+        'arquivo_local': exportacao['arquivo'],
+        'arquivo_colunar': exportacao['arquivo_colunar'],
+        'api_response': relatorio['success'],
+        'relatorio_envio': relatorio,
+        'callback_url': callback_url,
+        'framework_usado': 'scrapy',
+        'conexoes': estatisticas_conexoes(),
+        'timestamp': time.time()
+    }
@@ -6,8 +6,9 @@ Cliente para adicionar tarefas de scraping na fila do Celery.
 """
 
 import json
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from src.nivel2.celery_app import app
+from src.nivel2.etapas import motivo_tarefa_unica
 
 
 class TaskQueueClient:
@@ -23,7 +24,12 @@ class TaskQueueClient:
         callback_url: str = "https://desafio.cotefacil.net",
         filtro: str = "",
         max_pages: Optional[int] = 1,
-        framework: str = "original"
+        framework: str = "original",
+        resume: bool = False,
+        delta: bool = False,
+        filtros: Optional[List[str]] = None,
+        exportar: str = "",
+        encadeado: bool = False
     ) -> str:
         """
         Enfileira uma tarefa de scraping
@@ -35,6 +41,13 @@ class TaskQueueClient:
             filtro: Filtro para produtos (opcional)
             max_pages: Número máximo de páginas (opcional)
             framework: Framework para scraping (original ou scrapy)
+            resume: Retoma a coleta interrompida a partir do checkpoint
+            delta: Envia apenas produtos novos, alterados ou removidos
+            filtros: Vários termos coletados na mesma execução (produtos sem repetição)
+            exportar: Snapshot colunar adicional no worker ('parquet' ou 'arrow')
+            encadeado: Coleta em fatias -> exportação -> envio, cada etapa com
+                suas tentativas (src/nivel2/etapas.py); com delta ou resume
+                usa sempre a tarefa única
             
         Returns:
             str: ID da tarefa
@@ -45,16 +58,25 @@ class TaskQueueClient:
             "callback_url": callback_url,
             "filtro": filtro,
             "max_pages": max_pages,
-            "framework": framework
+            "framework": framework,
+            "resume": resume,
+            "delta": delta,
+            "filtros": filtros,
+            "exportar": exportar
         }
         
         print(f"Enfileirando tarefa ({framework}): {json.dumps(task_data, indent=2)}")
         
-        # Envia tarefa para fila (usando fila padrão)
-        result = self.celery_app.send_task(
-            'src.nivel2.tasks.processar_scraping_simple',
-            args=[task_data]
-        )
+        motivo = motivo_tarefa_unica(task_data) if encadeado else ''
+        if encadeado and not motivo:
+            nome_tarefa = 'src.nivel2.etapas.processar_coleta_encadeada'
+        else:
+            if motivo:
+                print(f"Coleta não encadeada: {motivo}")
+            nome_tarefa = 'src.nivel2.tasks.processar_scraping_simple'
+        
+        # Envia tarefa para fila (filas das etapas em task_routes)
+        result = self.celery_app.send_task(nome_tarefa, args=[task_data])
         
         print(f"Tarefa enfileirada com ID: {result.id}")
         return result.id
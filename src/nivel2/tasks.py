@@ -7,7 +7,6 @@ Versão otimizada para funcionamento no Windows com pool=solo
 
 import os
 import sys
-import json
 import time
 from pathlib import Path
 
@@ -23,14 +22,37 @@ if str(src_dir) not in sys.path:
     sys.path.insert(0, str(src_dir))
 
 from src.nivel2.celery_app import app
+from src.coleta import iter_produtos
+from src.rede import estatisticas_conexoes
+
+
+def finalizar_delta(task_id, stats, enviado):
+    """
+    Confirma (envio ok) ou descarta as mudanças preparadas pela coleta incremental
+    
+    Descartadas, as mudanças voltam a aparecer na próxima coleta com delta.
+    """
+    preparo = stats.get('delta/preparo')
+    if not preparo:
+        return
+    from src.catalogo.delta import confirmar_delta, descartar_delta
+    if enviado:
+        print(f"[{task_id}] Referência do delta atualizada: {confirmar_delta(preparo)} produtos")
+    else:
+        descartar_delta(preparo)
+        print(f"[{task_id}] Envio falhou - referência do delta mantida")
 
 
 @app.task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 2, 'countdown': 30})
 def processar_scraping_simple(self, task_data):
     """
     Versão simplificada da tarefa de scraping com suporte a Scrapy
+    
+    O arquivo de resultados da execução Scrapy (SCRAPY_EXECUCOES_DIR) é
+    removido ao final da tarefa, com ou sem sucesso no envio.
     """
     start_time = time.time()
+    arquivo_execucao = None
     try:
         task_id = self.request.id
         print(f"[{task_id}] Iniciando processamento...")
@@ -42,30 +64,37 @@ def processar_scraping_simple(self, task_data):
         callback_url = task_data.get('callback_url', 'https://desafio.cotefacil.net')
         filtro = task_data.get('filtro', '')
         max_pages = task_data.get('max_pages', 1)
+        resume = task_data.get('resume', False)
+        delta = task_data.get('delta', False)
+        filtros = task_data.get('filtros')
+        exportar = task_data.get('exportar', '')
         
         print(f"[{task_id}] Configurações: framework='scrapy', filtro='{filtro}', max_pages={max_pages}")
+        if filtros:
+            print(f"[{task_id}] Coleta com {len(filtros)} filtros: {filtros}")
         
         # 1. Executar scraping sempre com Scrapy
         print(f"[{task_id}] Iniciando scraping via Scrapy...")
         
         # Importar Scrapy wrapper
         try:
-            from scrapy_wrapper import ScrapyServimedWrapper
+            from src.scrapy_wrapper import ScrapyServimedWrapper
             
+            # Coleta em processo - reutiliza o reactor do worker entre tarefas
             wrapper = ScrapyServimedWrapper()
-            resultado_scrapy = wrapper.run_spider(filtro=filtro, max_pages=max_pages)
+            # Com callback_url o CeleryPipeline envia os produtos durante a coleta
+            results = wrapper.crawl(filtro=filtro, max_pages=max_pages, callback_url=callback_url,
+                                   resume=resume, delta=delta, filtros=filtros, exportar=exportar)
             
-            if resultado_scrapy:
-                results = wrapper.get_results()
-                if results['success']:
-                    produtos_coletados = results['total']
-                    arquivo_produtos = 'data/servimed_produtos_scrapy.json'
-                    print(f"[{task_id}] Scrapy concluído: {produtos_coletados} produtos")
-                    framework = 'scrapy'
-                else:
-                    raise Exception(f"Erro no Scrapy: {results.get('error')}")
+            if results['success']:
+                produtos = results['produtos']
+                produtos_coletados = results['total']
+                # Arquivo desta execução - o arquivo fixo pode ser de outra coleta do worker
+                arquivo_produtos = arquivo_execucao = results.get('arquivo')
+                print(f"[{task_id}] Scrapy concluído: {produtos_coletados} produtos")
+                framework = 'scrapy'
             else:
-                raise Exception("Falha na execução do Scrapy")
+                raise Exception(f"Erro no Scrapy: {results.get('error')}")
                 
         except Exception as e_scrapy:
             print(f"[{task_id}] ERRO no Scrapy: {e_scrapy}")
@@ -75,57 +104,84 @@ def processar_scraping_simple(self, task_data):
             from servimed_scraper.scraper import ServimedScraperCompleto
             
             scraper = ServimedScraperCompleto()
-            resultado_scraping = scraper.run(filtro=filtro, max_pages=max_pages)
+            resultado_scraping = scraper.run(filtro=filtro, max_pages=max_pages, resume=resume, filtros=filtros)
             
+            produtos = None
             produtos_coletados = resultado_scraping['total_produtos']
             arquivo_produtos = resultado_scraping['arquivo_salvo']
             framework = 'original'
             print(f"[{task_id}] Sistema original concluído: {produtos_coletados} produtos")
         
         # 2. Enviar para API de callback
-        print(f"[{task_id}] Enviando para API de callback...")
-        
-        from api_client.callback_client import CallbackAPIClient
-        api_client = CallbackAPIClient(base_url=callback_url)
-        
-        # Autenticar usando OAuth2 password flow
-        print(f"[{task_id}] Realizando autenticação OAuth2...")
-        auth_success = api_client.authenticate()
-        
-        if not auth_success:
-            print(f"[{task_id}] ERRO: Falha na autenticação OAuth2!")
-            return {
-                'status': 'error',
-                'task_id': task_id,
-                'error': 'Falha na autenticação OAuth2 com a API',
-                'framework': framework,
-                'timestamp': time.time()
-            }
-        
-        # Enviar produtos
-        print(f"[{task_id}] Enviando produtos para API...")
-        
-        # Ler arquivo de produtos gerado
-        with open(arquivo_produtos, 'r', encoding='utf-8') as f:
-            dados_completos = json.load(f)
-        
-        # Extrair apenas a lista de produtos
-        produtos = dados_completos.get('produtos', [])
-        print(f"[{task_id}] Produtos extraídos para envio: {len(produtos)}")
+        stats = results.get('stats', {}) if framework == 'scrapy' else {}
+        if stats.get('callback/success'):
+            # Já enviado em streaming pelo CeleryPipeline durante a coleta
+            print(f"[{task_id}] Produtos já enviados durante a coleta: "
+                  f"{stats.get('callback/produtos')} produtos, {stats.get('callback/lotes_ok')} lotes")
+            api_response = True
+            relatorio_envio = {key: value for key, value in stats.items() if key.startswith('callback/')}
+        else:
+            # Lotes já aceitos durante a coleta: o reenvio monta os mesmos lotes e pula esses
+            lotes_enviados = stats.get('callback/lotes_enviados') or []
+            if stats.get('callback/streaming'):
+                print(f"[{task_id}] Envio em streaming incompleto ({stats.get('callback/erro', 'lotes com falha')}) "
+                      f"- reenviando os lotes que faltam ({len(lotes_enviados)} já aceitos)")
+            
+            print(f"[{task_id}] Enviando para API de callback...")
+            
+            from src.api_client.callback_client import CallbackAPIClient
+            api_client = CallbackAPIClient(base_url=callback_url)
+            
+            # Autenticar usando OAuth2 password flow
+            print(f"[{task_id}] Realizando autenticação OAuth2...")
+            auth_success = api_client.authenticate()
+            
+            if not auth_success:
+                print(f"[{task_id}] ERRO: Falha na autenticação OAuth2!")
+                finalizar_delta(task_id, stats, False)
+                return {
+                    'status': 'error',
+                    'task_id': task_id,
+                    'error': 'Falha na autenticação OAuth2 com a API',
+                    'framework': framework,
+                    'timestamp': time.time()
+                }
+            
+            # Enviar produtos
+            print(f"[{task_id}] Enviando produtos para API...")
+            
+            # Sistema original: ler arquivo de produtos gerado (gerador, produto a produto)
+            if produtos is None:
+                produtos = iter_produtos(arquivo_produtos)
+            print(f"[{task_id}] Produtos a enviar: {produtos_coletados}")
+            
+            # O streaming só envia produtos com código, na ordem em que foram coletados
+            if lotes_enviados:
+                produtos = [produto for produto in produtos if produto.get('codigo')]
+            
+            # Lotes independentes em paralelo - uma falha não derruba o envio inteiro
+            relatorio_envio = api_client.send_products_chunked(produtos, pular_lotes=lotes_enviados)
+            api_response = relatorio_envio['success']
+            print(f"[{task_id}] Resposta da API: {api_response} "
+                  f"({relatorio_envio['lotes_ok']}/{relatorio_envio['total_lotes']} lotes)")
         
-        api_response = api_client.send_products(produtos)
-        print(f"[{task_id}] Resposta da API: {api_response}")
+        finalizar_delta(task_id, stats, api_response)
         
         resultado_final = {
             'status': 'success',
             'task_id': task_id,
             'produtos_coletados': produtos_coletados,
             'tempo_scraping': time.time() - start_time,
-            'arquivo_local': arquivo_produtos,
+            # O arquivo da execução Scrapy é removido abaixo; o do sistema original fica
+            'arquivo_local': None if arquivo_produtos == arquivo_execucao else arquivo_produtos,
+            'arquivo_colunar': stats.get('export/colunar/arquivo'),
             'api_response': api_response,
+            'relatorio_envio': relatorio_envio,
             'callback_url': callback_url,
             'filtro_usado': filtro,
+            'filtros_usados': filtros,
             'framework_usado': framework,
+            'conexoes': estatisticas_conexoes(),
             'timestamp': time.time()
         }
         
@@ -146,6 +202,10 @@ def processar_scraping_simple(self, task_data):
             'error': error_msg,
             'timestamp': time.time()
         }
+    
+    finally:
+        if arquivo_execucao:
+            Path(arquivo_execucao).unlink(missing_ok=True)
 
 
 @app.task(bind=True)
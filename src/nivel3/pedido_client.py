@@ -5,21 +5,28 @@ Cliente de Pedidos - Nível 3
 Cliente para realizar pedidos no portal Servimed e enviar confirmação para API.
 """
 
-import requests
 import json
 import os
 import time
 import uuid
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 
+from ..catalogo import CatalogoIndex
+from ..catalogo.cache import cache_produtos
+from ..rede import nova_sessao
+
 # Desabilitar warnings de SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Carregar .env
 load_dotenv()
 
+# Buscas simultâneas na verificação em lote dos produtos
+VERIFICACAO_WORKERS = int(os.getenv('PEDIDO_VERIFICACAO_WORKERS', '4'))
+
 
 class PedidoClient:
     """Cliente para realizar pedidos no portal Servimed"""
@@ -27,7 +34,8 @@ class PedidoClient:
     def __init__(self):
         self.base_url = os.getenv('BASE_URL', 'https://peapi.servimed.com.br')
         self.portal_url = os.getenv('PORTAL_URL', 'https://pedidoeletronico.servimed.com.br')
-        self.session = requests.Session()
+        # Sessão própria sobre o pool de conexões compartilhado do processo
+        self.session = nova_sessao()
         
         # Headers padrão baseados na análise do DevTools
         self.session.headers.update({
@@ -48,6 +56,12 @@ class PedidoClient:
         self.client_id = None
         self.x_cart = None
         
+        # Índice local do catálogo - evita scraping para produtos recentes
+        self.catalogo = CatalogoIndex()
+        
+        # Memoização das buscas (LRU + TTL), compartilhada pelos pedidos do worker
+        self.cache = cache_produtos
+        
     def authenticate(self) -> bool:
         """
         Autentica no portal usando tokens do .env
@@ -89,7 +103,7 @@ class PedidoClient:
     
     def buscar_produto_por_codigo(self, codigo: str) -> Optional[Dict]:
         """
-        Busca produto pelo código no portal
+        Busca produto pelo código - cache, índice local e, por último, o portal
         
         Args:
             codigo: Código do produto
@@ -98,45 +112,185 @@ class PedidoClient:
             Dict: Dados do produto ou None se não encontrado
         """
         try:
-            # Usar a mesma lógica do scraper para buscar produto
-            from ..servimed_scraper.scraper import ServimedScraperCompleto
-            
-            scraper = ServimedScraperCompleto()
-            # Fazer busca com filtro do código
-            resultado = scraper.run(filtro=codigo, max_pages=1)
-            
-            # Verificar se retornou dados válidos
-            if not resultado or 'arquivo_salvo' not in resultado:
-                print(f"Falha na busca do produto {codigo}")
-                return None
+            # Mesmo código repetido no pedido (ou em pedidos recentes) não gera nova busca
+            return self.cache.obter_ou_buscar(str(codigo), lambda: self._buscar_codigo(codigo))
+        except Exception as e:
+            print(f"Erro ao buscar produto: {e}")
+            return None
+    
+    def _buscar_codigo(self, codigo: str) -> Optional[Dict]:
+        """Busca sem cache: índice local e scraping (exceções não são memorizadas)"""
+        # Índice local: só faz scraping se o produto estiver ausente ou vencido
+        produto = self.catalogo.buscar_por_codigo(codigo)
+        if produto:
+            print(f"Produto encontrado no catálogo local: {produto.get('descricao', '')}")
+            return produto
+        
+        produto = self._buscar_no_portal(str(codigo), lambda prod: str(prod.get('codigo', '')) == str(codigo))
+        if produto:
+            print(f"Produto encontrado: {produto.get('descricao', '')}")
+        return produto
+    
+    def _buscar_no_portal(self, filtro: str, corresponde) -> Optional[Dict]:
+        """
+        Busca pontual (página 1) no portal, separando falha de "não encontrado"
+        
+        Só o "não encontrado" confirmado pelo portal retorna None (e vai para
+        o cache negativo); qualquer resultado incerto vira exceção.
+        
+        Returns:
+            Dict: Produto correspondente, ou None se o portal confirmou que
+                não há resultado (lista vazia ou todos os resultados na página 1)
             
-            # Ler arquivo de produtos gerado
-            arquivo_produtos = resultado['arquivo_salvo']
-            with open(arquivo_produtos, 'r', encoding='utf-8') as f:
-                dados_completos = json.load(f)
+        Raises:
+            RuntimeError: Busca falhou (erro HTTP/rede ou resposta sem 'lista')
+            LookupError: Nenhum correspondente na página 1, mas há mais páginas
+        """
+        from ..servimed_scraper.scraper import ServimedScraperCompleto
+        
+        scraper = ServimedScraperCompleto()
+        data = scraper.search_products(filtro, 1)
+        if not data or 'lista' not in data:
+            raise RuntimeError(f"Falha na busca de {filtro} no portal")
+        
+        produtos = [scraper.processar_produto(produto) for produto in data['lista']]
+        if produtos:
+            try:
+                self.catalogo.atualizar(produtos)
+            except Exception as e:
+                print(f"Erro ao atualizar índice do catálogo: {e}")
+        
+        for produto in produtos:
+            if corresponde(produto):
+                return dict(produto)
+        
+        if len(produtos) < (data.get('totalRegistros') or 0):
+            raise LookupError(f"{filtro} não está na página 1 de {data['totalRegistros']} resultados")
+        
+        print(f"Produto {filtro} não encontrado")
+        return None
+    
+    @staticmethod
+    def chave_produto(item: Dict) -> str:
+        """Chave de um item do pedido: código ou, na falta dele, GTIN"""
+        codigo = str(item.get('codigo') or '')
+        return codigo or f"gtin:{item.get('gtin') or ''}"
+    
+    def verificar_produtos(self, produtos_pedido: List[Dict], framework: str = 'scrapy') -> Dict[str, Dict]:
+        """
+        Resolve todos os produtos do pedido em uma única etapa
+        
+        Reúne os codigo/gtin distintos, consulta o catálogo local e busca os
+        ausentes de forma concorrente (uma busca por chave, sem repetição).
+        
+        Args:
+            produtos_pedido: Lista de produtos com {gtin, codigo, quantidade}
+            framework: 'scrapy' (coleta em processo) ou 'original'
             
-            # Extrair apenas a lista de produtos
-            produtos = dados_completos.get('produtos', [])
+        Returns:
+            Dict: chave_produto -> produto encontrado (com 'verificado_via')
+        """
+        pendentes = {}
+        for item in produtos_pedido:
+            if item.get('codigo') or item.get('gtin'):
+                pendentes.setdefault(self.chave_produto(item), item)
+        
+        resolvidos = {}
+        faltantes = []
+        em_cache = no_catalogo = 0
+        
+        for chave, item in pendentes.items():
+            # Buscas recentes (inclusive "não encontrado") vêm do cache
+            encontrado, produto = self.cache.obter(chave)
+            if encontrado:
+                em_cache += 1
+                if produto:
+                    resolvidos[chave] = produto
+                continue
             
-            # Procurar produto com código exato
-            for produto in produtos:
-                if str(produto.get('codigo', '')) == str(codigo):
-                    print(f"Produto encontrado: {produto.get('descricao', '')}")
-                    return produto
+            produto = self.catalogo.buscar(codigo=str(item.get('codigo') or ''), gtin=item.get('gtin') or '')
+            if produto:
+                no_catalogo += 1
+                resolvidos[chave] = {**produto, 'verificado_via': 'catalogo'}
+            else:
+                faltantes.append((chave, item))
+        
+        print(f"Verificação em lote: {len(pendentes)} produtos distintos, {em_cache} em cache, "
+              f"{no_catalogo} no catálogo, {len(faltantes)} para buscar")
+        
+        if faltantes:
+            with ThreadPoolExecutor(max_workers=min(VERIFICACAO_WORKERS, len(faltantes))) as executor:
+                buscas = [
+                    (chave, executor.submit(self.cache.obter_ou_buscar, chave,
+                                            lambda item=item: self._buscar_produto_remoto(item, framework)))
+                    for chave, item in faltantes
+                ]
+                for chave, busca in buscas:
+                    try:
+                        produto = busca.result()
+                    except Exception as e:
+                        print(f"Erro ao buscar produto {chave}: {e}")
+                        continue
+                    if produto:
+                        resolvidos[chave] = produto
+        
+        return resolvidos
+    
+    def _buscar_produto_remoto(self, item: Dict, framework: str) -> Optional[Dict]:
+        """
+        Busca um produto via Scrapy (em processo) com fallback para o sistema original
+        
+        None significa "não encontrado" confirmado pelo portal (memorizado no
+        cache negativo); erros de coleta são propagados para não serem
+        memorizados. A coleta Scrapy decide pelo totalRegistros da própria
+        página 1 (estatística coleta/total_registros); a busca pontual do
+        sistema original só roda quando a coleta falhou.
+        """
+        codigo = str(item.get('codigo') or '')
+        gtin = str(item.get('gtin') or '')
+        filtro = codigo or gtin
+        
+        def corresponde(prod):
+            return (codigo and str(prod.get('codigo', '')) == codigo) or \
+                   (gtin and str(prod.get('gtin') or prod.get('gtin_ean') or '') == gtin)
+        
+        try:
+            if framework == 'scrapy':
+                from ..scrapy_wrapper import ScrapyServimedWrapper
+                
+                results = ScrapyServimedWrapper().crawl(filtro=filtro, max_pages=1, arquivo_resultados=False)
+                stats = results.get('stats', {})
+                total = stats.get('coleta/total_registros')
+                if results['success'] and total is not None and not stats.get('coleta/paginas_pendentes'):
+                    for prod in results['produtos']:
+                        if corresponde(prod):
+                            print(f"Produto {filtro} encontrado via Scrapy")
+                            return {**prod, 'verificado_via': 'scrapy'}
+                    if len(results['produtos']) < total:
+                        raise LookupError(f"{filtro} não está na página 1 de {total} resultados")
+                    print(f"Produto {filtro} não encontrado")
+                    return None
+                print(f"Scrapy falhou para {filtro} ({results.get('error', 'página 1 não coletada')}) "
+                      f"- usando o sistema original")
             
-            print(f"Produto com código {codigo} não encontrado")
-            return None
+            prod = self._buscar_no_portal(filtro, corresponde)
+            if prod is None:
+                return None
+            print(f"Produto {filtro} encontrado via sistema original")
+            return {**prod, 'verificado_via': 'original'}
             
         except Exception as e:
-            print(f"Erro ao buscar produto: {e}")
-            return None
+            print(f"Erro ao buscar produto {filtro}: {e}")
+            raise
     
-    def realizar_pedido(self, produtos_pedido: List[Dict]) -> Optional[str]:
+    def realizar_pedido(self, produtos_pedido: List[Dict],
+                        produtos_resolvidos: Optional[Dict[str, Dict]] = None) -> Optional[str]:
         """
         Realiza pedido no portal Servimed e retorna o código do pedido
         
         Args:
             produtos_pedido: Lista de produtos com {gtin, codigo, quantidade}
+            produtos_resolvidos: Resultado de verificar_produtos() - evita buscar de novo
             
         Returns:
             str: Código do pedido retornado pelo Servimed ou None se falhou
@@ -153,8 +307,10 @@ class PedidoClient:
                 codigo = item.get('codigo')
                 quantidade = item.get('quantidade', 1)
                 
-                # Buscar dados do produto
-                produto = self.buscar_produto_por_codigo(codigo)
+                # Dados do produto: verificação em lote ou busca individual
+                produto = (produtos_resolvidos or {}).get(self.chave_produto(item))
+                if not produto:
+                    produto = self.buscar_produto_por_codigo(codigo)
                 if not produto:
                     print(f"Produto {codigo} não encontrado, ignorando...")
                     continue
@@ -226,9 +382,12 @@ class PedidoClient:
                     quantidade_total = sum(item.get('quantityRequested', 0) for item in itens_pedido)
                     cliente_sufixo = str(self.client_id)[-4:]  # Últimos 4 dígitos do cliente
                     
-                    # Formato legível: SERVIMED_DDMMAAAA_HHMM_PRODUTO1_QTD_CLIENTE
-                    # Exemplo: SERVIMED_13082025_1245_444212_01_7511
-                    codigo_pedido = f"SERVIMED_{data_str}_{hora_str}_{primeiro_produto}_{quantidade_total:02d}_{cliente_sufixo}"
+                    # Sufixo aleatório: pedidos iguais no mesmo minuto (lotes) não colidem
+                    unico = uuid.uuid4().hex[:6].upper()
+                    
+                    # Formato legível: SERVIMED_DDMMAAAA_HHMM_PRODUTO1_QTD_CLIENTE_UNICO
+                    # Exemplo: SERVIMED_13082025_1245_444212_01_7511_3F9A2C
+                    codigo_pedido = f"SERVIMED_{data_str}_{hora_str}_{primeiro_produto}_{quantidade_total:02d}_{cliente_sufixo}_{unico}"
                     
                     print(f"Pedido realizado com sucesso no Servimed!")
                     print(f"Código gerado para rastreamento: {codigo_pedido}")
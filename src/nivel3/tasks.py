@@ -7,17 +7,36 @@ Tasks para processamento de pedidos CONFORME DESAFIO COTEFÁCIL:
 2. Realizar pedido via formulário no site Servimed
 3. Chamar API do desafio para gerar pedido aleatório
 4. Fazer PATCH /pedido/:id com dados de confirmação do pedido
+
+O lado Cotefácil (autenticação e pedido aleatório) não depende do Servimed
+e roda em paralelo com as etapas 0-2; só o PATCH espera o código Servimed.
+
+processar_pedidos_lote faz o mesmo para vários pedidos numa única tarefa,
+com uma verificação de produtos e sessões autenticadas compartilhadas.
 """
 
+import os
 import json
 import time
-from typing import Dict, Any
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 from celery import Task
 
 from ..nivel2.celery_app import app
 from ..api_client.callback_client import CallbackAPIClient
 from .pedido_client import PedidoClient
 
+# Pedidos de um lote processados ao mesmo tempo (mesmas sessões autenticadas)
+PEDIDO_LOTE_WORKERS = int(os.getenv('PEDIDO_LOTE_WORKERS', '4'))
+
+# Endpoints que geram pedido aleatório, na ordem de tentativa
+ENDPOINTS_PEDIDO_ALEATORIO = ["/pedido", "/pedido/random", "/pedido/gerar", "/pedido/novo"]
+
+# Endpoint que funcionou por base_url - as próximas tarefas do worker vão direto nele
+_endpoint_pedido_aleatorio: Dict[str, str] = {}
+_endpoint_lock = threading.Lock()
+
 
 @app.task(bind=True, name='src.nivel3.tasks.processar_pedido_completo')
 def processar_pedido_completo(self: Task, task_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -36,10 +55,12 @@ def processar_pedido_completo(self: Task, task_data: Dict[str, Any]) -> Dict[str
         }
     
     Returns:
-        Dict: Resultado da operação
+        Dict: Resultado da operação (com erro no lado Servimed, o pedido
+            aleatório já criado na API vem em `pedido_aleatorio_api`)
     """
     task_id = self.request.id
     framework = task_data.get('framework', 'original')
+    futuro_api = None
     
     try:
         print(f"[{task_id}] === NÍVEL 3 - PROCESSAMENTO DE PEDIDO ({framework}) ===")
@@ -60,134 +81,39 @@ def processar_pedido_completo(self: Task, task_data: Dict[str, Any]) -> Dict[str
         if not produtos:
             raise ValueError("Nenhum produto especificado para o pedido")
         
-        # 0. ETAPA ADICIONAL: Buscar produtos via scraping para verificar disponibilidade
-        print(f"[{task_id}] 0. Verificando disponibilidade dos produtos...")
-        produtos_verificados = []
-        
-        for produto in produtos:
-            codigo = produto.get('codigo', '')
-            gtin = produto.get('gtin', '')
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # 3. API do desafio: autenticação + pedido aleatório, em paralelo com as etapas 0-2
+            print(f"[{task_id}] 3. Chamando API do desafio para gerar pedido aleatório (em paralelo)...")
+            futuro_api = executor.submit(preparar_pedido_api, callback_url, task_id)
             
-            if not codigo and not gtin:
-                print(f"[{task_id}] Produto sem código/GTIN, pulando...")
-                continue
+            # 0. ETAPA ADICIONAL: Verificação em lote - catálogo local + buscas concorrentes sem repetição
+            print(f"[{task_id}] 0. Verificando disponibilidade dos produtos...")
+            pedido_client = PedidoClient()
+            produtos_resolvidos = pedido_client.verificar_produtos(produtos, framework=framework)
+            produtos_verificados = montar_produtos_verificados(produtos, produtos_resolvidos, framework, task_id)
             
-            # Buscar produto via framework escolhido
-            produto_encontrado = None
+            print(f"[{task_id}] Produtos verificados: {len(produtos_resolvidos)} encontrados, {len(produtos_verificados)}/{len(produtos)} no pedido")
             
-            if framework == 'scrapy':
-                print(f"[{task_id}] Buscando {codigo} via Scrapy...")
-                try:
-                    from scrapy_wrapper import ScrapyServimedWrapper
-                    
-                    wrapper = ScrapyServimedWrapper()
-                    resultado = wrapper.run_spider(filtro=codigo, max_pages=1)
-                    
-                    if resultado:
-                        results = wrapper.get_results()
-                        if results['success']:
-                            for prod in results['produtos']:
-                                if prod.get('codigo') == codigo or prod.get('gtin') == gtin:
-                                    produto_encontrado = prod
-                                    break
-                    
-                    if produto_encontrado:
-                        print(f"[{task_id}] Produto {codigo} encontrado via Scrapy")
-                    else:
-                        print(f"[{task_id}] Produto {codigo} não encontrado via Scrapy")
-                        
-                except ImportError:
-                    print(f"[{task_id}] Scrapy não disponível, usando sistema original")
-                    framework = 'original'
+            # 1. Autenticar no portal
+            print(f"[{task_id}] 1. Autenticando no portal...")
+            auth_success = pedido_client.authenticate()
             
-            if framework == 'original' or not produto_encontrado:
-                print(f"[{task_id}] Buscando {codigo} via sistema original...")
-                
-                from servimed_scraper.scraper import ServimedScraperCompleto
-                
-                scraper = ServimedScraperCompleto()
-                resultado_scraping = scraper.run(filtro=codigo, max_pages=1)
-                
-                # Buscar produto nos resultados
-                arquivo_produtos = resultado_scraping['arquivo_salvo']
-                with open(arquivo_produtos, 'r', encoding='utf-8') as f:
-                    dados = json.load(f)
-                
-                for prod in dados.get('produtos', []):
-                    if prod.get('codigo') == codigo or prod.get('gtin') == gtin:
-                        produto_encontrado = prod
-                        break
-                
-                if produto_encontrado:
-                    print(f"[{task_id}] Produto {codigo} encontrado via sistema original")
-                else:
-                    print(f"[{task_id}] Produto {codigo} não encontrado")
+            if not auth_success:
+                raise ValueError("Falha na autenticação no portal Servimed")
             
-            if produto_encontrado:
-                # Adicionar dados do scraping ao produto do pedido
-                produto_completo = {
-                    **produto,
-                    'descricao': produto_encontrado.get('descricao', ''),
-                    'preco_fabrica': produto_encontrado.get('preco_fabrica', 0),
-                    'estoque_disponivel': produto_encontrado.get('estoque', 0),
-                    'verificado_via': framework
-                }
-                produtos_verificados.append(produto_completo)
-            else:
-                print(f"[{task_id}] Produto {codigo} não verificado, incluindo mesmo assim")
-                produtos_verificados.append(produto)
-        
-        print(f"[{task_id}] Produtos verificados: {len(produtos_verificados)}/{len(produtos)}")
-        
-        # 1. Criar cliente de pedidos e autenticar
-        print(f"[{task_id}] 1. Autenticando no portal...")
-        pedido_client = PedidoClient()
-        auth_success = pedido_client.authenticate()
-        
-        if not auth_success:
-            raise ValueError("Falha na autenticação no portal Servimed")
-        
-        # 2. Realizar pedido
-        print(f"[{task_id}] 2. Realizando pedido...")
-        codigo_pedido_servimed = pedido_client.realizar_pedido(produtos_verificados)
-        
-        if not codigo_pedido_servimed:
-            raise ValueError("Falha ao realizar pedido no portal")
-        
-        print(f"[{task_id}] Pedido realizado! Código Servimed: {codigo_pedido_servimed}")
-        
-        # 3. Chamar API do desafio para gerar pedido aleatório
-        print(f"[{task_id}] 3. Chamando API do desafio para gerar pedido aleatório...")
-        api_client = CallbackAPIClient(base_url=callback_url)
-        
-        # Autenticar na API Cotefacil
-        api_auth_success = api_client.authenticate()
-        if not api_auth_success:
-            raise ValueError("Falha na autenticação com API Cotefacil")
-        
-        # Gerar pedido aleatório conforme requisito do desafio
-        pedido_aleatorio_id = gerar_pedido_aleatorio_api(api_client)
-        
-        if not pedido_aleatorio_id:
-            raise ValueError("Falha crítica: não foi possível gerar pedido aleatório na API")
-        
-        print(f"[{task_id}] Pedido aleatório gerado: {pedido_aleatorio_id}")
-        
-        # 4. Fazer PATCH /pedido/:id com dados de confirmação
-        print(f"[{task_id}] 4. Enviando PATCH para /pedido/{pedido_aleatorio_id}...")
-        
-        callback_data = {
-            "codigo_confirmacao": str(codigo_pedido_servimed),
-            "status": "pedido_realizado"
-        }
-        
-        print(f"[{task_id}] Enviando confirmação com código Servimed: {codigo_pedido_servimed}")
-        
-        # Fazer PATCH conforme especificação do desafio
-        patch_success = fazer_patch_pedido(api_client, pedido_aleatorio_id, callback_data)
+            # 2. Realizar pedido
+            print(f"[{task_id}] 2. Realizando pedido...")
+            codigo_pedido_servimed = pedido_client.realizar_pedido(produtos_verificados, produtos_resolvidos)
+            
+            if not codigo_pedido_servimed:
+                raise ValueError("Falha ao realizar pedido no portal")
+            
+            print(f"[{task_id}] Pedido realizado! Código Servimed: {codigo_pedido_servimed}")
+            
+            api_client, pedido_aleatorio_id = futuro_api.result()
         
-        if not patch_success:
-            print(f"[{task_id}] PATCH falhou, mas pedido foi realizado no Servimed")
+        # 4. PATCH /pedido/:id com dados de confirmação (única etapa que espera o Servimed)
+        patch_success = confirmar_pedido_api(api_client, pedido_aleatorio_id, codigo_pedido_servimed, task_id)
         
         # Resultado final
         resultado_final = {
@@ -198,6 +124,7 @@ def processar_pedido_completo(self: Task, task_data: Dict[str, Any]) -> Dict[str
             'codigo_pedido_servimed': codigo_pedido_servimed,
             'produtos_pedido': len(produtos),
             'patch_enviado': patch_success,
+            'cache_produtos': pedido_client.cache.estatisticas(),
             'callback_url': callback_url,
             'timestamp': time.time()
         }
@@ -213,13 +140,277 @@ def processar_pedido_completo(self: Task, task_data: Dict[str, Any]) -> Dict[str
         import traceback
         traceback.print_exc()
         
-        return {
+        resultado_erro = {
             'status': 'error',
             'task_id': self.request.id,
             'id_pedido': task_data.get('id_pedido', 'unknown'),
             'error': error_msg,
             'timestamp': time.time()
         }
+        pedido_aleatorio_id = pedido_aleatorio_sem_confirmacao(futuro_api, task_id)
+        if pedido_aleatorio_id:
+            resultado_erro['pedido_aleatorio_api'] = pedido_aleatorio_id
+        return resultado_erro
+
+
+@app.task(bind=True, name='src.nivel3.tasks.processar_pedidos_lote')
+def processar_pedidos_lote(self: Task, task_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Processa vários pedidos numa única tarefa
+    
+    Os produtos de todos os pedidos são verificados de uma vez (cada
+    código/GTIN buscado uma única vez no lote), a API Cotefácil é
+    autenticada uma vez e os pedidos são transmitidos em paralelo (até
+    PEDIDO_LOTE_WORKERS), cada thread com o próprio PedidoClient autenticado
+    (requests.Session não é thread-safe). A falha de um pedido não
+    interrompe os demais. Pedidos sem id_pedido são identificados pela
+    posição no lote ('pedido_<n>'); ids repetidos rejeitam o lote.
+    
+    Args:
+        task_data: {
+            "usuario": "email",
+            "senha": "senha",
+            "pedidos": [{"id_pedido": "1234", "produtos": [{"gtin": "123", "codigo": "A123", "quantidade": 1}]}],
+            "callback_url": "https://desafio.cotefacil.net",
+            "framework": "scrapy"
+        }
+    
+    Returns:
+        Dict: Resumo do lote e resultado por id_pedido em `pedidos`
+    """
+    task_id = self.request.id
+    framework = task_data.get('framework', 'scrapy')
+    pedidos = task_data.get('pedidos', [])
+    callback_url = task_data.get('callback_url', 'https://desafio.cotefacil.net')
+    
+    try:
+        print(f"[{task_id}] === NÍVEL 3 - LOTE DE {len(pedidos)} PEDIDOS ({framework}) ===")
+        
+        if not pedidos:
+            raise ValueError("Nenhum pedido no lote")
+        
+        # O resultado é indexado por id_pedido: ids repetidos se sobreporiam
+        ids_pedidos = [str(pedido.get('id_pedido') or f'pedido_{indice}')
+                       for indice, pedido in enumerate(pedidos, 1)]
+        repetidos = sorted({id_pedido for id_pedido in ids_pedidos if ids_pedidos.count(id_pedido) > 1})
+        if repetidos:
+            raise ValueError(f"id_pedido repetido no lote: {', '.join(repetidos)}")
+        
+        executor_api = ThreadPoolExecutor(max_workers=min(PEDIDO_LOTE_WORKERS, len(pedidos)))
+        try:
+            # Autenticação na API Cotefácil em paralelo com a verificação
+            futuro_auth = executor_api.submit(autenticar_api, callback_url)
+            
+            # 0. Verificação única de todos os produtos do lote
+            pedido_client = PedidoClient()
+            todos_produtos = [produto for pedido in pedidos for produto in pedido.get('produtos', [])]
+            produtos_resolvidos = pedido_client.verificar_produtos(todos_produtos, framework=framework)
+            
+            # 1. Autenticação (credenciais do portal conferidas antes de transmitir)
+            if not pedido_client.authenticate():
+                raise ValueError("Falha na autenticação no portal Servimed")
+            api_client = futuro_auth.result()
+            
+            # 2-4. Transmissão de cada pedido com o pedido aleatório gerado em paralelo
+            clientes = threading.local()
+            with ThreadPoolExecutor(max_workers=min(PEDIDO_LOTE_WORKERS, len(pedidos))) as executor:
+                resultados = dict(executor.map(
+                    lambda item: _processar_pedido_lote(item, _pedido_client_da_thread(clientes), api_client,
+                                                        executor_api, produtos_resolvidos, framework, task_id),
+                    zip(ids_pedidos, pedidos)
+                ))
+        finally:
+            executor_api.shutdown(wait=False)
+        
+        pedidos_ok = sum(1 for resultado in resultados.values() if resultado['status'] == 'success')
+        print(f"[{task_id}] Lote concluído: {pedidos_ok}/{len(resultados)} pedidos realizados")
+        
+        return {
+            'status': 'success' if pedidos_ok == len(resultados) else ('partial' if pedidos_ok else 'error'),
+            'task_id': task_id,
+            'total_pedidos': len(resultados),
+            'pedidos_ok': pedidos_ok,
+            'pedidos_com_erro': len(resultados) - pedidos_ok,
+            'produtos_encontrados': len(produtos_resolvidos),
+            'pedidos': resultados,
+            'cache_produtos': pedido_client.cache.estatisticas(),
+            'callback_url': callback_url,
+            'timestamp': time.time()
+        }
+        
+    except Exception as e:
+        error_msg = f"Erro no lote {self.request.id}: {str(e)}"
+        print(f"[ERROR] {error_msg}")
+        
+        return {
+            'status': 'error',
+            'task_id': self.request.id,
+            'total_pedidos': len(pedidos),
+            'error': error_msg,
+            'timestamp': time.time()
+        }
+
+
+def _pedido_client_da_thread(clientes: threading.local) -> PedidoClient:
+    """PedidoClient autenticado da thread atual (uma sessão HTTP por thread)"""
+    pedido_client = getattr(clientes, 'pedido_client', None)
+    if pedido_client is None:
+        pedido_client = PedidoClient()
+        if not pedido_client.authenticate():
+            raise ValueError("Falha na autenticação no portal Servimed")
+        clientes.pedido_client = pedido_client
+    return pedido_client
+
+
+def _processar_pedido_lote(id_e_pedido: Tuple[str, Dict], pedido_client: PedidoClient,
+                           api_client: CallbackAPIClient, executor_api: ThreadPoolExecutor,
+                           produtos_resolvidos: Dict[str, Dict], framework: str,
+                           task_id: str) -> Tuple[str, Dict]:
+    """Um pedido do lote: (id_pedido, resultado); erros viram resultado 'error'"""
+    id_pedido, pedido = id_e_pedido
+    prefixo = f"{task_id}:{id_pedido}"
+    futuro_aleatorio = None
+    try:
+        produtos = pedido.get('produtos', [])
+        if not produtos:
+            raise ValueError("Nenhum produto especificado para o pedido")
+        
+        # Pedido aleatório na API não depende do Servimed: gerado durante a transmissão
+        futuro_aleatorio = executor_api.submit(gerar_pedido_aleatorio_api, api_client)
+        
+        produtos_verificados = montar_produtos_verificados(produtos, produtos_resolvidos, framework, prefixo)
+        codigo_pedido_servimed = pedido_client.realizar_pedido(produtos_verificados, produtos_resolvidos)
+        if not codigo_pedido_servimed:
+            raise ValueError("Falha ao realizar pedido no portal")
+        
+        pedido_aleatorio_id = futuro_aleatorio.result()
+        if not pedido_aleatorio_id:
+            raise ValueError("Falha crítica: não foi possível gerar pedido aleatório na API")
+        
+        patch_success = confirmar_pedido_api(api_client, pedido_aleatorio_id, codigo_pedido_servimed, prefixo)
+        return id_pedido, {
+            'status': 'success',
+            'codigo_pedido_servimed': codigo_pedido_servimed,
+            'pedido_aleatorio_api': pedido_aleatorio_id,
+            'patch_enviado': patch_success
+        }
+    except Exception as e:
+        print(f"[{prefixo}] Erro no pedido: {e}")
+        resultado_erro = {'status': 'error', 'error': str(e)}
+        pedido_aleatorio_id = pedido_aleatorio_sem_confirmacao(futuro_aleatorio, prefixo)
+        if pedido_aleatorio_id:
+            resultado_erro['pedido_aleatorio_api'] = pedido_aleatorio_id
+        return id_pedido, resultado_erro
+
+
+def montar_produtos_verificados(produtos: List[Dict], produtos_resolvidos: Dict[str, Dict],
+                                framework: str, task_id: str) -> List[Dict]:
+    """
+    Itens do pedido completados com os dados da verificação
+    
+    Produtos não encontrados entram como vieram; itens sem código/GTIN saem.
+    """
+    produtos_verificados = []
+    for produto in produtos:
+        codigo = produto.get('codigo', '')
+        
+        if not codigo and not produto.get('gtin', ''):
+            print(f"[{task_id}] Produto sem código/GTIN, pulando...")
+            continue
+        
+        produto_encontrado = produtos_resolvidos.get(PedidoClient.chave_produto(produto))
+        
+        if produto_encontrado:
+            # Adicionar dados do scraping ao produto do pedido
+            produto_completo = {
+                **produto,
+                'descricao': produto_encontrado.get('descricao', ''),
+                'preco_fabrica': produto_encontrado.get('preco_fabrica', 0),
+                'estoque_disponivel': produto_encontrado.get('estoque', 0),
+                'verificado_via': produto_encontrado.get('verificado_via', framework)
+            }
+            produtos_verificados.append(produto_completo)
+        else:
+            print(f"[{task_id}] Produto {codigo} não verificado, incluindo mesmo assim")
+            produtos_verificados.append(produto)
+    return produtos_verificados
+
+
+def autenticar_api(callback_url: str) -> CallbackAPIClient:
+    """Cliente da API Cotefácil autenticado (token do cache quando válido)"""
+    api_client = CallbackAPIClient(base_url=callback_url)
+    if not api_client.authenticate():
+        raise ValueError("Falha na autenticação com API Cotefacil")
+    return api_client
+
+
+def preparar_pedido_api(callback_url: str, task_id: str) -> Tuple[CallbackAPIClient, str]:
+    """
+    Lado Cotefácil que não depende do Servimed: autenticação + pedido aleatório
+    
+    Returns:
+        (cliente autenticado, id do pedido aleatório)
+    """
+    api_client = autenticar_api(callback_url)
+    
+    # Gerar pedido aleatório conforme requisito do desafio
+    pedido_aleatorio_id = gerar_pedido_aleatorio_api(api_client)
+    
+    if not pedido_aleatorio_id:
+        raise ValueError("Falha crítica: não foi possível gerar pedido aleatório na API")
+    
+    print(f"[{task_id}] Pedido aleatório gerado: {pedido_aleatorio_id}")
+    return api_client, pedido_aleatorio_id
+
+
+def confirmar_pedido_api(api_client: CallbackAPIClient, pedido_aleatorio_id: str,
+                         codigo_pedido_servimed: str, task_id: str) -> bool:
+    """
+    Envia o PATCH de confirmação do pedido aleatório com o código Servimed
+    
+    Returns:
+        bool: PATCH enviado com sucesso
+    """
+    # Fazer PATCH /pedido/:id com dados de confirmação
+    print(f"[{task_id}] 4. Enviando PATCH para /pedido/{pedido_aleatorio_id}...")
+    
+    callback_data = {
+        "codigo_confirmacao": str(codigo_pedido_servimed),
+        "status": "pedido_realizado"
+    }
+    
+    print(f"[{task_id}] Enviando confirmação com código Servimed: {codigo_pedido_servimed}")
+    
+    # Fazer PATCH conforme especificação do desafio
+    patch_success = fazer_patch_pedido(api_client, pedido_aleatorio_id, callback_data)
+    
+    if not patch_success:
+        print(f"[{task_id}] PATCH falhou, mas pedido foi realizado no Servimed")
+    
+    return patch_success
+
+
+def pedido_aleatorio_sem_confirmacao(futuro: Optional[Future], task_id: str) -> Optional[str]:
+    """
+    Id do pedido aleatório que a API chegou a criar num pedido que falhou
+    
+    O pedido aleatório é gerado em paralelo com o lado Servimed; se este falha,
+    o pedido já existe na API Cotefácil e fica sem o PATCH de confirmação.
+    
+    Returns:
+        str: id do pedido órfão, ou None se ele não chegou a ser criado
+    """
+    if futuro is None:
+        return None
+    try:
+        resultado = futuro.result()
+    except Exception:
+        return None
+    pedido_aleatorio_id = resultado[1] if isinstance(resultado, tuple) else resultado
+    if not pedido_aleatorio_id:
+        return None
+    print(f"[{task_id}] Pedido aleatório {pedido_aleatorio_id} criado na API ficou sem confirmação")
+    return pedido_aleatorio_id
 
 
 def gerar_pedido_aleatorio_api(api_client: CallbackAPIClient) -> str:
@@ -236,43 +427,39 @@ def gerar_pedido_aleatorio_api(api_client: CallbackAPIClient) -> str:
     try:
         print("Gerando pedido aleatório conforme requisito do desafio...")
         
-        # Tentativa 1: POST /pedido (dados vazios para gerar aleatório)
-        response = api_client.session.post(
-            f"{api_client.base_url}/pedido",
-            json={},  # Dados vazios conforme padrão para gerar aleatório
-            timeout=30
-        )
-        
-        print(f"POST /pedido - Status: {response.status_code}")
-        print(f"Response: {response.text}")
+        # Endpoint que já funcionou primeiro; os demais só se ele falhar
+        with _endpoint_lock:
+            conhecido = _endpoint_pedido_aleatorio.get(api_client.base_url)
+        endpoints = ENDPOINTS_PEDIDO_ALEATORIO
+        if conhecido:
+            endpoints = [conhecido] + [endpoint for endpoint in endpoints if endpoint != conhecido]
         
-        if response.status_code == 201:
-            resultado = response.json()
-            pedido_id = resultado.get('id')
-            if pedido_id:
-                print(f"Pedido aleatório gerado: {pedido_id}")
-                return str(pedido_id)
-        
-        # Tentativa 2: Outros endpoints possíveis
-        endpoints_alternativos = ["/pedido/random", "/pedido/gerar", "/pedido/novo"]
-        
-        for endpoint in endpoints_alternativos:
+        for endpoint in endpoints:
             try:
-                print(f"Tentando {endpoint}...")
-                response = api_client.session.post(
-                    f"{api_client.base_url}{endpoint}",
-                    json={},
+                print(f"Tentando POST {endpoint}...")
+                response = api_client.request(
+                    'POST',
+                    endpoint,
+                    json={},  # Dados vazios conforme padrão para gerar aleatório
                     timeout=30
                 )
                 
+                print(f"POST {endpoint} - Status: {response.status_code}")
+                
                 if response.status_code in [200, 201]:
                     resultado = response.json()
                     pedido_id = resultado.get('id') or resultado.get('pedido_id')
                     if pedido_id:
                         print(f"Pedido aleatório gerado via {endpoint}: {pedido_id}")
+                        with _endpoint_lock:
+                            _endpoint_pedido_aleatorio[api_client.base_url] = endpoint
                         return str(pedido_id)
-            except:
-                continue
+            except Exception as e:
+                print(f"Falha em POST {endpoint}: {e}")
+            
+            if endpoint == conhecido:
+                with _endpoint_lock:
+                    _endpoint_pedido_aleatorio.pop(api_client.base_url, None)
         
         print("Falha ao gerar pedido aleatório")
         return ""
@@ -298,8 +485,9 @@ def fazer_patch_pedido(api_client: CallbackAPIClient, pedido_id: str, callback_d
     try:
         print(f"Fazendo PATCH /pedido/{pedido_id} conforme requisito...")
         
-        response = api_client.session.patch(
-            f"{api_client.base_url}/pedido/{pedido_id}",
+        response = api_client.request(
+            'PATCH',
+            f"/pedido/{pedido_id}",
             json=callback_data,
             timeout=30
         )
@@ -62,6 +62,39 @@ class PedidoQueueClient:
         
         return result.id
     
+    def enqueue_pedidos_lote(self, usuario: str, senha: str, pedidos: List[Dict],
+                             callback_url: str = "https://desafio.cotefacil.net") -> str:
+        """
+        Enfileira vários pedidos numa única tarefa - sempre usa Scrapy
+        
+        Os produtos são verificados uma vez para o lote inteiro e os pedidos
+        compartilham as sessões autenticadas.
+        
+        Args:
+            usuario: Email do usuário
+            senha: Senha do usuário
+            pedidos: Lista de pedidos [{"id_pedido": "1234", "produtos": [{"gtin": "123", "codigo": "A123", "quantidade": 1}]}]
+            callback_url: URL para callback
+            
+        Returns:
+            str: ID da task criada
+        """
+        task_data = {
+            "usuario": usuario,
+            "senha": senha,
+            "pedidos": pedidos,
+            "callback_url": callback_url,
+            "framework": "scrapy"  # Sempre usar Scrapy
+        }
+        
+        result = self.app.send_task(
+            'src.nivel3.tasks.processar_pedidos_lote',
+            args=[task_data],
+            queue='celery'
+        )
+        
+        return result.id
+    
     def get_status(self, task_id: str) -> Dict[str, Any]:
         """
         Verifica status de uma tarefa
@@ -88,6 +121,7 @@ def main():
     if len(sys.argv) < 2:
         print("Uso:")
         print("  python pedido_queue_client.py enqueue <id_pedido> <codigo_produto> <quantidade> [gtin]")
+        print("  python pedido_queue_client.py lote <arquivo_pedidos.json>")
         print("  python pedido_queue_client.py status <task_id>")
         print("  python pedido_queue_client.py test")
         print("")
@@ -131,6 +165,30 @@ def main():
         task_id = client.enqueue_pedido(usuario, senha, id_pedido, produtos)
         print(f"Task criada: {task_id}")
     
+    elif command == "lote":
+        if len(sys.argv) < 3:
+            print("ERRO: Arquivo de pedidos necessário")
+            print("Uso: python pedido_queue_client.py lote <arquivo_pedidos.json>")
+            return
+        
+        # Arquivo com a lista de pedidos [{"id_pedido": ..., "produtos": [...]}]
+        with open(sys.argv[2], 'r', encoding='utf-8') as f:
+            pedidos = json.load(f)
+        
+        # Dados do .env
+        usuario = os.getenv('CALLBACK_API_USER')
+        senha = os.getenv('CALLBACK_API_PASSWORD')
+        
+        if not usuario or not senha:
+            print("ERRO: Credenciais não encontradas no .env")
+            print("Verifique CALLBACK_API_USER e CALLBACK_API_PASSWORD")
+            return
+        
+        print(f"Enfileirando lote de {len(pedidos)} pedidos com Scrapy...")
+        
+        task_id = client.enqueue_pedidos_lote(usuario, senha, pedidos)
+        print(f"Task criada: {task_id}")
+    
     elif command == "status":
         if len(sys.argv) < 3:
             print("ERRO: Task ID necessário")
@@ -0,0 +1,11 @@
+"""
+Rede
+====
+
+Recursos HTTP compartilhados pelo processo inteiro (coleta, pedidos e API de callback).
+"""
+
+from .conexoes import nova_sessao, estatisticas_conexoes
+from .orcamento import estatisticas_orcamentos
+
+__all__ = ["nova_sessao", "estatisticas_conexoes", "estatisticas_orcamentos"]
@@ -0,0 +1,149 @@
+"""
+Pool de Conexões HTTP
+=====================
+
+Registro de pools de conexão por host, compartilhado pelo processo.
+
+Cada cliente (download handler, sistema original, PedidoClient,
+CallbackAPIClient) continua com sua própria `requests.Session` - headers,
+cookies e token não se misturam - mas todas as sessões enviam pelo mesmo
+HTTPAdapter do host. Assim as conexões keep-alive (e o handshake TLS) com
+peapi.servimed.com.br e desafio.cotefacil.net são reaproveitadas entre
+clientes e entre tarefas Celery do mesmo worker.
+
+O tamanho do pool é limitado por host (POOL_CONEXOES_POR_HOST, com
+exceções em POOL_CONEXOES_HOSTS="host=n,..."); com o pool cheio, a
+requisição aguarda uma conexão livre em vez de abrir uma descartável.
+
+O mesmo adaptador aplica o orçamento de taxa do cluster (orcamento.py):
+toda requisição ao Servimed, de qualquer cliente, consome as fichas da
+conta e do host no Redis antes de sair.
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from dotenv import load_dotenv
+
+from .orcamento import limitar, recuar
+
+load_dotenv()
+
+POOL_CONEXOES_POR_HOST = int(os.getenv('POOL_CONEXOES_POR_HOST', '10'))
+POOL_CONEXOES_HOSTS = os.getenv('POOL_CONEXOES_HOSTS', '')
+POOL_BLOQUEAR = os.getenv('POOL_BLOQUEAR', 'true').lower() == 'true'
+
+
+def _tamanhos_por_host(valor: str) -> Dict[str, int]:
+    """Converte 'host=16,outro=4' em {'host': 16, 'outro': 4}"""
+    tamanhos = {}
+    for par in valor.split(','):
+        host, _, tamanho = par.partition('=')
+        if host.strip() and tamanho.strip().isdigit():
+            tamanhos[host.strip()] = int(tamanho)
+    return tamanhos
+
+
+class RegistroConexoes:
+    """Um HTTPAdapter (pool urllib3) por host, criado sob demanda"""
+
+    def __init__(self, tamanho_padrao: int = POOL_CONEXOES_POR_HOST,
+                 tamanhos: Optional[Dict[str, int]] = None, bloquear: bool = POOL_BLOQUEAR):
+        self.tamanho_padrao = tamanho_padrao
+        self.tamanhos = tamanhos if tamanhos is not None else _tamanhos_por_host(POOL_CONEXOES_HOSTS)
+        self.bloquear = bloquear
+        self._adaptadores: Dict[str, HTTPAdapter] = {}
+        self._lock = threading.Lock()
+
+    def adaptador(self, url: str) -> HTTPAdapter:
+        """Adaptador compartilhado do host da URL"""
+        partes = urlsplit(url)
+        chave = f'{partes.scheme}://{partes.netloc}'
+        adaptador = self._adaptadores.get(chave)
+        if adaptador is None:
+            with self._lock:
+                adaptador = self._adaptadores.get(chave)
+                if adaptador is None:
+                    tamanho = self.tamanhos.get(partes.hostname or '', self.tamanho_padrao)
+                    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho,
+                                            pool_block=self.bloquear)
+                    self._adaptadores[chave] = adaptador
+        return adaptador
+
+    def estatisticas(self) -> Dict[str, Dict]:
+        """
+        Requisições e conexões por host
+
+        `reutilizadas` são requisições atendidas por uma conexão keep-alive
+        já aberta; `conexoes_novas` inclui os handshakes TCP/TLS.
+        """
+        with self._lock:
+            adaptadores = dict(self._adaptadores)
+
+        resultado = {}
+        for chave, adaptador in adaptadores.items():
+            pools = adaptador.poolmanager.pools
+            requisicoes = novas = 0
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    requisicoes += pool.num_requests
+                    novas += pool.num_connections
+            resultado[chave] = {
+                'tamanho_pool': adaptador._pool_maxsize,
+                'requisicoes': requisicoes,
+                'conexoes_novas': novas,
+                'reutilizadas': max(0, requisicoes - novas)
+            }
+        return resultado
+
+    def limpar(self):
+        """Fecha e esquece todos os pools (ex.: processo filho após fork)"""
+        with self._lock:
+            adaptadores, self._adaptadores = self._adaptadores, {}
+        for adaptador in adaptadores.values():
+            adaptador.close()
+
+
+class _AdaptadorRoteado(BaseAdapter):
+    """Montado na sessão: encaminha cada requisição ao adaptador do host"""
+
+    def __init__(self, registro: RegistroConexoes):
+        super().__init__()
+        self.registro = registro
+
+    def send(self, request, **kwargs):
+        limitar(request.url, request.headers.get('loggeduser'))
+        response = self.registro.adaptador(request.url).send(request, **kwargs)
+        recuar(request.url, response.status_code, response.headers.get('Retry-After'))
+        return response
+
+    def close(self):
+        # Pools são do processo: fechar uma sessão não derruba as conexões das outras
+        pass
+
+
+registro = RegistroConexoes()
+
+if hasattr(os, 'register_at_fork'):
+    # Sockets herdados do processo pai (worker Celery prefork) não podem ser compartilhados
+    os.register_at_fork(after_in_child=registro.limpar)
+
+
+def nova_sessao(verify: bool = True) -> requests.Session:
+    """Sessão requests própria (headers/cookies) sobre os pools compartilhados"""
+    session = requests.Session()
+    session.verify = verify
+    adaptador = _AdaptadorRoteado(registro)
+    session.mount('http://', adaptador)
+    session.mount('https://', adaptador)
+    return session
+
+
+def estatisticas_conexoes() -> Dict[str, Dict]:
+    """Estatísticas dos pools do processo por host"""
+    return registro.estatisticas()
@@ -0,0 +1,240 @@
+"""
+Orçamento de Taxa do Cluster
+============================
+
+Token buckets no Redis do Celery, compartilhados por todos os processos e
+nós que acessam o Servimed. O ControladorTaxa (src/coleta/controle_taxa.py)
+ajusta a concorrência de um processo; o orçamento limita a soma das
+requisições de todos eles, para que mais workers não multipliquem a taxa
+que chega à API.
+
+Toda requisição aos hosts de COLETA_ORCAMENTO_HOSTS (padrão: o host de
+BASE_URL, a API do Servimed configurada) passa por `limitar()`,
+chamado pelo adaptador das sessões de src/rede/conexoes.py (download
+handler do Scrapy, sistema original e PedidoClient), e consome:
+
+1. uma ficha da conta (cabeçalho loggeduser): COLETA_ORCAMENTO_CONTA_RPS
+2. uma ficha do host, somando todas as contas: COLETA_ORCAMENTO_RPS
+
+Taxa 0 desliga o respectivo orçamento; COLETA_*_RAJADA é a quantidade
+máxima de fichas acumuladas. O cálculo das fichas roda num script Lua,
+atômico no Redis e com o relógio do próprio Redis (sem depender do relógio
+de cada nó). Um 403/429 com Retry-After pausa o orçamento do host inteiro,
+não só o worker que recebeu.
+
+O tempo de espera por fichas conta como latência para o ControladorTaxa,
+que deixa de aumentar a concorrência além da fatia do orçamento que cabe ao
+processo. Sem o pacote redis ou com o Redis fora do ar, cada processo
+segue apenas com o próprio controle.
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:  # redis é opcional fora dos workers Celery
+    redis = None
+
+load_dotenv()
+
+COLETA_ORCAMENTO_RPS = float(os.getenv('COLETA_ORCAMENTO_RPS', '0'))
+COLETA_ORCAMENTO_RAJADA = float(os.getenv('COLETA_ORCAMENTO_RAJADA', '5'))
+COLETA_ORCAMENTO_CONTA_RPS = float(os.getenv('COLETA_ORCAMENTO_CONTA_RPS', '0'))
+COLETA_ORCAMENTO_CONTA_RAJADA = float(os.getenv('COLETA_ORCAMENTO_CONTA_RAJADA', '3'))
+# Vazio limita o host da API configurada em BASE_URL (o mesmo que os coletores acessam)
+COLETA_ORCAMENTO_HOSTS = {host.strip() for host in
+                          (os.getenv('COLETA_ORCAMENTO_HOSTS') or
+                           urlsplit(os.getenv('BASE_URL') or 'https://peapi.servimed.com.br').hostname or '').split(',')
+                          if host.strip()}
+# Mesmo Redis do broker do Celery (src/nivel2/celery_app.py), salvo indicação em contrário
+COLETA_ORCAMENTO_REDIS_URL = os.getenv('COLETA_ORCAMENTO_REDIS_URL') or \
+    os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+
+PREFIXO_CHAVE = 'servimed:orcamento'
+
+# Segundos sem consultar o Redis depois de uma falha de acesso
+INTERVALO_RECONEXAO = 30
+
+# Respostas cujo Retry-After pausa o orçamento do host
+STATUS_PAUSA = {403, 429}
+
+# KEYS: fichas, pausa | ARGV: taxa (fichas/s), capacidade
+# Retorna a espera em ms (0 = ficha concedida)
+SCRIPT_FICHA = """
+local pausa = redis.call('PTTL', KEYS[2])
+if pausa > 0 then
+    return pausa
+end
+
+local taxa = tonumber(ARGV[1])
+local capacidade = tonumber(ARGV[2])
+local relogio = redis.call('TIME')
+local agora = tonumber(relogio[1]) + tonumber(relogio[2]) / 1000000
+
+local estado = redis.call('HMGET', KEYS[1], 'fichas', 'ts')
+local fichas = tonumber(estado[1]) or capacidade
+local ts = tonumber(estado[2]) or agora
+fichas = math.min(capacidade, fichas + math.max(0, agora - ts) * taxa)
+
+local espera = 0
+if fichas >= 1 then
+    fichas = fichas - 1
+else
+    espera = math.ceil((1 - fichas) / taxa * 1000)
+end
+
+redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'ts', tostring(agora))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacidade / taxa * 1000) + 1000)
+return espera
+"""
+
+
+class OrcamentoTaxa:
+    """Token bucket de um escopo (host do Servimed ou conta) guardado no Redis"""
+
+    def __init__(self, nome: str, taxa: float = COLETA_ORCAMENTO_RPS,
+                 capacidade: float = COLETA_ORCAMENTO_RAJADA, cliente=None,
+                 url: str = COLETA_ORCAMENTO_REDIS_URL):
+        if taxa <= 0:
+            raise ValueError('Taxa do orçamento precisa ser positiva')
+        if cliente is None:
+            if redis is None:
+                raise RuntimeError('pacote redis não instalado - orçamento do cluster indisponível')
+            cliente = redis.Redis.from_url(url, socket_timeout=5, socket_connect_timeout=5)
+
+        self.nome = nome
+        self.taxa = taxa
+        self.capacidade = max(1.0, capacidade)
+        self.chave = f'{PREFIXO_CHAVE}:{nome}'
+        self.chave_pausa = f'{self.chave}:pausa'
+        self.cliente = cliente
+        self._script = cliente.register_script(SCRIPT_FICHA)
+
+        self.fichas = 0
+        self.espera_total = 0.0
+        self.falhas = 0
+        self._ignorar_ate = 0.0
+        self._lock = threading.Lock()
+
+    def adquirir(self) -> float:
+        """
+        Aguarda uma ficha do orçamento do cluster
+
+        Returns:
+            float: Segundos esperados
+        """
+        esperado = 0.0
+        if time.monotonic() < self._ignorar_ate:
+            return esperado
+        while True:
+            try:
+                espera_ms = int(self._script(keys=[self.chave, self.chave_pausa],
+                                             args=[self.taxa, self.capacidade]))
+            except Exception as e:
+                # Redis indisponível: segue só com o controle local do processo
+                self._registrar_falha(e)
+                return esperado
+            if espera_ms <= 0:
+                with self._lock:
+                    self.fichas += 1
+                    self.espera_total += esperado
+                return esperado
+            time.sleep(espera_ms / 1000)
+            esperado += espera_ms / 1000
+
+    def pausar(self, segundos: float):
+        """Suspende o orçamento para todos os workers (Retry-After da API)"""
+        if segundos <= 0 or time.monotonic() < self._ignorar_ate:
+            return
+        try:
+            self.cliente.set(self.chave_pausa, '1', px=int(segundos * 1000))
+        except Exception as e:
+            self._registrar_falha(e)
+
+    def _registrar_falha(self, erro: Exception):
+        with self._lock:
+            self.falhas += 1
+            self._ignorar_ate = time.monotonic() + INTERVALO_RECONEXAO
+            primeira = self.falhas == 1
+        if primeira:
+            print(f"Orçamento {self.nome}: Redis indisponível ({erro}) - usando apenas o controle local")
+
+    def estatisticas(self):
+        """Fichas obtidas, espera acumulada e falhas de acesso ao Redis neste processo"""
+        with self._lock:
+            return {
+                'taxa': self.taxa,
+                'fichas': self.fichas,
+                'espera': round(self.espera_total, 3),
+                'falhas': self.falhas
+            }
+
+
+_orcamentos: Dict[str, OrcamentoTaxa] = {}
+_lock = threading.Lock()
+
+
+def orcamento_para(nome: str, taxa: float = COLETA_ORCAMENTO_RPS,
+                   capacidade: float = COLETA_ORCAMENTO_RAJADA) -> Optional[OrcamentoTaxa]:
+    """Orçamento do escopo, compartilhado pelo processo; None quando desligado"""
+    if taxa <= 0 or redis is None:
+        return None
+    with _lock:
+        orcamento = _orcamentos.get(nome)
+        if orcamento is None:
+            orcamento = _orcamentos[nome] = OrcamentoTaxa(nome, taxa, capacidade)
+        return orcamento
+
+
+def limitar(url: str, conta: Optional[str] = None) -> float:
+    """
+    Consome as fichas da conta e do host antes de uma requisição
+
+    A ficha da conta vem primeiro: esperar por ela segurando uma ficha do
+    host desperdiçaria o orçamento das outras contas.
+
+    Returns:
+        float: Segundos esperados
+    """
+    host = urlsplit(url).hostname or ''
+    if host not in COLETA_ORCAMENTO_HOSTS:
+        return 0.0
+
+    esperado = 0.0
+    if conta:
+        orcamento = orcamento_para(f'{host}:conta:{conta}', COLETA_ORCAMENTO_CONTA_RPS,
+                                   COLETA_ORCAMENTO_CONTA_RAJADA)
+        if orcamento is not None:
+            esperado += orcamento.adquirir()
+    orcamento = orcamento_para(host, COLETA_ORCAMENTO_RPS, COLETA_ORCAMENTO_RAJADA)
+    if orcamento is not None:
+        esperado += orcamento.adquirir()
+    return esperado
+
+
+def recuar(url: str, status: int, retry_after: Optional[str]):
+    """403/429 com Retry-After (em segundos) pausa o orçamento do host para todos os workers"""
+    if status not in STATUS_PAUSA or not retry_after:
+        return
+    host = urlsplit(url).hostname or ''
+    orcamento = orcamento_para(host, COLETA_ORCAMENTO_RPS, COLETA_ORCAMENTO_RAJADA) \
+        if host in COLETA_ORCAMENTO_HOSTS else None
+    if orcamento is None:
+        return
+    try:
+        orcamento.pausar(float(retry_after))
+    except ValueError:
+        pass
+
+
+def estatisticas_orcamentos() -> Dict[str, Dict]:
+    """Estatísticas de cada orçamento usado pelo processo"""
+    with _lock:
+        orcamentos = dict(_orcamentos)
+    return {nome: orcamento.estatisticas() for nome, orcamento in orcamentos.items()}
@@ -4,17 +4,30 @@ CUSTOM DOWNLOAD HANDLER - ANTI-BOT BYPASS
 
 Handler customizado que usa Python requests ao invés do engine do Scrapy
 para contornar sistemas de detecção anti-bot.
+
+As chamadas requests (bloqueantes) rodam em um pool de threads limitado,
+fora da thread do reactor, para que CONCURRENT_REQUESTS tenha efeito real.
+Com SERVIMED_CONTROLE_TAXA, cada requisição passa pelo controlador adaptativo
+do host (src/coleta/controle_taxa.py), que define quantas ficam em voo.
+As sessões de src/rede aplicam ainda o orçamento de taxa do cluster no Redis
+(src/rede/orcamento.py), por conta e somando todos os workers.
 """
 
 import os
 import time
-import requests
+import threading
 import urllib3
 from scrapy.http import HtmlResponse, TextResponse
 from scrapy.core.downloader.handlers.http import HTTPDownloadHandler
 from scrapy.exceptions import NotSupported
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
 from dotenv import load_dotenv
 
+from ..coleta.controle_taxa import controlador_para
+from ..rede import nova_sessao, estatisticas_conexoes, estatisticas_orcamentos
+from ..rede.orcamento import limitar
+
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 load_dotenv()
@@ -34,9 +47,22 @@ class AntiDetectionDownloadHandler(HTTPDownloadHandler):
         self.client_id = os.getenv('CLIENT_ID')
         self.x_cart = os.getenv('X_CART')
         
-        # Sessão requests reutilizável
-        self.session = requests.Session()
-        self.session.verify = False
+        # Sessões requests reutilizáveis - uma por thread do pool
+        self._sessions = threading.local()
+        
+        # Controle adaptativo de taxa por host (substitui o atraso fixo)
+        self.controle_taxa = settings.getbool('SERVIMED_CONTROLE_TAXA')
+        self._controladores = {}
+        self._crawler = crawler
+        
+        # Pool de threads limitado para as requisições bloqueantes
+        max_threads = settings.getint('SERVIMED_DOWNLOAD_THREADS') or settings.getint('CONCURRENT_REQUESTS', 1)
+        self.threadpool = ThreadPool(minthreads=1, maxthreads=max_threads, name='servimed-download')
+        self.threadpool.start()
+        
+        from twisted.internet import reactor
+        self._reactor = reactor
+        self._shutdown_trigger = reactor.addSystemEventTrigger('during', 'shutdown', self.threadpool.stop)
         
         # Headers padrão que funcionam
         self.default_headers = {
@@ -66,83 +92,139 @@ class AntiDetectionDownloadHandler(HTTPDownloadHandler):
         }
     
     def download_request(self, request, spider):
-        """Substitui requisições Scrapy por requests Python"""
+        """Substitui requisições Scrapy por requests Python sem bloquear o reactor"""
+        
+        d = threads.deferToThreadPool(self._reactor, self.threadpool, self._download_blocking, request)
+        d.addCallback(self._log_response, request, spider)
+        d.addErrback(self._fallback_download, request, spider)
+        return d
+    
+    def close(self):
+        """Encerra o pool de threads junto com o handler padrão"""
+        stats = getattr(self._crawler, 'stats', None)
+        for host, controlador in self._controladores.items():
+            estado = controlador.estatisticas()
+            if stats is not None:
+                for chave in ('concorrencia', 'intervalo', 'latencia_media', 'ok', 'recuo', 'lenta'):
+                    stats.set_value(f'taxa/{host}/{chave}', estado[chave])
+        if stats is not None:
+            for host, estado in estatisticas_conexoes().items():
+                for chave, valor in estado.items():
+                    stats.set_value(f'conexoes/{host}/{chave}', valor)
+            for nome, estado in estatisticas_orcamentos().items():
+                for chave, valor in estado.items():
+                    stats.set_value(f'orcamento/{nome}/{chave}', valor)
         
+        if self._shutdown_trigger is not None:
+            self._reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+            self.threadpool.stop()
+        return super().close()
+    
+    def _get_session(self):
+        """Retorna a sessão requests da thread atual (requests.Session não é thread-safe)"""
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            # Pools de conexão do processo: keep-alive reaproveitado entre threads e coletas
+            session = nova_sessao(verify=False)
+            self._sessions.session = session
+        return session
+    
+    def _build_headers(self, request):
+        """Monta headers padrão + headers da requisição + autenticação"""
+        headers = self.default_headers.copy()
+        
+        # Adicionar headers específicos da requisição
+        for key, value in request.headers.items():
+            if isinstance(value, list) and len(value) > 0:
+                headers[key.decode()] = value[0].decode()
+            elif isinstance(value, bytes):
+                headers[key.decode()] = value.decode()
+            elif isinstance(value, str):
+                headers[key] = value
+        
+        # Headers específicos de autenticação
+        if self.access_token:
+            headers['accesstoken'] = self.access_token
+        if self.logged_user:
+            headers['loggeduser'] = self.logged_user
+        if self.x_cart:
+            headers['x-cart'] = self.x_cart
+        
+        headers['x-peperone'] = str(int(time.time() * 1000))
+        return headers
+    
+    def _build_cookies(self, request):
+        """Monta cookies padrão + cookies da requisição"""
+        cookies = self.default_cookies.copy()
+        
+        # Adicionar cookies da requisição se houver
+        if hasattr(request, 'cookies') and request.cookies:
+            cookies.update(request.cookies)
+        
+        return cookies
+    
+    def _download_blocking(self, request):
+        """Executa a requisição com requests - roda em uma thread do pool"""
+        
+        if not self.controle_taxa:
+            return self._enviar(request)
+        
+        controlador = controlador_para(request.url)
+        self._controladores[controlador.host] = controlador
+        inicio = controlador.adquirir()
+        status, retry_after = None, None
         try:
-            # Preparar headers
-            headers = self.default_headers.copy()
-            
-            # Adicionar headers específicos da requisição
-            for key, value in request.headers.items():
-                if isinstance(value, list) and len(value) > 0:
-                    headers[key.decode()] = value[0].decode()
-                elif isinstance(value, bytes):
-                    headers[key.decode()] = value.decode()
-                elif isinstance(value, str):
-                    headers[key] = value
-            
-            # Headers específicos de autenticação
-            if self.access_token:
-                headers['accesstoken'] = self.access_token
-            if self.logged_user:
-                headers['loggeduser'] = self.logged_user
-            if self.x_cart:
-                headers['x-cart'] = self.x_cart
-            
-            headers['x-peperone'] = str(int(time.time() * 1000))
-            
-            # Preparar cookies
-            cookies = self.default_cookies.copy()
-            
-            # Adicionar cookies da requisição se houver
-            if hasattr(request, 'cookies') and request.cookies:
-                cookies.update(request.cookies)
-            
-            # Fazer requisição com requests
-            if request.method == 'POST':
-                # Para POST, usar JSON body se disponível
-                json_data = None
-                data = None
-                
-                if hasattr(request, 'body') and request.body:
-                    try:
-                        import json
-                        json_data = json.loads(request.body.decode('utf-8'))
-                        headers['Content-Type'] = 'application/json'
-                    except:
-                        data = request.body
-                
-                response = self.session.post(
-                    request.url,
-                    headers=headers,
-                    cookies=cookies,
-                    json=json_data,
-                    data=data,
-                    timeout=10,  # Reduced timeout
-                    verify=False
-                )
-            else:
-                # GET request
-                response = self.session.get(
-                    request.url,
-                    headers=headers,
-                    cookies=cookies,
-                    timeout=10,  # Reduced timeout
-                    verify=False
-                )
-            
-            # Converter resposta requests para Response do Scrapy
-            scrapy_response = self._convert_response(response, request)
-            
-            # Log do resultado
-            spider.logger.info(f"Anti-detection request: {request.method} {request.url} -> {response.status_code}")
-            
-            return scrapy_response
-            
-        except Exception as e:
-            spider.logger.error(f"Anti-detection download failed: {e}")
-            # Fallback para handler padrão
-            return super().download_request(request, spider)
+            response = self._enviar(request)
+            status, retry_after = response.status, response.headers.get('Retry-After')
+            return response
+        finally:
+            controlador.liberar(inicio, status, retry_after.decode() if retry_after else None)
+    
+    def _enviar(self, request):
+        """Requisição HTTP propriamente dita"""
+        
+        headers = self._build_headers(request)
+        cookies = self._build_cookies(request)
+        session = self._get_session()
+        
+        # Fazer requisição com requests
+        if request.method == 'POST':
+            # Corpo enviado como está (já serializado pelo spider)
+            response = session.post(
+                request.url,
+                headers=headers,
+                cookies=cookies,
+                data=request.body or None,
+                timeout=10,  # Reduced timeout
+                verify=False
+            )
+        else:
+            # GET request
+            response = session.get(
+                request.url,
+                headers=headers,
+                cookies=cookies,
+                timeout=10,  # Reduced timeout
+                verify=False
+            )
+        
+        # Converter resposta requests para Response do Scrapy
+        return self._convert_response(response, request)
+    
+    def _log_response(self, scrapy_response, request, spider):
+        """Log do resultado (thread do reactor)"""
+        spider.logger.info(f"Anti-detection request: {request.method} {request.url} -> {scrapy_response.status}")
+        return scrapy_response
+    
+    def _fallback_download(self, failure, request, spider):
+        """Em caso de falha, usa o handler padrão do Scrapy"""
+        spider.logger.error(f"Anti-detection download failed: {failure.value}")
+        # O handler padrão não passa pelas sessões de src/rede: a ficha do
+        # orçamento é consumida aqui, numa thread do pool (pode esperar)
+        d = threads.deferToThreadPool(self._reactor, self.threadpool, limitar, request.url, self.logged_user)
+        d.addCallback(lambda _: HTTPDownloadHandler.download_request(self, request, spider))
+        return d
     
     def _convert_response(self, requests_response, scrapy_request):
         """Converte resposta requests para Response do Scrapy"""
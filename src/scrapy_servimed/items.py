@@ -21,3 +21,9 @@ class ProdutoItem(scrapy.Item):
     url = scrapy.Field()
     timestamp = scrapy.Field()
     usuario = scrapy.Field()
+    
+    # Coleta incremental: 'novo', 'alterado' ou 'removido'
+    alteracao = scrapy.Field()
+    
+    # Termos de busca que encontraram o produto (coleta com vários filtros)
+    filtros = scrapy.Field()
@@ -19,7 +19,7 @@ import json
 import logging
 from scrapy import signals
 from scrapy.http import HtmlResponse
-from scrapy.exceptions import NotConfigured
+from scrapy.exceptions import NotConfigured, IgnoreRequest
 from itemadapter import is_item, ItemAdapter
 from dotenv import load_dotenv
 
@@ -116,6 +116,13 @@ class ServimedSessionMiddleware:
         # SSL bypass se necessário
         request.meta['dont_filter'] = True
         
+        # Páginas além do fim do catálogo já detectado não precisam ser baixadas
+        page = request.meta.get('page')
+        ultima_pagina_de = getattr(spider, 'ultima_pagina_de', None)
+        ultima_pagina = ultima_pagina_de(request.meta.get('filtro')) if ultima_pagina_de else None
+        if page and ultima_pagina is not None and page > ultima_pagina:
+            raise IgnoreRequest(f'Página {page} após o fim do catálogo ({ultima_pagina})')
+        
         return None
     
     def process_response(self, request, response, spider):
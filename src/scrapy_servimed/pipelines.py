@@ -11,30 +11,113 @@ import os
 from datetime import datetime
 from pathlib import Path
 from itemadapter import ItemAdapter
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider, DropItem, NotConfigured
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
 import logging
 
+from ..api_client import CallbackAPIClient
+from ..api_client.uploader import CallbackUploader
+from ..catalogo import CatalogoIndex, HistoricoPrecos
+from ..catalogo.delta import DeltaStore, REMOVIDO
+from ..coleta import Produto
+from ..coleta import colunar
+from .items import ProdutoItem
+
 logger = logging.getLogger(__name__)
 
+# Arquivo de resultados padrão (sem extensão); coletas em processo usam um por execução
+ARQUIVO_RESULTADOS = Path('data') / 'servimed_produtos_scrapy'
+
+
+def arquivo_resultados(spider, extensao):
+    """Arquivo de saída da coleta: `arquivo_resultados` do spider ou o padrão"""
+    base = getattr(spider, 'arquivo_resultados', '')
+    base = Path(base) if isinstance(base, (str, Path)) and base else ARQUIVO_RESULTADOS
+    return base.parent / f'{base.name}{extensao}'
+
+
+def limpar_produto(produto):
+    """Reduz um produto aos campos exportados (formato da API de callback)"""
+    limpo = {
+        'gtin': produto.get('gtin', ''),
+        'codigo': produto.get('codigo', ''),
+        'descricao': produto.get('descricao', ''),
+        'preco_fabrica': produto.get('preco_fabrica', 0.0),
+        'estoque': produto.get('estoque', 0)
+    }
+    if produto.get('filtros'):
+        limpo['filtros'] = list(produto['filtros'])
+    return limpo
+
 
 class ServimedPipeline:
-    """Pipeline principal para processamento de produtos"""
+    """
+    Pipeline principal para processamento de produtos
+    
+    Formatos de exportação (setting SERVIMED_EXPORT_FORMAT):
+    - json: acumula em memória (registros compactos) e grava um documento
+      único ao final (padrão)
+    - jsonl: grava um produto por linha conforme os itens chegam, em lotes,
+      num arquivo temporário renomeado atomicamente ao final da coleta
+    """
     
-    def __init__(self):
+    def __init__(self, formato='json', flush_every=100, stats=None):
+        self.ativo = True
+        self.stats = stats
         self.items_processed = 0
         self.produtos = []
+        self.formato = formato
+        self.flush_every = max(1, flush_every)
+        self.buffer = []
+        self.arquivo = None
+        self.arquivo_tmp = None
+        self.arquivo_saida = None
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        formato = crawler.settings.get('SERVIMED_EXPORT_FORMAT', 'json').lower()
+        if formato not in ('json', 'jsonl'):
+            logger.warning(f'Formato de exportação desconhecido: {formato} - usando json')
+            formato = 'json'
+        return cls(
+            formato=formato,
+            flush_every=crawler.settings.getint('SERVIMED_EXPORT_FLUSH_EVERY', 100),
+            stats=crawler.stats
+        )
         
     def open_spider(self, spider):
         """Inicializa pipeline quando spider abre"""
-        logger.info(f'Iniciando pipeline para spider {spider.name}')
+        logger.info(f'Iniciando pipeline para spider {spider.name} (formato {self.formato})')
         self.start_time = time.time()
+        
+        # Fatia de coleta dividida: o arquivo consolidado é gravado pela exportação;
+        # coletas em processo sem arquivo mantêm os itens só em memória
+        self.ativo = (getattr(spider, 'fatia', False) is not True
+                      and getattr(spider, 'arquivo_resultados', '') is not False)
+        if not self.ativo:
+            return
+        
+        self.arquivo_saida = arquivo_resultados(spider, f'.{self.formato}')
+        if self.formato == 'jsonl':
+            self.arquivo_saida.parent.mkdir(parents=True, exist_ok=True)
+            
+            # Temporário exclusivo desta coleta - coletas simultâneas não se sobrescrevem
+            self.arquivo_tmp = self.arquivo_saida.parent / f'{self.arquivo_saida.name}.{os.getpid()}.{id(self)}.tmp'
+            self.arquivo = open(self.arquivo_tmp, 'w', encoding='utf-8')
     
     def close_spider(self, spider):
         """Finaliza pipeline quando spider fecha"""
         duration = time.time() - self.start_time
         logger.info(f'Pipeline finalizado: {self.items_processed} itens em {duration:.2f}s')
         
+        if not self.ativo:
+            return
+        if self.formato == 'jsonl':
+            self.finalizar_jsonl()
         # Salvar dados se houver produtos
-        if self.produtos:
+        elif self.produtos:
             self.save_to_json()
     
     def process_item(self, item, spider):
@@ -56,40 +139,55 @@ class ServimedPipeline:
             logger.warning(f'Erro na conversão de tipos: {e}')
         
         # Não adicionar timestamp ou outros campos desnecessários
-        # Adicionar à lista
-        self.produtos.append(dict(adapter))
+        if not self.ativo:
+            pass
+        elif self.formato == 'jsonl':
+            self.buffer.append(json.dumps(limpar_produto(adapter), ensure_ascii=False))
+            if len(self.buffer) >= self.flush_every:
+                self.flush()
+        else:
+            self.produtos.append(Produto.de_mapping(adapter))
         self.items_processed += 1
         
         logger.info(f'Produto processado: {adapter.get("codigo")} - {adapter.get("descricao", "")[:50]}...')
         
         return item
     
+    def flush(self):
+        """Grava as linhas pendentes no arquivo JSONL temporário"""
+        if not self.buffer or self.arquivo is None:
+            return
+        self.arquivo.write('\n'.join(self.buffer) + '\n')
+        self.arquivo.flush()
+        self.buffer = []
+    
+    def finalizar_jsonl(self):
+        """Grava o restante e publica o arquivo JSONL com rename atômico"""
+        if self.arquivo is None:
+            return
+        try:
+            self.flush()
+            self.arquivo.close()
+            os.replace(self.arquivo_tmp, self.arquivo_saida)
+            logger.info(f'Dados salvos em {self.arquivo_saida}')
+            self.registrar_arquivo()
+        except Exception as e:
+            # O temporário fica em disco com o que já foi gravado
+            logger.error(f'Erro ao finalizar JSONL ({self.arquivo_tmp}): {e}')
+        finally:
+            self.arquivo = None
+    
     def save_to_json(self):
         """Salva produtos em arquivo JSON"""
         try:
             # Garantir que o diretório existe
-            data_dir = Path('data')
-            data_dir.mkdir(exist_ok=True)
-            
-            # Arquivo de saída
-            output_file = data_dir / 'servimed_produtos_scrapy.json'
-            
-            # Limpar produtos - apenas campos necessários
-            produtos_limpos = []
-            for produto in self.produtos:
-                produto_limpo = {
-                    'gtin': produto.get('gtin', ''),
-                    'codigo': produto.get('codigo', ''),
-                    'descricao': produto.get('descricao', ''),
-                    'preco_fabrica': produto.get('preco_fabrica', 0.0),
-                    'estoque': produto.get('estoque', 0)
-                }
-                produtos_limpos.append(produto_limpo)
+            output_file = self.arquivo_saida
+            output_file.parent.mkdir(parents=True, exist_ok=True)
             
             # Metadados
             metadata = {
                 'scraped_at': datetime.now().isoformat(),
-                'total_produtos': len(produtos_limpos),
+                'total_produtos': len(self.produtos),
                 'scraper': 'scrapy',
                 'fonte': 'servimed'
             }
@@ -97,48 +195,449 @@ class ServimedPipeline:
             # Dados finais
             data = {
                 'metadata': metadata,
-                'produtos': produtos_limpos
+                'produtos': self.produtos
             }
             
-            # Salvar
+            # Salvar - cada registro é limpo (apenas campos necessários) ao ser gravado
             with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+                json.dump(data, f, ensure_ascii=False, indent=2, default=limpar_produto)
             
             logger.info(f'Dados salvos em {output_file}')
+            self.registrar_arquivo()
             
         except Exception as e:
             logger.error(f'Erro ao salvar JSON: {e}')
+    
+    def registrar_arquivo(self):
+        """Informa nas estatísticas o arquivo gravado por esta coleta"""
+        if self.stats is not None:
+            self.stats.set_value('export/arquivo', str(self.arquivo_saida))
+
+
+class ColunarPipeline:
+    """
+    Snapshot colunar (Parquet ou Arrow IPC) dos produtos da coleta
+    
+    Ativado pela setting SERVIMED_EXPORT_COLUNAR ('parquet' ou 'arrow') ou
+    pelo argumento `exportar` do spider. Grava
+    data/servimed_produtos_scrapy.parquet (ou .arrow) ao final da coleta, ou
+    o arquivo da execução quando o spider informa `arquivo_resultados`.
+    Sem pyarrow instalado o pipeline fica desabilitado.
+    
+    Roda antes do DeltaPipeline para que o snapshot tenha todos os produtos
+    (inclusive os inalterados) e ignora os itens 'removido'. O arquivo só é
+    publicado quando a coleta termina normalmente ('finished').
+    """
+    
+    def __init__(self, formato='', lote=colunar.EXPORT_COLUNAR_LOTE, stats=None):
+        self.formato = formato
+        self.lote = lote
+        self.stats = stats
+        self.exportador = None
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        formato = crawler.settings.get('SERVIMED_EXPORT_COLUNAR', '').lower()
+        if not colunar.disponivel():
+            if formato:
+                logger.warning('pyarrow não instalado: exportação colunar desabilitada')
+            raise NotConfigured('pyarrow não instalado')
+        pipeline = cls(
+            formato=formato,
+            lote=crawler.settings.getint('SERVIMED_EXPORT_COLUNAR_LOTE', colunar.EXPORT_COLUNAR_LOTE),
+            stats=crawler.stats
+        )
+        # O motivo do encerramento só chega no sinal (close_spider não o recebe)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+    
+    def open_spider(self, spider):
+        formato = (getattr(spider, 'exportar', '') or self.formato).lower()
+        if not formato:
+            return
+        if formato not in colunar.FORMATOS:
+            logger.warning(f'Formato colunar desconhecido: {formato} - exportação colunar ignorada')
+            return
+        arquivo = arquivo_resultados(spider, colunar.FORMATOS[formato])
+        self.exportador = colunar.ExportadorColunar(arquivo, formato, self.lote)
+        logger.info(f'Exportação colunar ativa: {arquivo}')
+    
+    def process_item(self, item, spider):
+        if self.exportador is not None:
+            adapter = ItemAdapter(item)
+            if adapter.get('codigo') and adapter.get('alteracao') != REMOVIDO:
+                self.exportador.adicionar(adapter)
+        return item
+    
+    def spider_closed(self, spider, reason):
+        if self.exportador is None:
+            return
+        exportador, self.exportador = self.exportador, None
+        if reason != 'finished':
+            logger.info(f'Coleta encerrada ({reason}): snapshot colunar descartado')
+            exportador.descartar()
+            return
+        try:
+            arquivo = exportador.fechar()
+        except Exception as e:
+            logger.error(f'Erro ao gravar exportação colunar: {e}')
+            exportador.descartar()
+            return
+        logger.info(f'Snapshot colunar salvo em {arquivo}: {exportador.total} produtos')
+        if self.stats is not None:
+            self.stats.set_value('export/colunar/arquivo', str(arquivo))
+            self.stats.set_value('export/colunar/produtos', exportador.total)
 
 
 class CeleryPipeline:
-    """Pipeline para integração com Celery (compatibilidade)"""
+    """
+    Pipeline para integração com Celery
     
-    def __init__(self):
+    Com SERVIMED_CALLBACK_STREAMING ativo e `callback_url` informado no
+    spider, os produtos são enviados para a API de callback durante a
+    coleta por um CallbackUploader. Sem isso, apenas acumula os dados
+    (compatibilidade).
+    
+    Com a fila do uploader cheia, o item espera numa thread própria do
+    pipeline (o pool padrão do reactor fica livre para DNS e afins); com
+    SERVIMED_CALLBACK_MAX_ESPERA itens esperando, o engine é pausado até a
+    fila andar.
+    """
+    
+    def __init__(self, streaming=False, stats=None, max_espera=100, crawler=None):
         self.callback_data = []
+        self.streaming = streaming
+        self.stats = stats
+        self.max_espera = max(1, max_espera)
+        self.crawler = crawler
+        self.uploader = None
+        self.threadpool = None
+        self.aguardando = 0
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            streaming=crawler.settings.getbool('SERVIMED_CALLBACK_STREAMING', False),
+            stats=crawler.stats,
+            max_espera=crawler.settings.getint('SERVIMED_CALLBACK_MAX_ESPERA', 100),
+            crawler=crawler
+        )
+    
+    def open_spider(self, spider):
+        callback_url = getattr(spider, 'callback_url', '')
+        if self.streaming and callback_url:
+            logger.info(f'Envio em streaming para {callback_url}')
+            self.uploader = CallbackUploader(CallbackAPIClient(base_url=callback_url)).iniciar()
+            # Uma thread basta: os itens esperam em ordem por espaço na fila do uploader
+            self.threadpool = ThreadPool(minthreads=1, maxthreads=1, name='servimed-callback')
+            self.threadpool.start()
+            from twisted.internet import reactor
+            self._shutdown_trigger = reactor.addSystemEventTrigger('during', 'shutdown', self.threadpool.stop)
+            if self.stats is not None:
+                self.stats.set_value('callback/streaming', True)
     
     def process_item(self, item, spider):
-        """Prepara dados para callback"""
+        """Prepara dados para callback (ou enfileira para envio imediato)"""
         adapter = ItemAdapter(item)
         
+        if self.uploader is not None:
+            if not adapter.get('codigo'):
+                return item
+            produto = limpar_produto(adapter)
+            # Com itens já esperando, este entra atrás deles: a ordem dos lotes segue a dos itens
+            if self.aguardando == 0 and self.uploader.enviar_sem_bloquear(produto):
+                return item
+            # Contrapressão: envio atrasado - o item espera (fora do reactor) por espaço na fila
+            from twisted.internet import reactor
+            self.aguardando += 1
+            if self.aguardando >= self.max_espera:
+                self.pausar_engine(True)
+            d = threads.deferToThreadPool(reactor, self.threadpool, self.uploader.enviar, produto)
+            d.addBoth(self.liberar_espera)
+            d.addCallback(lambda _: item)
+            return d
+        
         # Formato para callback API
         if adapter.get('gtin'):
-            callback_item = {
-                'gtin': adapter.get('gtin', ''),
-                'codigo': adapter.get('codigo', ''),
-                'descricao': adapter.get('descricao', ''),
-                'preco_fabrica': adapter.get('preco_fabrica', 0.0),
-                'estoque': adapter.get('estoque', 0)
-            }
-            
-            self.callback_data.append(callback_item)
+            self.callback_data.append(Produto.de_mapping(adapter))
         
         return item
     
     def close_spider(self, spider):
-        """Envia dados para sistema de callback se necessário"""
+        """Finaliza o envio em streaming ou registra os dados acumulados"""
+        if self.uploader is not None:
+            from twisted.internet import reactor
+            d = threads.deferToThreadPool(reactor, self.threadpool, self.uploader.finalizar)
+            d.addCallback(self.registrar_relatorio)
+            d.addBoth(self.encerrar_pool)
+            return d
+        
         if hasattr(spider, 'callback_url') and self.callback_data:
             logger.info(f'Preparando {len(self.callback_data)} itens para callback')
             
             # Aqui poderia integrar com o sistema de callback existente
             # Por ora, apenas logamos
             logger.info('Dados prontos para integração com sistema atual')
+    
+    def pausar_engine(self, pausar):
+        """Pausa (ou retoma) o agendamento de páginas enquanto muitos itens esperam envio"""
+        engine = getattr(self.crawler, 'engine', None)
+        if engine is None or engine.paused == pausar:
+            return
+        if pausar:
+            logger.info(f'{self.aguardando} itens aguardando envio: coleta pausada')
+            engine.pause()
+            if self.stats is not None:
+                self.stats.inc_value('callback/pausas')
+        else:
+            engine.unpause()
+    
+    def liberar_espera(self, resultado):
+        """Item entregue ao uploader: retoma a coleta quando a espera cai à metade"""
+        self.aguardando -= 1
+        if self.aguardando <= self.max_espera // 2:
+            self.pausar_engine(False)
+        return resultado
+    
+    def encerrar_pool(self, resultado):
+        if self.threadpool is not None:
+            from twisted.internet import reactor
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self.threadpool.stop()
+            self.threadpool = None
+        return resultado
+    
+    def registrar_relatorio(self, relatorio):
+        """Publica o resultado do envio nas estatísticas do crawler"""
+        logger.info(f'Envio em streaming finalizado: {relatorio["lotes_ok"]}/{relatorio["total_lotes"]} '
+                    f'lotes ok, {relatorio["total_produtos"]} produtos')
+        if self.stats is not None:
+            self.stats.set_value('callback/success', relatorio['success'])
+            self.stats.set_value('callback/produtos', relatorio['total_produtos'])
+            self.stats.set_value('callback/lotes_ok', relatorio['lotes_ok'])
+            self.stats.set_value('callback/lotes_falhos', relatorio['lotes_falhos'])
+            # Lotes aceitos: um reenvio depois da coleta pula esses (mesma ordem de lotes)
+            self.stats.set_value('callback/lotes_enviados',
+                                 [lote['lote'] for lote in relatorio['lotes'] if lote['status'] == 'ok'])
+            if relatorio.get('error'):
+                self.stats.set_value('callback/erro', relatorio['error'])
+        return relatorio
+
+
+class CatalogoPipeline:
+    """Pipeline que alimenta o índice local do catálogo (consultado pelo Nível 3)"""
+    
+    def __init__(self, batch_size=200):
+        self.batch_size = batch_size
+        self.pendentes = []
+        self.removidos = []
+        self.total_indexado = 0
+        self.catalogo = None
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SERVIMED_CATALOGO_ENABLED', True):
+            raise NotConfigured('Índice do catálogo desabilitado')
+        return cls(batch_size=crawler.settings.getint('SERVIMED_CATALOGO_BATCH_SIZE', 200))
+    
+    def open_spider(self, spider):
+        self.catalogo = CatalogoIndex()
+    
+    def process_item(self, item, spider):
+        """Acumula produtos e grava no índice em lotes"""
+        adapter = ItemAdapter(item)
+        
+        if not adapter.get('codigo'):
+            return item
+        
+        # Removidos emitidos pelo DeltaPipeline saem do índice em vez de virar linha com estoque 0
+        if adapter.get('alteracao') == REMOVIDO:
+            self.removidos.append(adapter['codigo'])
+        else:
+            self.pendentes.append(adapter.asdict())
+        if len(self.pendentes) + len(self.removidos) >= self.batch_size:
+            self.flush()
+        
+        return item
+    
+    def flush(self):
+        """Grava os produtos pendentes no índice e apaga os removidos"""
+        if not self.pendentes and not self.removidos:
+            return
+        try:
+            self.total_indexado += self.catalogo.atualizar(self.pendentes)
+            self.catalogo.remover(self.removidos)
+        except Exception as e:
+            logger.error(f'Erro ao atualizar índice do catálogo: {e}')
+        self.pendentes = []
+        self.removidos = []
+    
+    def close_spider(self, spider):
+        self.flush()
+        logger.info(f'Índice do catálogo atualizado: {self.total_indexado} produtos')
+
+
+class HistoricoPipeline:
+    """
+    Registra preço e estoque de cada produto no histórico (snapshots por dia)
+    
+    Roda antes do DeltaPipeline para ver todos os produtos da coleta,
+    inclusive os inalterados.
+    """
+    
+    def __init__(self, batch_size=500, stats=None):
+        self.batch_size = batch_size
+        self.stats = stats
+        self.pendentes = []
+        self.historico = None
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SERVIMED_HISTORICO_ENABLED', True):
+            raise NotConfigured('Histórico de preços desabilitado')
+        return cls(batch_size=crawler.settings.getint('SERVIMED_HISTORICO_BATCH_SIZE', 500),
+                   stats=crawler.stats)
+    
+    def open_spider(self, spider):
+        # Fatia de coleta dividida: a exportação registra a coleta inteira de uma vez
+        if getattr(spider, 'fatia', False) is True:
+            return
+        self.historico = HistoricoPrecos()
+        self.historico.iniciar_coleta(getattr(spider, 'escopo', getattr(spider, 'filtro', '')))
+    
+    def process_item(self, item, spider):
+        if self.historico is None:
+            return item
+        adapter = ItemAdapter(item)
+        
+        # Removidos (estoque zerado pelo DeltaPipeline) não são observações reais
+        if adapter.get('codigo') and adapter.get('alteracao') != REMOVIDO:
+            self.pendentes.append(adapter.asdict())
+            if len(self.pendentes) >= self.batch_size:
+                self.flush()
+        
+        return item
+    
+    def flush(self):
+        """Grava os produtos pendentes na partição do dia"""
+        if not self.pendentes:
+            return
+        try:
+            self.historico.registrar(self.pendentes)
+        except Exception as e:
+            logger.error(f'Erro ao gravar histórico de preços: {e}')
+        self.pendentes = []
+    
+    def close_spider(self, spider):
+        if self.historico is None:
+            return
+        self.flush()
+        try:
+            resumo = self.historico.concluir_coleta()
+        finally:
+            self.historico.fechar()
+        logger.info(f'Histórico de preços: coleta {resumo["coleta"]} ({resumo["particao"]}), '
+                    f'{resumo["produtos"]} produtos')
+        if self.stats is not None:
+            self.stats.set_value('historico/coleta', resumo['coleta'])
+            self.stats.set_value('historico/produtos', resumo['produtos'])
+
+
+class DeltaPipeline:
+    """
+    Coleta incremental: deixa passar apenas produtos novos, alterados ou removidos
+    
+    Ativado pela setting SERVIMED_DELTA_ENABLED ou pelo argumento `delta` do
+    spider. Produtos inalterados são descartados antes da exportação e do
+    envio. Ao fim de uma coleta completa do filtro, os produtos que sumiram
+    são emitidos com estoque 0 e alteracao='removido'.
+    
+    A referência só avança quando a coleta termina normalmente ('finished').
+    Com `callback_url` as mudanças ficam apenas preparadas (estatística
+    delta/preparo) e a tarefa as confirma depois do envio bem-sucedido.
+    """
+    
+    def __init__(self, habilitado=False, crawler=None):
+        self.habilitado = habilitado
+        self.crawler = crawler
+        self.store = None
+        self.removidos_emitidos = False
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(habilitado=crawler.settings.getbool('SERVIMED_DELTA_ENABLED', False), crawler=crawler)
+        crawler.signals.connect(pipeline.spider_idle, signal=signals.spider_idle)
+        # O motivo do encerramento só chega no sinal (close_spider não o recebe)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+    
+    def open_spider(self, spider):
+        if self.habilitado or getattr(spider, 'delta', False):
+            self.store = DeltaStore(escopo=getattr(spider, 'escopo', getattr(spider, 'filtro', '')))
+            logger.info(f'Coleta incremental ativa: {len(self.store.anteriores)} produtos na referência')
+    
+    def process_item(self, item, spider):
+        if self.store is None:
+            return item
+        
+        adapter = ItemAdapter(item)
+        if adapter.get('alteracao') == REMOVIDO:
+            return item
+        
+        alteracao = self.store.classificar(adapter)
+        if alteracao is None:
+            raise DropItem(f'Produto inalterado: {adapter.get("codigo")}', log_level='DEBUG')
+        
+        adapter['alteracao'] = alteracao
+        return item
+    
+    def spider_idle(self, spider):
+        """Com todas as páginas coletadas, agenda a emissão dos produtos removidos"""
+        if self.store is None or self.removidos_emitidos:
+            return
+        self.removidos_emitidos = True
+        
+        completa = getattr(spider, 'coleta_completa', None)
+        if completa is None or not completa():
+            logger.info('Coleta parcial: produtos removidos não são calculados')
+            return
+        
+        removidos = self.store.produtos_removidos()
+        if not removidos:
+            return
+        
+        logger.info(f'{len(removidos)} produtos removidos desde a última coleta')
+        self.crawler.engine.crawl(Request(
+            'data:,',
+            callback=self.emitir_removidos,
+            cb_kwargs={'removidos': removidos},
+            dont_filter=True
+        ))
+        raise DontCloseSpider
+    
+    def emitir_removidos(self, response, removidos):
+        for produto in removidos:
+            yield ProdutoItem(**produto, alteracao=REMOVIDO)
+    
+    def spider_closed(self, spider, reason):
+        if self.store is None:
+            return
+        try:
+            contagem = dict(self.store.contagem)
+            if reason != 'finished':
+                logger.info(f'Coleta encerrada ({reason}): referência do delta mantida')
+                return
+            if getattr(spider, 'callback_url', ''):
+                preparo = self.store.preparar()
+                logger.info(f'Coleta incremental: {contagem} - aguardando confirmação do envio ({preparo})')
+                if self.crawler is not None:
+                    self.crawler.stats.set_value('delta/preparo', preparo)
+            else:
+                contagem = self.store.salvar()
+                logger.info(f'Coleta incremental: {contagem}')
+        finally:
+            self.store.fechar()
+            self.store = None
+            if self.crawler is not None:
+                for chave, valor in contagem.items():
+                    self.crawler.stats.set_value(f'delta/{chave}', valor)
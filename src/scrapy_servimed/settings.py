@@ -6,6 +6,8 @@ Projeto Scrapy para scraping do portal Servimed.
 Mantém compatibilidade com o sistema atual.
 """
 
+import os
+
 BOT_NAME = 'servimed_scrapy'
 
 SPIDER_MODULES = ['src.scrapy_servimed.spiders']
@@ -32,11 +34,23 @@ DOWNLOADER_MIDDLEWARES = {
 }
 
 # Configure item pipelines
+# CatalogoPipeline e ColunarPipeline (snapshot) rodam antes do DeltaPipeline
+# para que vejam todos os produtos; exportação e callback recebem apenas as
+# mudanças
 ITEM_PIPELINES = {
+    'src.scrapy_servimed.pipelines.CatalogoPipeline': 250,
+    'src.scrapy_servimed.pipelines.HistoricoPipeline': 260,
+    'src.scrapy_servimed.pipelines.ColunarPipeline': 270,
+    'src.scrapy_servimed.pipelines.DeltaPipeline': 280,
     'src.scrapy_servimed.pipelines.ServimedPipeline': 300,
     'src.scrapy_servimed.pipelines.CeleryPipeline': 400,
 }
 
+# Novas tentativas de páginas com erro: inclui o 403 do anti-bot (intermitente)
+RETRY_ENABLED = True
+RETRY_TIMES = int(os.getenv('SCRAPY_RETRY_TIMES', '3'))
+RETRY_HTTP_CODES = [500, 502, 503, 504, 522, 524, 408, 429, 403]
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 AUTOTHROTTLE_ENABLED = True
 AUTOTHROTTLE_START_DELAY = 1
@@ -58,3 +72,34 @@ LOG_LEVEL = 'INFO'
 # Configurações customizadas
 SERVIMED_BASE_URL = 'https://peapi.servimed.com.br'
 SERVIMED_PORTAL_URL = 'https://pedidoeletronico.servimed.com.br'
+
+# Threads do AntiDetectionDownloadHandler (0 = usa CONCURRENT_REQUESTS)
+SERVIMED_DOWNLOAD_THREADS = 0
+
+# Concorrência/intervalo adaptativos por host no AntiDetectionDownloadHandler
+# (quando ativo, o spider desliga DOWNLOAD_DELAY e AutoThrottle)
+SERVIMED_CONTROLE_TAXA = os.getenv('CONTROLE_TAXA', 'true').lower() == 'true'
+
+# Índice local do catálogo (data/catalogo.db), usado pelo Nível 3
+SERVIMED_CATALOGO_ENABLED = True
+SERVIMED_CATALOGO_BATCH_SIZE = 200
+
+# Histórico de preço/estoque por coleta (data/historico/, partições por dia)
+SERVIMED_HISTORICO_ENABLED = os.getenv('HISTORICO', 'true').lower() == 'true'
+SERVIMED_HISTORICO_BATCH_SIZE = 500
+
+# Exportação do ServimedPipeline: 'json' (documento único) ou 'jsonl' (streaming)
+SERVIMED_EXPORT_FORMAT = os.getenv('SCRAPY_EXPORT_FORMAT', 'json')
+SERVIMED_EXPORT_FLUSH_EVERY = int(os.getenv('SCRAPY_EXPORT_FLUSH_EVERY', '100'))
+
+# Snapshot colunar adicional: '' (desligado), 'parquet' ou 'arrow' (requer pyarrow)
+SERVIMED_EXPORT_COLUNAR = os.getenv('SCRAPY_EXPORT_COLUNAR', '')
+SERVIMED_EXPORT_COLUNAR_LOTE = int(os.getenv('EXPORT_COLUNAR_LOTE', '10000'))
+
+# Envio para a API de callback durante a coleta (quando o spider recebe callback_url)
+SERVIMED_CALLBACK_STREAMING = os.getenv('SCRAPY_CALLBACK_STREAMING', 'true').lower() == 'true'
+# Itens aguardando espaço na fila de envio antes de pausar a coleta
+SERVIMED_CALLBACK_MAX_ESPERA = int(os.getenv('SCRAPY_CALLBACK_MAX_ESPERA', '100'))
+
+# Coleta incremental: exporta/envia apenas produtos novos, alterados ou removidos
+SERVIMED_DELTA_ENABLED = os.getenv('SCRAPY_DELTA', 'false').lower() == 'true'
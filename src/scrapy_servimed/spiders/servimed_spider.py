@@ -11,86 +11,163 @@ import os
 import time
 from urllib.parse import urlencode
 from ..items import ProdutoItem
+from ...coleta import CheckpointColeta, carregar_filtros
+from ...coleta.payload import PayloadBusca, url_busca
+from ...coleta.controle_taxa import CONTROLE_TAXA_ENABLED, TAXA_CONCORRENCIA_MAX
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Limite de páginas em voo simultaneamente (fan-out após a primeira página)
+MAX_PAGINAS_SIMULTANEAS = int(os.getenv('SCRAPY_MAX_PAGINAS_SIMULTANEAS', '4'))
+DOWNLOAD_DELAY = float(os.getenv('SCRAPY_DOWNLOAD_DELAY', '0.5'))
+
+if CONTROLE_TAXA_ENABLED:
+    # Controle adaptativo no download handler: o Scrapy só mantém a fila cheia
+    # até o teto do controlador, sem atraso fixo nem AutoThrottle
+    _TETO_CONCORRENCIA = max(MAX_PAGINAS_SIMULTANEAS, int(TAXA_CONCORRENCIA_MAX))
+    CONFIGURACAO_DOWNLOAD = {
+        'DOWNLOAD_DELAY': 0,
+        'AUTOTHROTTLE_ENABLED': False,
+        'CONCURRENT_REQUESTS': _TETO_CONCORRENCIA,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': _TETO_CONCORRENCIA,
+    }
+else:
+    CONFIGURACAO_DOWNLOAD = {
+        'DOWNLOAD_DELAY': DOWNLOAD_DELAY,
+        'CONCURRENT_REQUESTS': MAX_PAGINAS_SIMULTANEAS,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': MAX_PAGINAS_SIMULTANEAS,
+        'AUTOTHROTTLE_TARGET_CONCURRENCY': float(MAX_PAGINAS_SIMULTANEAS),
+    }
+
+
+class EstadoFiltro:
+    """Paginação de um termo de busca dentro da coleta"""
+    
+    def __init__(self, filtro, motor='scrapy', persistente=True, diretorio=None, execucao=None):
+        self.filtro = filtro
+        
+        # Páginas concluídas + cursor, para retomar uma coleta interrompida
+        self.checkpoint = CheckpointColeta(motor, filtro, diretorio=diretorio, execucao=execucao,
+                                           persistente=persistente)
+        
+        # Última página válida conhecida - reduzida quando chega uma página incompleta
+        self.ultima_pagina = float('inf')
+
 
 class ServimedProductsSpider(scrapy.Spider):
     name = 'servimed_products'
     allowed_domains = ['peapi.servimed.com.br']
     
-    custom_settings = {
-        'DOWNLOAD_DELAY': 2,
-        'CONCURRENT_REQUESTS': 1,
-        'CONCURRENT_REQUESTS_PER_DOMAIN': 1,
-    }
+    # Após a página 1 todas as páginas restantes são agendadas de uma vez;
+    # o número de requisições simultâneas é limitado por estas configurações
+    custom_settings = CONFIGURACAO_DOWNLOAD
     
-    def __init__(self, filtro='', max_pages=1, callback_url='', *args, **kwargs):
+    def __init__(self, filtro='', max_pages=1, callback_url='', resume=False, delta=False,
+                 cliente_id=None, codigo_usuario=None, users=None, filtros=None, arquivo_filtros=None,
+                 exportar='', pagina_inicial=1, fatia=False, arquivo_resultados='',
+                 diretorio_checkpoint='', execucao='', *args, **kwargs):
+        """
+        max_pages limita a última página coletada; 0 coleta todas as páginas
+        informadas por totalRegistros (antes do fan-out, 0 coletava só a página 1)
+        """
         super(ServimedProductsSpider, self).__init__(*args, **kwargs)
         
-        # Parâmetros
-        self.filtro = filtro
+        # Parâmetros - vários termos são coletados em paralelo na mesma execução
+        self.filtros = carregar_filtros(filtros, arquivo_filtros, filtro)
+        self.filtro = self.filtros[0] if len(self.filtros) == 1 else ''
+        self.escopo = '|'.join(sorted(self.filtros)) if len(self.filtros) > 1 else self.filtro
         self.max_pages = int(max_pages)
         self.callback_url = callback_url
+        self.resume = str(resume).lower() in ('1', 'true', 'sim', 'yes')
+        self.delta = str(delta).lower() in ('1', 'true', 'sim', 'yes')
+        # Snapshot colunar ('parquet' ou 'arrow'), gravado pelo ColunarPipeline
+        self.exportar = exportar or ''
+        # Arquivo de resultados desta execução (sem extensão); vazio usa o padrão
+        # data/servimed_produtos_scrapy - coletas em processo recebem um por execução
+        # e False dispensa o arquivo (itens só em memória)
+        self.arquivo_resultados = arquivo_resultados if arquivo_resultados is False else arquivo_resultados or ''
+        # Fatia de uma coleta dividida (páginas pagina_inicial..max_pages): o
+        # arquivo de resultados e o histórico ficam com a etapa de exportação
+        self.pagina_inicial = max(1, int(pagina_inicial))
+        self.fatia = str(fatia).lower() in ('1', 'true', 'sim', 'yes')
+        motor = f'scrapy_fatia{self.pagina_inicial}' if self.fatia else 'scrapy'
+        # Busca de uma página (ex.: Nível 3): nada a retomar, checkpoint só em memória
+        persistente = self.max_pages == 0 or self.max_pages > self.pagina_inicial
+        # Checkpoint de uma execução conhecida (ex.: fatia de uma coleta encadeada):
+        # diretório e identificador fixos, a retomada não adota outra execução
+        diretorio_checkpoint = diretorio_checkpoint or None
+        execucao = execucao or None
+        
+        self.estados = {termo: EstadoFiltro(termo, motor, persistente, diretorio_checkpoint, execucao)
+                        for termo in self.filtros}
+        
+        # Termos que encontraram cada código (itens são emitidos uma vez por código)
+        self.filtros_por_codigo = {}
         
         # Configurações da API
         self.base_url = os.getenv('BASE_URL', 'https://peapi.servimed.com.br')
-        self.api_endpoint = '/api/carrinho/oculto'
+        self.url_busca = url_busca(self.base_url)
+        
+        # Conta da busca: argumentos do spider ou .env (CLIENT_ID, LOGGED_USER, USERS)
+        self.payload = PayloadBusca.do_ambiente(cliente_id, codigo_usuario, users)
         
         # Contadores
-        self.current_page = 1
+        self.pages_processed = 0
         self.total_products = 0
         
-        self.logger.info(f'Spider inicializado: filtro="{filtro}", max_pages={max_pages}')
+        self.logger.info(f'Spider inicializado: filtros={self.filtros}, páginas {self.pagina_inicial}-{max_pages}, '
+                         f'resume={self.resume}')
+    
+    def estado(self, filtro=None):
+        """Estado de paginação do termo (padrão: primeiro termo)"""
+        return self.estados[self.filtros[0] if filtro is None else filtro]
+    
+    def ultima_pagina_de(self, filtro=None):
+        """Última página válida conhecida do termo"""
+        return self.estado(filtro).ultima_pagina
     
     def start_requests(self):
         """Gera requisições iniciais - vai direto para produtos (pula ObterVencimentos que dá 500)"""
         
-        # Ir direto para requisição de produtos
-        url = f"{self.base_url}{self.api_endpoint}"
-        full_url = f"{url}?siteVersion=4.0.27"
-        
-        # Payload POST exato conforme capturado do DevTools
-        payload = {
-            "filtro": self.filtro,
-            "pagina": 1,
-            "registrosPorPagina": 25,
-            "ordenarDecrescente": False,
-            "colunaOrdenacao": "nenhuma",
-            "clienteId": 267511,
-            "tipoVendaId": 1,
-            "fabricanteIdFiltro": 0,
-            "pIIdFiltro": 0,
-            "cestaPPFiltro": False,
-            "codigoExterno": 0,
-            "codigoUsuario": 22850,
-            "promocaoSelecionada": "",
-            "indicadorTipoUsuario": "CLI",
-            "kindUser": 0,
-            "xlsx": [],
-            "principioAtivo": "",
-            "master": False,
-            "kindSeller": 0,
-            "grupoEconomico": "",
-            "users": [
-                518565,
-                267511
-            ],
-            "list": True
-        }
+        for filtro, estado in self.estados.items():
+            if self.resume and estado.checkpoint.carregar():
+                yield from self.retomar_checkpoint(filtro)
+                continue
+            
+            # Ir direto para requisição de produtos
+            request = self.build_page_request(self.pagina_inicial, filtro)
+            
+            self.logger.info(f'Iniciando scraping direto: {request.url} (filtro "{filtro}")')
+            self.logger.debug(f'Payload: {self.payload.dados(self.pagina_inicial, filtro)}')
+            
+            yield request
+    
+    def retomar_checkpoint(self, filtro=None):
+        """Reemite os produtos das páginas já concluídas e agenda só as que faltam"""
         
-        self.logger.info(f'Iniciando scraping direto: {full_url}')
-        self.logger.info(f'Payload: {json.dumps(payload, indent=2, ensure_ascii=False)}')
+        checkpoint = self.estado(filtro).checkpoint
+        filtro = self.estado(filtro).filtro
+        self.logger.info(f'Retomando coleta "{filtro}": {len(checkpoint.paginas_concluidas)} páginas já concluídas')
         
-        yield scrapy.Request(
-            url=full_url,
-            method='POST',
-            body=json.dumps(payload),
-            headers={'Content-Type': 'application/json'},
-            callback=self.parse_products,
-            errback=self.handle_error,
-            meta={'handle_httpstatus_list': [403, 500], 'page': 1}
+        for produto in checkpoint.produtos():
+            item = ProdutoItem(**produto)
+            item['url'] = self.base_url
+            item['timestamp'] = time.time()
+            item['usuario'] = os.getenv('LOGGED_USER', '')
+            if self.registrar_codigo(item, filtro):
+                self.total_products += 1
+                yield item
+        
+        if self.pagina_inicial not in checkpoint.paginas_concluidas:
+            # Sem a primeira página o cursor pode estar desatualizado: o fan-out acontece no parse
+            yield self.build_page_request(self.pagina_inicial, filtro)
+            return
+        
+        yield from self.agendar_paginas_restantes(
+            checkpoint.cursor.get('total_registros', 0),
+            checkpoint.cursor.get('registros_por_pagina', self.payload.registros_por_pagina),
+            filtro
         )
     
     def after_vencimentos(self, response):
@@ -99,62 +176,37 @@ class ServimedProductsSpider(scrapy.Spider):
         self.logger.info(f'ObterVencimentos concluído, status: {response.status}')
         
         # Agora faz a requisição de produtos
-        url = f"{self.base_url}{self.api_endpoint}"
-        full_url = f"{url}?siteVersion=4.0.27"
-        
-        # Payload POST exato conforme capturado do DevTools
-        payload = {
-            "filtro": self.filtro,
-            "pagina": 1,
-            "registrosPorPagina": 25,
-            "ordenarDecrescente": False,
-            "colunaOrdenacao": "nenhuma",
-            "clienteId": 267511,
-            "tipoVendaId": 1,
-            "fabricanteIdFiltro": 0,
-            "pIIdFiltro": 0,
-            "cestaPPFiltro": False,
-            "codigoExterno": 0,
-            "codigoUsuario": 22850,
-            "promocaoSelecionada": "",
-            "indicadorTipoUsuario": "CLI",
-            "kindUser": 0,
-            "xlsx": [],
-            "principioAtivo": "",
-            "master": False,
-            "kindSeller": 0,
-            "grupoEconomico": "",
-            "users": [
-                518565,
-                267511
-            ],
-            "list": True
-        }
-        
-        self.logger.info(f'Iniciando scraping POST: {full_url}')
-        self.logger.info(f'Payload: {json.dumps(payload, indent=2)}')
+        for filtro in self.filtros:
+            yield self.build_page_request(1, filtro)
+    
+    def registrar_codigo(self, item, filtro):
+        """
+        Associa o termo ao código; retorna True só na primeira ocorrência do código
         
-        yield scrapy.Request(
-            url=full_url,
-            method='POST',
-            body=json.dumps(payload),
-            headers={'Content-Type': 'application/json'},
-            callback=self.parse_products,
-            errback=self.handle_error,
-            meta={'page': 1, 'handle_httpstatus_list': [403]}
-        )
+        A lista `filtros` do item é compartilhada com filtros_por_codigo: termos
+        que encontrarem o mesmo código depois são acrescentados ao item já emitido.
+        """
+        codigo = item.get('codigo')
+        termos = self.filtros_por_codigo.get(codigo)
+        if termos is None:
+            termos = self.filtros_por_codigo[codigo] = [filtro]
+            item['filtros'] = termos
+            return True
+        if filtro not in termos:
+            termos.append(filtro)
+        return False
     
     def parse_products(self, response):
         """Parse da resposta de produtos"""
         
         page = response.meta['page']
-        self.logger.info(f'Processando página {page}, status: {response.status}')
+        filtro = response.meta.get('filtro', self.filtros[0])
+        estado = self.estado(filtro)
+        self.logger.info(f'Processando página {page} ("{filtro}"), status: {response.status}')
         
-        # Handle 403 responses
-        if response.status == 403:
-            self.logger.error(f'HTTP 403 Forbidden na página {page}')
-            self.logger.error(f'Response headers: {dict(response.headers)}')
-            self.logger.error(f'Response body: {response.text[:500]}...')
+        # Página além do fim do catálogo (já em voo quando uma página curta chegou)
+        if page > estado.ultima_pagina:
+            self.logger.info(f'Página {page} descartada: catálogo termina na página {estado.ultima_pagina}')
             return
         
         try:
@@ -166,74 +218,118 @@ class ServimedProductsSpider(scrapy.Spider):
             total_registros = data.get('totalRegistros', 0)
             registros_por_pagina = data.get('registrosPorPagina', 25)
             
+            self.pages_processed += 1
             self.logger.info(f'Página {page}: {len(produtos)} produtos encontrados de {total_registros} total')
             
+            if page == self.pagina_inicial:
+                estado.checkpoint.definir_cursor(registros_por_pagina, total_registros)
+                # Resultados da busca segundo a API (buscas pontuais decidem o "não encontrado")
+                if getattr(self, 'crawler', None) is not None:
+                    self.crawler.stats.inc_value('coleta/total_registros', total_registros)
+            
             if not produtos:
                 self.logger.info('Nenhum produto encontrado, finalizando')
+                self.marcar_ultima_pagina(page - 1, filtro)
                 return
             
             # Processar cada produto
-            for produto in produtos:
-                item = self.extract_product_data(produto)
-                if item:
+            itens = [item for item in map(self.extract_product_data, produtos) if item]
+            estado.checkpoint.registrar_pagina(page, [
+                {campo: item.get(campo) for campo in ('gtin', 'codigo', 'descricao', 'preco_fabrica', 'estoque')}
+                for item in itens
+            ])
+            for item in itens:
+                # Código já emitido por outro termo: apenas registra o termo
+                if self.registrar_codigo(item, filtro):
                     yield item
                     self.total_products += 1
             
-            # Verificar se deve continuar para próxima página
-            if page < self.max_pages and len(produtos) == registros_por_pagina and self.total_products < total_registros:
-                next_page = page + 1
-                
-                # URL da próxima página - POST conforme DevTools
-                next_url = f"{self.base_url}{self.api_endpoint}?siteVersion=4.0.27"
-                
-                # Payload POST exato conforme capturado do DevTools - próxima página
-                payload = {
-                    "filtro": self.filtro,
-                    "pagina": next_page,
-                    "registrosPorPagina": 25,
-                    "ordenarDecrescente": False,
-                    "colunaOrdenacao": "nenhuma",
-                    "clienteId": 267511,
-                    "tipoVendaId": 1,
-                    "fabricanteIdFiltro": 0,
-                    "pIIdFiltro": 0,
-                    "cestaPPFiltro": False,
-                    "codigoExterno": 0,
-                    "codigoUsuario": 22850,
-                    "promocaoSelecionada": "",
-                    "indicadorTipoUsuario": "CLI",
-                    "kindUser": 0,
-                    "xlsx": [],
-                    "principioAtivo": "",
-                    "master": False,
-                    "kindSeller": 0,
-                    "grupoEconomico": "",
-                    "users": [
-                        518565,
-                        267511
-                    ],
-                    "list": True
-                }
-                
-                self.logger.info(f'Requisitando página {next_page}')
-                
-                yield scrapy.Request(
-                    url=next_url,
-                    method='POST',
-                    body=json.dumps(payload),
-                    headers={'Content-Type': 'application/json'},
-                    callback=self.parse_products,
-                    errback=self.handle_error,
-                    meta={'page': next_page, 'handle_httpstatus_list': [403]}
-                )
+            # Página incompleta = fim do catálogo, páginas posteriores são canceladas
+            if len(produtos) < registros_por_pagina:
+                self.marcar_ultima_pagina(page, filtro)
+            
+            # Com totalRegistros conhecido, agenda todas as páginas restantes de uma vez
+            if page == self.pagina_inicial:
+                yield from self.agendar_paginas_restantes(total_registros, registros_por_pagina, filtro)
         
         except json.JSONDecodeError as e:
             self.logger.error(f'Erro ao decodificar JSON da página {page}: {e}')
         except Exception as e:
             self.logger.error(f'Erro no parse da página {page}: {e}')
     
+    def agendar_paginas_restantes(self, total_registros, registros_por_pagina, filtro=None):
+        """Gera as requisições das páginas seguintes à inicial respeitando max_pages e o fim do catálogo"""
+        
+        estado = self.estado(filtro)
+        total_paginas = (total_registros + registros_por_pagina - 1) // registros_por_pagina
+        ultima = min(total_paginas, self.max_pages) if self.max_pages > 0 else total_paginas
+        ultima = min(ultima, estado.ultima_pagina)
+        
+        if ultima <= self.pagina_inicial:
+            return
+        
+        self.logger.info(f'Agendando páginas {self.pagina_inicial + 1}-{ultima} de "{estado.filtro}" '
+                         f'(até {MAX_PAGINAS_SIMULTANEAS} simultâneas)')
+        
+        for pagina in range(self.pagina_inicial + 1, ultima + 1):
+            if pagina not in estado.checkpoint.paginas_concluidas:
+                yield self.build_page_request(pagina, estado.filtro)
+    
+    def marcar_ultima_pagina(self, page, filtro=None):
+        """Registra o fim do catálogo para descartar páginas posteriores ainda pendentes"""
+        estado = self.estado(filtro)
+        if page < estado.ultima_pagina:
+            estado.ultima_pagina = page
+            self.logger.info(f'Fim do catálogo de "{estado.filtro}" detectado na página {page}')
+    
+    def build_page_request(self, page, filtro=None):
+        """Monta a requisição POST de uma página de produtos"""
+        
+        filtro = self.estado(filtro).filtro
+        
+        # Corpo pré-codificado: só filtro e página mudam entre requisições.
+        # Páginas menores têm prioridade para que o fim do catálogo seja detectado cedo.
+        # 403/5xx passam pelo RetryMiddleware (RETRY_HTTP_CODES); esgotadas as
+        # tentativas, a página cai no errback e fica pendente no checkpoint
+        return scrapy.Request(
+            url=self.url_busca,
+            method='POST',
+            body=self.payload.corpo(page, filtro),
+            headers={'Content-Type': 'application/json'},
+            callback=self.parse_products,
+            errback=self.handle_error,
+            meta={'page': page, 'filtro': filtro},
+            priority=-page
+        )
+    
+    def paginas_pendentes(self, filtro=None):
+        """Páginas esperadas ainda não concluídas (None se a paginação é desconhecida)"""
+        estado = self.estado(filtro)
+        total_paginas = estado.checkpoint.total_paginas()
+        if total_paginas is None:
+            return None
+        ultima = min(total_paginas, self.max_pages) if self.max_pages > 0 else total_paginas
+        ultima = min(ultima, estado.ultima_pagina)
+        return estado.checkpoint.paginas_pendentes(int(ultima), self.pagina_inicial)
+    
+    def coleta_completa(self):
+        """True se todas as páginas de todos os termos foram coletadas (sem corte por max_pages)"""
+        if self.pagina_inicial > 1:
+            return False
+        for filtro, estado in self.estados.items():
+            total_paginas = estado.checkpoint.total_paginas()
+            if total_paginas is None:
+                return False
+            cortada = 0 < self.max_pages < min(total_paginas, estado.ultima_pagina)
+            if cortada or self.paginas_pendentes(filtro) != []:
+                return False
+        return True
+    
     def handle_error(self, failure):
-        """Handle request errors"""
+        """Página que falhou mesmo após as novas tentativas (fica pendente para o --resume)"""
+        request = getattr(failure, 'request', None)
+        if request is not None:
+            self.logger.error(f'Página {request.meta.get("page")} ("{request.meta.get("filtro")}") não coletada')
         self.logger.error(f'Request failed: {failure.value}')
         if hasattr(failure.value, 'response'):
             response = failure.value.response
@@ -289,9 +385,26 @@ class ServimedProductsSpider(scrapy.Spider):
         # Estatísticas finais
         stats = {
             'total_products': self.total_products,
-            'pages_processed': self.current_page,
+            'pages_processed': self.pages_processed,
             'filter_used': self.filtro,
+            'filters_used': self.filtros,
             'reason': reason
         }
         
         self.logger.info(f'Estatísticas finais: {stats}')
+        
+        # Checkpoint só é removido quando todas as páginas esperadas foram concluídas
+        total_pendentes = 0
+        for filtro, estado in self.estados.items():
+            pendentes = self.paginas_pendentes(filtro)
+            if pendentes is None:
+                continue
+            total_pendentes += len(pendentes)
+            if pendentes:
+                self.logger.warning(f'Coleta de "{filtro}" incompleta: {len(pendentes)} páginas pendentes - '
+                                    f'use --resume para continuar')
+            else:
+                estado.checkpoint.concluir()
+        
+        if getattr(self, 'crawler', None) is not None:
+            self.crawler.stats.set_value('coleta/paginas_pendentes', total_pendentes)
@@ -4,17 +4,26 @@ SCRAPY WRAPPER - SERVIMED
 =========================
 
 Wrapper para executar spiders Scrapy integrado ao sistema atual.
+
+Além do modo subprocess, oferece coleta em processo (`crawl`) usando um
+reactor Twisted de longa duração em thread dedicada, reutilizado entre
+chamadas - evita o custo de iniciar um interpretador a cada busca.
 """
 
 import os
 import sys
 import json
+import time
+import uuid
+import atexit
+import threading
 import subprocess
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from pathlib import Path
 from datetime import datetime
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.project import get_project_settings
-from twisted.internet import reactor
+from scrapy import signals
+from scrapy.crawler import CrawlerRunner
+from scrapy.settings import Settings
 import logging
 
 # Adicionar src ao path
@@ -22,8 +31,126 @@ current_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(current_dir))
 sys.path.insert(0, str(Path(__file__).parent))
 
+from src.coleta import Produto
+from src.coleta.arquivos import iter_produtos  # noqa: F401 - reexportado (compatibilidade)
 from src.scrapy_servimed.spiders.servimed_spider import ServimedProductsSpider
 
+ARQUIVO_JSON = Path('data/servimed_produtos_scrapy.json')
+ARQUIVO_JSONL = Path('data/servimed_produtos_scrapy.jsonl')
+
+# Coletas em processo gravam um arquivo de resultados por execução: chamadas
+# simultâneas no mesmo worker não disputam o arquivo fixo
+EXECUCOES_DIR = Path(os.getenv('SCRAPY_EXECUCOES_DIR', 'data/execucoes'))
+# Arquivos de execuções mais antigos que isto (segundos) são removidos a cada
+# coleta - sobras de tarefas que caíram antes de apagar o próprio arquivo
+EXECUCOES_RETENCAO = int(os.getenv('SCRAPY_EXECUCOES_RETENCAO', '86400'))
+
+
+def limpar_execucoes(retencao: int = EXECUCOES_RETENCAO) -> int:
+    """Remove de EXECUCOES_DIR os arquivos mais antigos que `retencao` segundos"""
+    limite = time.time() - retencao
+    removidos = 0
+    for arquivo in EXECUCOES_DIR.glob('servimed_produtos_scrapy_*'):
+        try:
+            if arquivo.stat().st_mtime < limite:
+                arquivo.unlink()
+                removidos += 1
+        except OSError:
+            continue
+    return removidos
+
+
+class _ColetorItens:
+    """Acumula os itens de uma coleta em memória"""
+    
+    def __init__(self):
+        self.produtos = []
+    
+    def item_scraped(self, item, spider):
+        # Registro compacto; `filtros` é a mesma lista do spider: termos que
+        # acharem o código depois ainda entram
+        self.produtos.append(Produto.de_mapping(item))
+
+
+class _ReactorThread:
+    """Reactor Twisted em thread dedicada, compartilhado por todas as coletas do processo"""
+    
+    _lock = threading.Lock()
+    _instance = None
+    
+    @classmethod
+    def get(cls):
+        """Retorna o reactor do processo, iniciando-o na primeira chamada"""
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+    
+    def __init__(self):
+        from scrapy.utils.reactor import install_reactor, is_reactor_installed
+        
+        if not is_reactor_installed():
+            install_reactor('twisted.internet.asyncioreactor.AsyncioSelectorReactor')
+        
+        from twisted.internet import reactor
+        self.reactor = reactor
+        
+        # Settings do projeto Scrapy - aceita o reactor já instalado
+        settings = Settings()
+        settings.setmodule('src.scrapy_servimed.settings', priority='project')
+        settings.set('TWISTED_REACTOR', None, priority='cmdline')
+        self.runner = CrawlerRunner(settings)
+        
+        # O reactor pode já estar rodando (módulo importado por outro caminho)
+        self.thread = None
+        if not reactor.running:
+            self.thread = threading.Thread(target=self._run, name='scrapy-reactor', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+    
+    def _run(self):
+        event_loop = getattr(self.reactor, '_asyncioEventloop', None)
+        if event_loop is not None:
+            import asyncio
+            asyncio.set_event_loop(event_loop)
+        self.reactor.run(installSignalHandlers=False)
+    
+    def stop(self):
+        if self.reactor.running:
+            self.reactor.callFromThread(self.reactor.stop)
+    
+    def crawl(self, spidercls, timeout, **spider_kwargs):
+        """
+        Executa uma coleta no reactor e bloqueia a thread chamadora até o fim
+        
+        Returns:
+            tuple: (coletor com os itens, estatísticas do crawler)
+        """
+        from twisted.internet import threads
+        
+        resultado = Future()
+        coletor = _ColetorItens()
+        
+        def iniciar():
+            crawler = self.runner.create_crawler(spidercls)
+            crawler.signals.connect(coletor.item_scraped, signal=signals.item_scraped, weak=False)
+            d = self.runner.crawl(crawler, **spider_kwargs)
+            d.addCallbacks(
+                lambda _: resultado.set_result(crawler.stats.get_stats()),
+                lambda failure: resultado.set_exception(failure.value)
+            )
+            return crawler
+        
+        crawler = threads.blockingCallFromThread(self.reactor, iniciar)
+        
+        try:
+            stats = resultado.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.reactor.callFromThread(crawler.stop)
+            raise
+        
+        return coletor, stats
+
 
 class ScrapyServimedWrapper:
     """Wrapper para executar Scrapy de forma integrada"""
@@ -39,26 +166,120 @@ class ScrapyServimedWrapper:
         )
         self.logger = logging.getLogger(__name__)
     
-    def run_spider(self, filtro='', max_pages=1, callback_url=''):
+    def run_spider(self, filtro='', max_pages=1, callback_url='', resume=False, delta=False, filtros=None,
+                   exportar=''):
         """
         Executa spider via subprocess para evitar conflitos de reactor
         
         Args:
             filtro: Filtro de busca
-            max_pages: Máximo de páginas
+            max_pages: Máximo de páginas (0 = todas)
             callback_url: URL para callback
+            resume: Retoma a coleta interrompida a partir do checkpoint
+            delta: Exporta apenas produtos novos, alterados ou removidos
+            filtros: Lista de termos coletados na mesma execução
+            exportar: Snapshot colunar adicional ('parquet' ou 'arrow')
         """
         
-        return self.run_spider_subprocess(filtro, max_pages, callback_url)
+        return self.run_spider_subprocess(filtro, max_pages, callback_url, resume, delta, filtros, exportar)
     
-    def run_spider_subprocess(self, filtro='', max_pages=1, callback_url=''):
+    def crawl(self, filtro='', max_pages=1, callback_url='', timeout=300, resume=False, delta=False,
+              filtros=None, exportar='', pagina_inicial=1, fatia=False, arquivo_resultados=True,
+              diretorio_checkpoint=None, execucao=None):
+        """
+        Executa spider no próprio processo e retorna os itens em memória
+        
+        O reactor é iniciado uma única vez por processo (thread dedicada) e
+        reutilizado pelas chamadas seguintes, inclusive concorrentes.
+        
+        Args:
+            filtro: Filtro de busca
+            max_pages: Máximo de páginas (0 = todas)
+            callback_url: URL para callback
+            timeout: Tempo máximo da coleta em segundos
+            resume: Retoma a coleta interrompida a partir do checkpoint
+            delta: Retorna apenas produtos novos, alterados ou removidos
+            filtros: Lista de termos coletados na mesma execução (produtos
+                sem repetição, com o campo `filtros` indicando os termos)
+            exportar: Snapshot colunar adicional ('parquet' ou 'arrow')
+            pagina_inicial: Primeira página coletada (fatias de uma coleta dividida)
+            fatia: Coleta parcial - não grava o arquivo de resultados nem o histórico
+            arquivo_resultados: Grava os itens num arquivo desta execução em
+                EXECUCOES_DIR (False: só em memória, ex. buscas pontuais); quem
+                chama remove o arquivo depois de usá-lo, e o que sobrar é
+                removido após SCRAPY_EXECUCOES_RETENCAO
+            diretorio_checkpoint: Diretório do checkpoint (padrão CHECKPOINT_DIR)
+            execucao: Identificador fixo da execução no checkpoint (o resume
+                retoma exatamente essa execução)
+            
+        Returns:
+            dict: Mesmo formato de get_results() + estatísticas do crawler e
+                `arquivo` (resultados gravados por esta execução, ou None)
+        """
+        
+        if arquivo_resultados:
+            limpar_execucoes()
+            arquivo_resultados = str(EXECUCOES_DIR / f'servimed_produtos_scrapy_{uuid.uuid4().hex}')
+        
+        try:
+            self.logger.info(f"Iniciando Scrapy em processo: filtro='{filtro}', filtros={filtros}, "
+                             f"max_pages={max_pages}")
+            
+            reactor_thread = _ReactorThread.get()
+            coletor, stats = reactor_thread.crawl(
+                ServimedProductsSpider,
+                timeout,
+                filtro=filtro,
+                max_pages=max_pages,
+                callback_url=callback_url,
+                resume=resume,
+                delta=delta,
+                filtros=filtros,
+                exportar=exportar,
+                pagina_inicial=pagina_inicial,
+                fatia=fatia,
+                arquivo_resultados=arquivo_resultados,
+                diretorio_checkpoint=str(diretorio_checkpoint or ''),
+                execucao=execucao or ''
+            )
+            
+            produtos = coletor.produtos
+            self.logger.info(f"Coleta em processo finalizada: {len(produtos)} produtos")
+            
+            return {
+                'success': True,
+                'produtos': produtos,
+                'metadata': {
+                    'scraped_at': datetime.now().isoformat(),
+                    'total_produtos': len(produtos),
+                    'scraper': 'scrapy',
+                    'fonte': 'servimed'
+                },
+                'total': len(produtos),
+                'arquivo': stats.get('export/arquivo'),
+                'stats': stats
+            }
+            
+        except FutureTimeoutError:
+            self.logger.error("Timeout na coleta Scrapy em processo")
+            return {'success': False, 'error': f'Timeout de {timeout}s na coleta'}
+        except Exception as e:
+            self.logger.error(f"Erro na coleta em processo: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def run_spider_subprocess(self, filtro='', max_pages=1, callback_url='', resume=False, delta=False,
+                              filtros=None, exportar=''):
         """
         Executa spider via subprocess (alternativa)
         
         Args:
             filtro: Filtro de busca  
-            max_pages: Máximo de páginas
+            max_pages: Máximo de páginas (0 = todas)
             callback_url: URL para callback
+            resume: Retoma a coleta interrompida a partir do checkpoint
+            delta: Exporta apenas produtos novos, alterados ou removidos
+            filtros: Lista de termos coletados na mesma execução
+            exportar: Snapshot colunar adicional ('parquet' ou 'arrow')
         """
         
         try:
@@ -70,8 +291,15 @@ class ScrapyServimedWrapper:
                 '-a', f'filtro={filtro}',
                 '-a', f'max_pages={max_pages}',
                 '-a', f'callback_url={callback_url}',
+                '-a', f'resume={resume}',
+                '-a', f'delta={delta}',
                 '-s', 'LOG_LEVEL=INFO'
             ]
+            if filtros:
+                # Um termo por linha: termos podem conter vírgulas
+                cmd[4:4] = ['-a', 'filtros=' + '\n'.join(filtros)]
+            if exportar:
+                cmd[4:4] = ['-a', f'exportar={exportar}']
             
             # Executar
             result = subprocess.run(
@@ -97,10 +325,54 @@ class ScrapyServimedWrapper:
             self.logger.error(f"Erro no subprocess: {e}")
             return False
     
+    def arquivo_resultados(self):
+        """Arquivo de resultados mais recente (JSONL do modo streaming ou JSON)"""
+        try:
+            if ARQUIVO_JSONL.exists() and (
+                not ARQUIVO_JSON.exists() or ARQUIVO_JSONL.stat().st_mtime >= ARQUIVO_JSON.stat().st_mtime
+            ):
+                return ARQUIVO_JSONL
+        except OSError:
+            pass
+        return ARQUIVO_JSON
+    
+    def iter_results(self):
+        """
+        Itera os produtos da última coleta sem carregar o arquivo inteiro
+        
+        Yields:
+            dict: Um produto por vez (vazio se não houver resultados)
+        """
+        result_file = self.arquivo_resultados()
+        if result_file.exists():
+            yield from iter_produtos(result_file)
+    
     def get_results(self):
         """Retorna resultados do scraping"""
         
-        result_file = Path('data/servimed_produtos_scrapy.json')
+        result_file = self.arquivo_resultados()
+        
+        if result_file.suffix == '.jsonl' and result_file.exists():
+            try:
+                produtos = list(iter_produtos(result_file))
+                self.logger.info(f"Resultados carregados (JSONL): {len(produtos)} produtos")
+                
+                return {
+                    'success': True,
+                    'produtos': produtos,
+                    'metadata': {
+                        'scraped_at': datetime.fromtimestamp(result_file.stat().st_mtime).isoformat(),
+                        'total_produtos': len(produtos),
+                        'scraper': 'scrapy',
+                        'fonte': 'servimed',
+                        'formato': 'jsonl'
+                    },
+                    'total': len(produtos)
+                }
+                
+            except Exception as e:
+                self.logger.error(f"Erro ao carregar resultados: {e}")
+                return {'success': False, 'error': str(e)}
         
         if result_file.exists():
             try:
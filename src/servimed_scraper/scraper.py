@@ -8,7 +8,9 @@ Coleta produtos da API do Servimed com opções de filtro personalizáveis.
 import requests
 import json
 import time
+import threading
 import urllib3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import sys
 
@@ -17,6 +19,12 @@ sys.path.append(str(Path(__file__).parent.parent.parent))
 
 from config.settings import *
 from config.paths import OUTPUT_FILES
+from src.catalogo import CatalogoIndex, HistoricoPrecos
+from src.catalogo.historico import HISTORICO_ENABLED
+from src.coleta import CheckpointColeta, ProdutoOriginal, para_json
+from src.coleta.payload import PayloadBusca
+from src.coleta.controle_taxa import CONTROLE_TAXA_ENABLED, controlador_para
+from src.rede import nova_sessao
 
 # Desabilita avisos de SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -28,8 +36,8 @@ class ServimedScraperCompleto:
     """
     
     def __init__(self):
-        self.session = requests.Session()
-        self.session.verify = VERIFY_SSL
+        # Sessão própria sobre o pool de conexões compartilhado do processo
+        self.session = nova_sessao(verify=VERIFY_SSL)
         
         # Tokens
         self.access_token = ACCESS_TOKEN
@@ -40,8 +48,18 @@ class ServimedScraperCompleto:
         self.x_cart = X_CART
         self.client_id = CLIENT_ID
         self.users = USERS
+        self.payload = PayloadBusca(self.client_id, self.logged_user, self.users, RECORDS_PER_PAGE)
         
-        # Lista para armazenar todos os produtos
+        # Controlador de taxa do host, compartilhado com o spider no mesmo processo
+        # (None = atraso fixo DELAY_BETWEEN_REQUESTS)
+        self.controle_taxa = controlador_para(BASE_URL) if CONTROLE_TAXA_ENABLED else None
+        
+        # Sessão por thread e intervalo fixo compartilhado do modo simultâneo
+        self._local = threading.local()
+        self._lock_intervalo = threading.Lock()
+        self._proximo_inicio = 0.0
+        
+        # Lista para armazenar todos os produtos (registros compactos, ver src/coleta/produto.py)
         self.todos_produtos = []
         
         # Configura sessão
@@ -87,37 +105,19 @@ class ServimedScraperCompleto:
         """
         url = f'{BASE_URL}{API_ENDPOINT}?siteVersion={SITE_VERSION}'
         
-        payload = {
-            "filtro": filtro,  # Filtro personalizável
-            "pagina": page,
-            "registrosPorPagina": RECORDS_PER_PAGE,
-            "ordenarDecrescente": False,
-            "colunaOrdenacao": "nenhuma",
-            "clienteId": self.client_id,
-            "tipoVendaId": 1,
-            "fabricanteIdFiltro": 0,
-            "pIIdFiltro": 0,
-            "cestaPPFiltro": False,
-            "codigoExterno": 0,
-            "codigoUsuario": int(self.logged_user),
-            "promocaoSelecionada": "",
-            "indicadorTipoUsuario": "CLI",
-            "kindUser": 0,
-            "xlsx": [],
-            "principioAtivo": "",
-            "master": False,
-            "kindSeller": 0,
-            "grupoEconomico": "",
-            "users": self.users,
-            "list": True
-        }
+        # Corpo pré-codificado: só filtro e página mudam entre requisições
+        body = self.payload.corpo(page, filtro)
         
         # Atualiza timestamp
         headers = self.headers.copy()
         headers['x-peperone'] = str(int(time.time() * 1000))
         
+        inicio = self.controle_taxa.adquirir() if self.controle_taxa else None
+        status, retry_after = None, None
         try:
-            response = self.session.post(url, json=payload, headers=headers, timeout=TIMEOUT_SECONDS)
+            session = getattr(self._local, 'session', None) or self.session
+            response = session.post(url, data=body, headers=headers, timeout=TIMEOUT_SECONDS)
+            status, retry_after = response.status_code, response.headers.get('Retry-After')
             
             if response.status_code == 200:
                 return response.json()
@@ -128,68 +128,119 @@ class ServimedScraperCompleto:
         except requests.RequestException as e:
             print(f"Erro na requisição: {e}")
             return None
+        finally:
+            if self.controle_taxa:
+                self.controle_taxa.liberar(inicio, status, retry_after)
     
     def processar_produto(self, produto):
         """
         Extrai apenas os campos específicos solicitados
         """
-        produto_processado = {
-            'gtin_ean': produto.get('codigoBarras'),
-            'codigo': produto.get('codigoExterno'),
-            'descricao': produto.get('descricao'),
-            'preco_fabrica': produto.get('valorBase'),
-            'estoque': produto.get('quantidadeEstoque'),
-            'data_coleta': time.strftime('%Y-%m-%d %H:%M:%S')
-        }
-        return produto_processado
+        return ProdutoOriginal(
+            gtin=produto.get('codigoBarras'),
+            codigo=produto.get('codigoExterno'),
+            descricao=produto.get('descricao'),
+            preco_fabrica=produto.get('valorBase'),
+            estoque=produto.get('quantidadeEstoque'),
+            data_coleta=time.strftime('%Y-%m-%d %H:%M:%S')
+        )
     
-    def get_all_products(self, filtro="", max_pages=None):
+    def get_all_products(self, filtro="", max_pages=None, resume=False, paginas_simultaneas=None):
         """
         Coleta produtos com filtro específico
         
         Args:
             filtro (str): Termo para buscar (vazio = todos os produtos)
             max_pages (int, optional): Máximo de páginas para coletar
+            resume (bool): Retoma a coleta interrompida, buscando só as páginas pendentes
+            paginas_simultaneas (int, optional): Páginas buscadas em paralelo após a
+                primeira (padrão PAGINAS_SIMULTANEAS; 1 = uma página por vez)
             
         Returns:
             list: Lista com todos os produtos encontrados
         """
-        page = 1
+        if paginas_simultaneas is None:
+            paginas_simultaneas = PAGINAS_SIMULTANEAS
         
         tipo_busca = "TODOS OS PRODUTOS" if not filtro else f"FILTRO: '{filtro}'"
         print(f"Coletando produtos - {tipo_busca}")
         print("=" * 60)
         
+        # Páginas concluídas + cursor, para retomar após token expirado ou reinício
+        # (busca de uma página: só em memória)
+        checkpoint = CheckpointColeta('original', filtro, persistente=max_pages != 1)
+        paginas = {}
+        if resume and checkpoint.carregar():
+            paginas = {pagina: [ProdutoOriginal.de_mapping(produto) for produto in produtos]
+                       for pagina, produtos in checkpoint.produtos_por_pagina().items()}
+            print(f"Retomando coleta: {len(checkpoint.paginas_concluidas)} paginas ja concluidas "
+                  f"({sum(len(produtos) for produtos in paginas.values())} produtos)")
+        
+        if paginas_simultaneas > 1:
+            completa = self._coletar_paginas_simultaneas(filtro, max_pages, checkpoint, paginas,
+                                                         paginas_simultaneas)
+        else:
+            completa = self._coletar_paginas_em_sequencia(filtro, max_pages, checkpoint, paginas)
+        
+        if completa:
+            checkpoint.concluir()
+        else:
+            print("Coleta incompleta - use --resume para continuar das paginas pendentes")
+        
+        print(f"\nCOLETA FINALIZADA: {len(self.todos_produtos)} produtos coletados")
+        return self.todos_produtos
+    
+    def _coletar_paginas_em_sequencia(self, filtro, max_pages, checkpoint, paginas):
+        """
+        Uma página por vez, na ordem
+        
+        Returns:
+            bool: True se a coleta chegou ao fim
+        """
+        for pagina in sorted(paginas):
+            self.todos_produtos.extend(paginas[pagina])
+        total_pages = checkpoint.total_paginas()
+        page = 1
+        
         while True:
+            if page in checkpoint.paginas_concluidas and total_pages:
+                # Página coletada em execução anterior
+                if page >= total_pages or (max_pages and page >= max_pages):
+                    return True
+                page += 1
+                continue
+            
             print(f"Pagina {page:>4}...", end=" ")
             
             data = self.search_products(filtro, page)
             
             if not data or 'lista' not in data:
                 print("Erro ou fim dos dados")
-                break
+                return False
             
             products = data['lista']
             
             if not products:  # Lista vazia = fim dos produtos
                 print("Fim dos produtos")
-                break
+                return True
             
             # Processa cada produto
-            for produto in products:
-                produto_processado = self.processar_produto(produto)
-                self.todos_produtos.append(produto_processado)
+            produtos_pagina = [self.processar_produto(produto) for produto in products]
+            self.todos_produtos.extend(produtos_pagina)
             
             # Info de paginação
             total_records = data.get('totalRegistros', 0)
             records_per_page = data.get('registrosPorPagina', RECORDS_PER_PAGE)
             total_pages = (total_records + records_per_page - 1) // records_per_page
             
+            checkpoint.definir_cursor(records_per_page, total_records)
+            checkpoint.registrar_pagina(page, produtos_pagina)
+            
             print(f"OK {len(products)} produtos (Total: {len(self.todos_produtos)}/{total_records})")
             
             # Verifica se deve parar
             if page >= total_pages or (max_pages and page >= max_pages):
-                break
+                return True
             
             # A cada 50 páginas, salva backup
             if page % 50 == 0:
@@ -197,11 +248,131 @@ class ServimedScraperCompleto:
             
             page += 1
             
-            # Pausa entre requisições
-            if DELAY_BETWEEN_REQUESTS > 0:
+            # Pausa entre requisições (com controle de taxa o intervalo é adaptativo)
+            if self.controle_taxa is None and DELAY_BETWEEN_REQUESTS > 0:
                 time.sleep(DELAY_BETWEEN_REQUESTS)
+    
+    def _coletar_paginas_simultaneas(self, filtro, max_pages, checkpoint, paginas, simultaneas):
+        """
+        Página 1 define o total; as demais vão para um pool de threads limitado
         
-        print(f"\nCOLETA FINALIZADA: {len(self.todos_produtos)} produtos coletados")
+        As threads dividem o controle de taxa do host (ou o intervalo fixo
+        DELAY_BETWEEN_REQUESTS) e cada página concluída vai para o checkpoint.
+        Os produtos são remontados na ordem das páginas no final.
+        
+        Returns:
+            bool: True se todas as páginas foram coletadas
+        """
+        total_pages = checkpoint.total_paginas()
+        
+        if total_pages is None:
+            print(f"Pagina {1:>4}...", end=" ")
+            data = self.search_products(filtro, 1)
+            
+            if not data or 'lista' not in data:
+                print("Erro ou fim dos dados")
+                return False
+            if not data['lista']:
+                print("Fim dos produtos")
+                return True
+            
+            total_records = data.get('totalRegistros', 0)
+            records_per_page = data.get('registrosPorPagina', RECORDS_PER_PAGE)
+            total_pages = (total_records + records_per_page - 1) // records_per_page
+            
+            paginas[1] = [self.processar_produto(produto) for produto in data['lista']]
+            checkpoint.definir_cursor(records_per_page, total_records)
+            checkpoint.registrar_pagina(1, paginas[1])
+            print(f"OK {len(paginas[1])} produtos ({total_records} registros em {total_pages} paginas)")
+        
+        ultima_pagina = min(total_pages, max_pages) if max_pages else total_pages
+        pendentes = checkpoint.paginas_pendentes(ultima_pagina)
+        falhas = []
+        
+        if pendentes:
+            print(f"Buscando {len(pendentes)} paginas, ate {simultaneas} em paralelo")
+            with ThreadPoolExecutor(max_workers=min(simultaneas, len(pendentes)),
+                                    thread_name_prefix='servimed-pagina') as executor:
+                futuros = {executor.submit(self._buscar_pagina, filtro, page): page for page in pendentes}
+                for concluidas, futuro in enumerate(as_completed(futuros), 1):
+                    page = futuros[futuro]
+                    produtos_pagina = futuro.result()
+                    if produtos_pagina is None:
+                        falhas.append(page)
+                        print(f"Pagina {page:>4}... Erro ({concluidas}/{len(pendentes)})")
+                        continue
+                    
+                    # O checkpoint (gravado a cada página) substitui o backup a cada 50 páginas
+                    paginas[page] = produtos_pagina
+                    checkpoint.registrar_pagina(page, produtos_pagina)
+                    print(f"Pagina {page:>4}... OK {len(produtos_pagina)} produtos ({concluidas}/{len(pendentes)})")
+        
+        for pagina in sorted(paginas):
+            self.todos_produtos.extend(paginas[pagina])
+        
+        if falhas:
+            print(f"{len(falhas)} paginas com erro: {sorted(falhas)}")
+        return not falhas
+    
+    def _buscar_pagina(self, filtro, page):
+        """
+        Busca e processa uma página (executado nas threads do modo simultâneo)
+        
+        Returns:
+            list: Produtos processados, ou None em caso de erro
+        """
+        # requests.Session não é thread-safe: cada thread usa uma cópia (mesmos cookies e pool)
+        if getattr(self._local, 'session', None) is None:
+            session = nova_sessao(verify=VERIFY_SSL)
+            session.cookies.update(self.session.cookies)
+            self._local.session = session
+        
+        if self.controle_taxa is None:
+            self._aguardar_intervalo()
+        
+        data = self.search_products(filtro, page)
+        if not data or 'lista' not in data:
+            return None
+        return [self.processar_produto(produto) for produto in data['lista']]
+    
+    def _aguardar_intervalo(self):
+        """Intervalo fixo entre o início de duas requisições, somado entre as threads"""
+        with self._lock_intervalo:
+            agora = time.monotonic()
+            espera = self._proximo_inicio - agora
+            self._proximo_inicio = max(agora, self._proximo_inicio) + DELAY_BETWEEN_REQUESTS
+        if espera > 0:
+            time.sleep(espera)
+    
+    def get_products_filtros(self, filtros, max_pages=None, resume=False):
+        """
+        Coleta vários termos, sem repetir produtos encontrados por mais de um
+        
+        Args:
+            filtros (list): Termos de busca
+            max_pages (int, optional): Máximo de páginas por termo
+            resume (bool): Retoma cada termo a partir do seu checkpoint
+            
+        Returns:
+            list: Produtos únicos por código, com os termos em `filtros`
+        """
+        por_codigo = {}
+        for termo in filtros:
+            inicio = len(self.todos_produtos)
+            self.get_all_products(filtro=termo, max_pages=max_pages, resume=resume)
+            
+            novos = self.todos_produtos[inicio:]
+            del self.todos_produtos[inicio:]
+            for produto in novos:
+                existente = por_codigo.get(produto['codigo'])
+                if existente is None:
+                    produto['filtros'] = [termo]
+                    por_codigo[produto['codigo']] = produto
+                    self.todos_produtos.append(produto)
+                elif termo not in existente['filtros']:
+                    existente['filtros'].append(termo)
+        
+        print(f"\n{len(filtros)} FILTROS: {len(self.todos_produtos)} produtos unicos")
         return self.todos_produtos
     
     def salvar_backup(self, page, filtro=""):
@@ -219,7 +390,7 @@ class ServimedScraperCompleto:
         
         backup_file = OUTPUT_FILES['backup']
         with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump(dados_backup, f, ensure_ascii=False, indent=2)
+            json.dump(dados_backup, f, ensure_ascii=False, indent=2, default=para_json)
         
         print(f"Backup salvo: {backup_file}")
     
@@ -260,21 +431,59 @@ class ServimedScraperCompleto:
         }
         
         with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(dados_finais, f, ensure_ascii=False, indent=2)
+            json.dump(dados_finais, f, ensure_ascii=False, indent=2, default=para_json)
         
         print(f"Arquivo final salvo: {filename}")
         print(f"Total de produtos salvos: {len(self.todos_produtos)}")
         
         return str(filename)
     
-    def run(self, filtro="", max_pages=None):
+    def atualizar_catalogo(self):
+        """Grava os produtos coletados no índice local do catálogo"""
+        if not self.todos_produtos:
+            return 0
+        try:
+            total = CatalogoIndex().atualizar(self.todos_produtos)
+            print(f"Indice do catalogo atualizado: {total} produtos")
+            return total
+        except Exception as e:
+            print(f"Erro ao atualizar indice do catalogo: {e}")
+            return 0
+    
+    def registrar_historico(self, filtro=""):
+        """Grava preço e estoque desta coleta no histórico (snapshots por dia)"""
+        if not self.todos_produtos or not HISTORICO_ENABLED:
+            return None
+        historico = None
+        try:
+            historico = HistoricoPrecos()
+            historico.iniciar_coleta(filtro)
+            historico.registrar(self.todos_produtos)
+            resumo = historico.concluir_coleta()
+            print(f"Historico de precos: coleta {resumo['coleta']} ({resumo['produtos']} produtos)")
+            return resumo
+        except Exception as e:
+            print(f"Erro ao gravar historico de precos: {e}")
+            return None
+        finally:
+            if historico is not None:
+                historico.fechar()
+    
+    def run(self, filtro="", max_pages=None, resume=False, filtros=None):
         """
         Executa a coleta completa de produtos
         
         Args:
             filtro (str): Termo para filtrar produtos (padrão: vazio = todos)
             max_pages (int): Número máximo de páginas (padrão: None = sem limite)
+            resume (bool): Retoma a partir do checkpoint da coleta interrompida
+            filtros (list): Vários termos coletados na mesma execução
         """
+        if filtros and len(filtros) > 1:
+            filtro = ', '.join(filtros)
+        elif filtros:
+            filtro, filtros = filtros[0], None
+        
         print("=" * 60)
         print("SERVIMED SCRAPER - COLETA DE PRODUTOS")
         print("=" * 60)
@@ -294,11 +503,20 @@ class ServimedScraperCompleto:
         start_time = time.time()
         
         # Coleta produtos com ou sem filtro
-        produtos = self.get_all_products(filtro=filtro, max_pages=max_pages)
+        if filtros:
+            produtos = self.get_products_filtros(filtros, max_pages=max_pages, resume=resume)
+        else:
+            produtos = self.get_all_products(filtro=filtro, max_pages=max_pages, resume=resume)
         
         # Salva arquivo final
         arquivo_salvo = self.salvar_todos_produtos(filtro=filtro)
         
+        # Atualiza índice local do catálogo (consultado pelo Nível 3)
+        self.atualizar_catalogo()
+        
+        # Acrescenta os preços/estoques desta coleta ao histórico
+        self.registrar_historico(filtro=filtro)
+        
         end_time = time.time()
         duracao = end_time - start_time
         
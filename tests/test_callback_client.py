@@ -0,0 +1,281 @@
+"""
+Testes para o cliente da API de callback (src/api_client/callback_client.py)
+"""
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.api_client.callback_client import CallbackAPIClient
+
+
+def resposta(status_code):
+    """Cria uma resposta fake do requests"""
+    response = Mock()
+    response.status_code = status_code
+    response.text = '[]'
+    return response
+
+
+class TestCallbackTokenCache:
+    """Testes do cache do token OAuth2"""
+
+    CREDENCIAIS = ('usuario', 'senha', 'cliente', 'segredo')
+
+    @pytest.fixture(autouse=True)
+    def cache_isolado(self, monkeypatch):
+        from src.api_client.token_cache import CacheToken
+        cache = CacheToken(usar_redis=False, margem=60)
+        monkeypatch.setattr('src.api_client.callback_client.cache_token', cache)
+        return cache
+
+    def novo_cliente(self, respostas):
+        client = CallbackAPIClient(base_url='http://callback.teste')
+        client.session = Mock()
+        client.session.headers = {}
+        client.session.post.side_effect = respostas
+        return client
+
+    def resposta_token(self, token, expires_in=3600):
+        response = resposta(200)
+        response.json.return_value = {'access_token': token, 'expires_in': expires_in}
+        return response
+
+    def test_token_reutilizado_entre_clientes(self):
+        """Testa que uma segunda tarefa reutiliza o token sem chamar /oauth/token"""
+        primeiro = self.novo_cliente([self.resposta_token('tok-1')])
+        segundo = self.novo_cliente([])
+
+        assert primeiro.authenticate(*self.CREDENCIAIS) is True
+        assert segundo.authenticate(*self.CREDENCIAIS) is True
+
+        assert segundo.session.post.call_count == 0
+        assert segundo.session.headers['Authorization'] == 'Bearer tok-1'
+
+    def test_renovacao_antes_do_vencimento(self):
+        """Testa que o token é renovado antes de expirar, antes da requisição"""
+        client = self.novo_cliente([self.resposta_token('tok-1', expires_in=3600),
+                                    self.resposta_token('tok-2'), resposta(201)])
+        client.authenticate(*self.CREDENCIAIS)
+        client.token_renovar_em = 0
+
+        client.request('POST', '/produto', json=[])
+
+        assert client.access_token == 'tok-2'
+        assert client.session.post.call_args_list[-1].args[0] == 'http://callback.teste/produto'
+
+    def test_401_renova_e_repete_uma_vez(self):
+        """Testa que um 401 gera um token novo e uma única nova tentativa"""
+        client = self.novo_cliente([self.resposta_token('tok-1'), resposta(401),
+                                    self.resposta_token('tok-2'), resposta(401)])
+        client.authenticate(*self.CREDENCIAIS)
+
+        response = client.request('POST', '/produto', json=[])
+
+        assert response.status_code == 401
+        assert client.access_token == 'tok-2'
+        assert client.session.post.call_count == 4
+
+
+class TestCallbackEnvioEmLotes:
+    """Testes do envio em lotes (send_products_chunked)"""
+
+    def setup_method(self):
+        self.client = CallbackAPIClient(base_url='http://callback.teste')
+        self.client.access_token = 'token'
+        self.client.session = Mock()
+        self.produtos = ({'gtin_ean': f'789{i}', 'codigo': i, 'descricao': f'P{i}',
+                          'preco_fabrica': 1, 'estoque': 2} for i in range(5))
+
+    def test_divide_em_lotes_e_converte(self):
+        """Testa que a entrada (gerador) vira lotes no formato da API"""
+        self.client.session.post.return_value = resposta(201)
+
+        relatorio = self.client.send_products_chunked(self.produtos, batch_size=2, max_in_flight=2)
+
+        assert relatorio['success'] is True
+        assert relatorio['total_produtos'] == 5
+        assert [lote['quantidade'] for lote in relatorio['lotes']] == [2, 2, 1]
+        enviados = [c.kwargs['json'] for c in self.client.session.post.call_args_list]
+        assert sorted(p['codigo'] for lote in enviados for p in lote) == ['0', '1', '2', '3', '4']
+        assert enviados[0][0]['gtin'] in ('7890', '7892', '7894')
+
+    @patch('src.api_client.callback_client.time.sleep')
+    def test_lote_falho_tenta_novamente_sozinho(self, mock_sleep):
+        """Testa que apenas o lote com erro é repetido e o relatório aponta a falha"""
+        respostas = {0: [resposta(201)], 1: [resposta(503), resposta(201)], 2: [resposta(400)]}
+
+        def post(url, json, timeout):
+            return respostas[int(json[0]['codigo']) // 2].pop(0)
+        self.client.session.post.side_effect = post
+
+        relatorio = self.client.send_products_chunked(self.produtos, batch_size=2, max_in_flight=1,
+                                                      max_retries=2)
+
+        lotes = relatorio['lotes']
+        assert [lote['status'] for lote in lotes] == ['ok', 'ok', 'erro']
+        assert [lote['tentativas'] for lote in lotes] == [1, 2, 1]
+        assert relatorio['lotes_falhos'] == 1
+        assert relatorio['success'] is False
+
+    def test_pular_lotes_ja_enviados(self):
+        """Testa a retomada: lotes informados não são reenviados"""
+        self.client.session.post.return_value = resposta(201)
+
+        relatorio = self.client.send_products_chunked(self.produtos, batch_size=2, pular_lotes=[0, 1])
+
+        assert self.client.session.post.call_count == 1
+        assert relatorio['lotes_pulados'] == 2
+        assert relatorio['success'] is True
+
+
+class TestCallbackUploader:
+    """Testes do envio em segundo plano (CallbackUploader)"""
+
+    def test_envia_em_lotes_durante_a_producao(self):
+        """Testa que os lotes saem antes de finalizar e o relatório fecha os totais"""
+        from src.api_client.uploader import CallbackUploader
+
+        client = CallbackAPIClient(base_url='http://callback.teste')
+        client.access_token = 'token'
+        client.session = Mock()
+        client.session.post.return_value = resposta(201)
+
+        uploader = CallbackUploader(client, batch_size=2, max_in_flight=2, max_fila=2).iniciar()
+        for i in range(5):
+            uploader.enviar({'gtin': str(i), 'codigo': str(i), 'descricao': '', 'preco_fabrica': 1, 'estoque': 1})
+        relatorio = uploader.finalizar(timeout=5)
+
+        assert relatorio['success'] is True
+        assert relatorio['total_produtos'] == 5
+        assert [lote['quantidade'] for lote in relatorio['lotes']] == [2, 2, 1]
+        assert client.session.post.call_count == 3
+
+    def test_mesmos_lotes_no_streaming_e_no_reenvio(self):
+        """Testa que produto inválido é ignorado igual nos dois caminhos: os índices dos lotes coincidem"""
+        from src.api_client.uploader import CallbackUploader
+
+        produtos = [{'codigo': str(i), 'preco_fabrica': 'abc' if i == 1 else 1, 'estoque': 1} for i in range(5)]
+
+        def lotes_enviados(client):
+            return {tuple(p['codigo'] for p in c.kwargs['json']) for c in client.session.post.call_args_list}
+
+        streaming = CallbackAPIClient(base_url='http://callback.teste')
+        streaming.access_token = 'token'
+        streaming.session = Mock()
+        streaming.session.post.return_value = resposta(201)
+        uploader = CallbackUploader(streaming, batch_size=2, max_in_flight=1).iniciar()
+        for produto in produtos:
+            uploader.enviar(produto)
+        relatorio_streaming = uploader.finalizar(timeout=5)
+
+        reenvio = CallbackAPIClient(base_url='http://callback.teste')
+        reenvio.access_token = 'token'
+        reenvio.session = Mock()
+        reenvio.session.post.return_value = resposta(201)
+        relatorio_reenvio = reenvio.send_products_chunked(iter(produtos), batch_size=2, max_in_flight=1)
+
+        assert relatorio_reenvio['success'] is True
+        assert relatorio_streaming['total_produtos'] == relatorio_reenvio['total_produtos'] == 4
+        assert lotes_enviados(streaming) == lotes_enviados(reenvio) == {('0', '2'), ('3', '4')}
+
+    def test_falha_de_autenticacao_consome_a_fila(self):
+        """Testa que sem token a fila é drenada (sem travar o produtor) e o envio falha"""
+        from src.api_client.uploader import CallbackUploader
+
+        client = Mock()
+        client.access_token = None
+        client.authenticate.return_value = False
+
+        uploader = CallbackUploader(client, batch_size=1, max_in_flight=1, max_fila=1).iniciar()
+        for i in range(3):
+            uploader.enviar({'codigo': str(i)})
+        relatorio = uploader.finalizar(timeout=5)
+
+        assert relatorio['success'] is False
+        assert relatorio['total_produtos'] == 3
+        assert 'autenticação' in relatorio['error']
+
+
+class TestCeleryPipelineStreaming:
+    """Testes do CeleryPipeline como destino em streaming"""
+
+    @patch('src.scrapy_servimed.pipelines.ThreadPool')
+    @patch('src.scrapy_servimed.pipelines.CallbackUploader')
+    def test_itens_vao_para_o_uploader(self, mock_uploader_cls, mock_pool_cls):
+        """Testa que, com callback_url, os itens são enfileirados em vez de acumulados"""
+        from src.scrapy_servimed.pipelines import CeleryPipeline
+
+        uploader = mock_uploader_cls.return_value.iniciar.return_value
+        uploader.enviar_sem_bloquear.return_value = True
+        stats = Mock()
+        spider = Mock(callback_url='http://callback.teste')
+
+        pipeline = CeleryPipeline(streaming=True, stats=stats)
+        pipeline.open_spider(spider)
+        item = {'gtin': '789', 'codigo': '1', 'descricao': 'P', 'preco_fabrica': 1.0, 'estoque': 1, 'url': 'x'}
+
+        assert pipeline.process_item(item, spider) is item
+        uploader.enviar_sem_bloquear.assert_called_once_with(
+            {'gtin': '789', 'codigo': '1', 'descricao': 'P', 'preco_fabrica': 1.0, 'estoque': 1})
+        assert pipeline.callback_data == []
+        stats.set_value.assert_called_with('callback/streaming', True)
+
+    @patch('src.scrapy_servimed.pipelines.ThreadPool')
+    @patch('src.scrapy_servimed.pipelines.threads.deferToThreadPool')
+    @patch('src.scrapy_servimed.pipelines.CallbackUploader')
+    def test_fila_cheia_espera_no_pool_proprio_e_pausa(self, mock_uploader_cls, mock_defer, mock_pool_cls):
+        """Testa que itens atrasados esperam no pool do pipeline, em ordem, e pausam o engine"""
+        from twisted.internet.defer import Deferred
+        from src.scrapy_servimed.pipelines import CeleryPipeline
+
+        uploader = mock_uploader_cls.return_value.iniciar.return_value
+        uploader.enviar_sem_bloquear.return_value = False
+        esperas = [Deferred(), Deferred()]
+        mock_defer.side_effect = esperas
+        crawler = Mock()
+        crawler.engine.paused = False
+        crawler.engine.pause.side_effect = lambda: setattr(crawler.engine, 'paused', True)
+        crawler.engine.unpause.side_effect = lambda: setattr(crawler.engine, 'paused', False)
+        spider = Mock(callback_url='http://callback.teste')
+
+        pipeline = CeleryPipeline(streaming=True, stats=Mock(), max_espera=2, crawler=crawler)
+        pipeline.open_spider(spider)
+        pipeline.process_item({'gtin': '1', 'codigo': '1'}, spider)
+        pipeline.process_item({'gtin': '2', 'codigo': '2'}, spider)
+
+        # O segundo item nem tenta a fila: entra atrás do primeiro no pool do pipeline
+        assert uploader.enviar_sem_bloquear.call_count == 1
+        assert mock_defer.call_args[0][1] is mock_pool_cls.return_value
+        assert crawler.engine.paused is True
+
+        esperas[0].callback(None)
+        assert crawler.engine.paused is False
+
+    def test_relatorio_registra_lotes_aceitos(self):
+        """Testa que os lotes aceitos no streaming ficam nas estatísticas para o reenvio"""
+        from src.scrapy_servimed.pipelines import CeleryPipeline
+
+        stats = Mock()
+        pipeline = CeleryPipeline(streaming=True, stats=stats)
+        pipeline.registrar_relatorio({'success': False, 'total_lotes': 3, 'lotes_ok': 2, 'lotes_falhos': 1,
+                                      'total_produtos': 5, 'lotes': [{'lote': 0, 'status': 'ok'},
+                                                                     {'lote': 1, 'status': 'erro'},
+                                                                     {'lote': 2, 'status': 'ok'}]})
+
+        stats.set_value.assert_any_call('callback/lotes_enviados', [0, 2])
+
+    def test_sem_callback_url_mantem_compatibilidade(self):
+        """Testa que sem callback_url o pipeline só acumula os dados"""
+        from src.scrapy_servimed.pipelines import CeleryPipeline
+
+        spider = Mock(callback_url='')
+        pipeline = CeleryPipeline(streaming=True)
+        pipeline.open_spider(spider)
+        pipeline.process_item({'gtin': '789', 'codigo': '1'}, spider)
+
+        assert pipeline.uploader is None
+        assert len(pipeline.callback_data) == 1
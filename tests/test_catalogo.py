@@ -0,0 +1,330 @@
+"""
+Testes para o índice local do catálogo (src/catalogo/)
+"""
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.catalogo import CatalogoIndex
+
+
+@pytest.fixture
+def catalogo(tmp_path):
+    """Índice em arquivo temporário"""
+    return CatalogoIndex(db_path=tmp_path / "catalogo.db", ttl=3600)
+
+
+class TestCatalogoIndex:
+    """Testes do índice por codigo/gtin"""
+    
+    def test_atualizar_e_buscar_por_codigo(self, catalogo):
+        """Produto gravado é encontrado pelo código"""
+        total = catalogo.atualizar([
+            {'gtin': '7898636193493', 'codigo': '444212', 'descricao': 'Hidratante',
+             'preco_fabrica': 19.9, 'estoque': 5}
+        ])
+        
+        produto = catalogo.buscar_por_codigo('444212')
+        
+        assert total == 1
+        assert produto['descricao'] == 'Hidratante'
+        assert produto['preco_fabrica'] == 19.9
+        assert produto['estoque'] == 5
+    
+    def test_buscar_por_gtin_formato_original(self, catalogo):
+        """Produtos do sistema original (gtin_ean, codigo int) são normalizados"""
+        catalogo.atualizar([
+            {'gtin_ean': '789000', 'codigo': 123, 'descricao': 'X', 'preco_fabrica': None, 'estoque': None}
+        ])
+        
+        produto = catalogo.buscar(codigo='', gtin='789000')
+        
+        assert produto['codigo'] == '123'
+        assert produto['preco_fabrica'] == 0.0
+        assert produto['estoque'] == 0
+    
+    def test_produto_sem_codigo_ignorado(self, catalogo):
+        """Produtos sem código não entram no índice"""
+        assert catalogo.atualizar([{'gtin': '1', 'codigo': ''}]) == 0
+        assert catalogo.total() == 0
+    
+    def test_entrada_vencida_conta_como_ausente(self, catalogo):
+        """Entradas mais antigas que o TTL não são retornadas"""
+        with patch('src.catalogo.indice.time.time', return_value=1000.0):
+            catalogo.atualizar([{'gtin': '1', 'codigo': 'A1', 'descricao': 'Velho'}])
+        
+        with patch('src.catalogo.indice.time.time', return_value=1000.0 + 7200):
+            assert catalogo.buscar_por_codigo('A1') is None
+            assert catalogo.buscar_por_codigo('A1', ttl=0) is not None
+    
+    def test_atualizacao_substitui_entrada(self, catalogo):
+        """Nova coleta atualiza preço e estoque"""
+        catalogo.atualizar([{'codigo': 'A1', 'preco_fabrica': 1.0, 'estoque': 1}])
+        catalogo.atualizar([{'codigo': 'A1', 'preco_fabrica': 2.0, 'estoque': 0}])
+        
+        produto = catalogo.buscar_por_codigo('A1')
+        
+        assert catalogo.total() == 1
+        assert produto['preco_fabrica'] == 2.0
+        assert produto['estoque'] == 0
+    
+    def test_remover_produtos(self, catalogo):
+        """Produtos removidos do catálogo deixam de ser encontrados"""
+        catalogo.atualizar([{'codigo': 'A1'}, {'codigo': 'A2'}])
+        
+        assert catalogo.remover(['A1', 'X9', '']) == 1
+        assert catalogo.buscar_por_codigo('A1') is None
+        assert catalogo.buscar_por_codigo('A2') is not None
+    
+    def test_pipeline_remove_itens_removidos(self, catalogo):
+        """Removidos do DeltaPipeline (estoque 0) saem do índice em vez de virar linha viva"""
+        from src.scrapy_servimed.pipelines import CatalogoPipeline
+        
+        catalogo.atualizar([{'codigo': 'A1', 'estoque': 5}])
+        pipeline = CatalogoPipeline(batch_size=10)
+        pipeline.catalogo = catalogo
+        
+        pipeline.process_item({'codigo': 'A2', 'estoque': 3}, None)
+        pipeline.process_item({'codigo': 'A1', 'estoque': 0, 'alteracao': 'removido'}, None)
+        pipeline.close_spider(None)
+        
+        assert catalogo.buscar_por_codigo('A1') is None
+        assert catalogo.buscar_por_codigo('A2')['estoque'] == 3
+        assert pipeline.total_indexado == 1
+
+
+class TestDeltaStore:
+    """Testes da coleta incremental (src/catalogo/delta.py)"""
+    
+    def abrir(self, tmp_path):
+        from src.catalogo.delta import DeltaStore
+        return DeltaStore('dipirona', db_path=tmp_path / "catalogo.db", log_path=tmp_path / "delta.jsonl")
+    
+    def test_classifica_novo_alterado_e_inalterado(self, tmp_path):
+        """Somente produtos com conteúdo diferente da última coleta passam"""
+        store = self.abrir(tmp_path)
+        assert store.classificar({'codigo': '1', 'preco_fabrica': 10, 'estoque': 5}) == 'novo'
+        assert store.classificar({'codigo': '2', 'preco_fabrica': 20, 'estoque': 1}) == 'novo'
+        store.salvar()
+        
+        store = self.abrir(tmp_path)
+        assert store.classificar({'codigo': '1', 'preco_fabrica': '10.0', 'estoque': '5'}) is None
+        assert store.classificar({'codigo': '2', 'preco_fabrica': 20, 'estoque': 0}) == 'alterado'
+        assert store.contagem['inalterado'] == 1
+    
+    def test_removidos_saem_com_estoque_zero_e_vao_para_o_log(self, tmp_path):
+        """Produto ausente numa coleta completa é emitido como removido"""
+        import json
+        
+        store = self.abrir(tmp_path)
+        store.classificar({'codigo': '1', 'descricao': 'A', 'estoque': 5})
+        store.classificar({'codigo': '2', 'descricao': 'B', 'estoque': 3})
+        store.salvar()
+        
+        store = self.abrir(tmp_path)
+        store.classificar({'codigo': '1', 'descricao': 'A', 'estoque': 5})
+        removidos = store.produtos_removidos()
+        contagem = store.salvar()
+        
+        assert [(p['codigo'], p['estoque']) for p in removidos] == [('2', 0)]
+        assert contagem['removido'] == 1
+        assert '2' not in self.abrir(tmp_path).anteriores
+        
+        ultima = json.loads((tmp_path / "delta.jsonl").read_text(encoding='utf-8').splitlines()[-1])
+        assert ultima['alteracao'] == 'removido'
+        assert ultima['antes'] == {'estoque': 3}
+        assert ultima['depois'] == {'estoque': 0}
+    
+    def test_preparo_so_altera_a_referencia_quando_confirmado(self, tmp_path):
+        """Mudanças preparadas não valem até confirmar_delta; descartadas, voltam a aparecer"""
+        from src.catalogo.delta import confirmar_delta, descartar_delta
+        
+        store = self.abrir(tmp_path)
+        store.classificar({'codigo': '1', 'estoque': 5})
+        preparo = store.preparar()
+        store.fechar()
+        
+        assert self.abrir(tmp_path).anteriores == {}
+        descartar_delta(preparo, db_path=tmp_path / "catalogo.db")
+        assert confirmar_delta(preparo, db_path=tmp_path / "catalogo.db", log_path=tmp_path / "delta.jsonl") == 0
+        
+        store = self.abrir(tmp_path)
+        assert store.classificar({'codigo': '1', 'estoque': 5}) == 'novo'
+        preparo = store.preparar()
+        store.fechar()
+        
+        assert confirmar_delta(preparo, db_path=tmp_path / "catalogo.db", log_path=tmp_path / "delta.jsonl") == 1
+        assert self.abrir(tmp_path).classificar({'codigo': '1', 'estoque': 5}) is None
+        assert (tmp_path / "delta.jsonl").read_text(encoding='utf-8').count('\n') == 1
+    
+    def test_pipeline_so_grava_coleta_terminada(self, tmp_path):
+        """DeltaPipeline não avança a referência em coleta interrompida e só prepara quando há envio"""
+        from unittest.mock import Mock
+        from src.catalogo.delta import confirmar_delta
+        from src.scrapy_servimed.pipelines import DeltaPipeline
+        
+        crawler = Mock()
+        for motivo, callback_url in (('shutdown', ''), ('finished', 'http://callback.teste')):
+            pipeline = DeltaPipeline(habilitado=True, crawler=crawler)
+            pipeline.store = self.abrir(tmp_path)
+            pipeline.process_item({'codigo': '1', 'estoque': 5}, spider=None)
+            pipeline.spider_closed(Mock(callback_url=callback_url), motivo)
+            assert self.abrir(tmp_path).anteriores == {}
+        
+        preparos = [c[0][1] for c in crawler.stats.set_value.call_args_list if c[0][0] == 'delta/preparo']
+        assert len(preparos) == 1
+        confirmar_delta(preparos[0], db_path=tmp_path / "catalogo.db", log_path=tmp_path / "delta.jsonl")
+        assert '1' in self.abrir(tmp_path).anteriores
+        
+        # Sem envio para a API a coleta terminada grava na hora
+        pipeline = DeltaPipeline(habilitado=True, crawler=crawler)
+        pipeline.store = self.abrir(tmp_path)
+        pipeline.process_item({'codigo': '2', 'estoque': 1}, spider=None)
+        pipeline.spider_closed(Mock(callback_url=''), 'finished')
+        assert '2' in self.abrir(tmp_path).anteriores
+    
+    def test_pipeline_descarta_inalterados(self, tmp_path):
+        """DeltaPipeline marca mudanças e descarta produtos inalterados"""
+        from scrapy.exceptions import DropItem
+        from src.catalogo.delta import hash_produto
+        from src.scrapy_servimed.pipelines import DeltaPipeline
+        
+        pipeline = DeltaPipeline(habilitado=True)
+        pipeline.store = self.abrir(tmp_path)
+        anterior = {'codigo': '1', 'estoque': 5}
+        pipeline.store.anteriores['1'] = (hash_produto(anterior), anterior)
+        
+        item = pipeline.process_item({'codigo': '2', 'estoque': 1}, spider=None)
+        assert item['alteracao'] == 'novo'
+        with pytest.raises(DropItem):
+            pipeline.process_item({'codigo': '1', 'estoque': 5}, spider=None)
+
+
+class TestCacheProdutos:
+    """Testes da memoização das buscas de produto (src/catalogo/cache.py)"""
+
+    def test_lru_remove_o_menos_usado(self):
+        """Testa que, cheio, o cache descarta a entrada usada há mais tempo"""
+        from src.catalogo.cache import CacheProdutos
+
+        cache = CacheProdutos(tamanho=2, usar_redis=False)
+        cache.guardar('1', {'codigo': '1'})
+        cache.guardar('2', {'codigo': '2'})
+        cache.obter('1')
+        cache.guardar('3', {'codigo': '3'})
+
+        assert cache.obter('2') == (False, None)
+        assert cache.obter('1') == (True, {'codigo': '1'})
+        assert cache.estatisticas()['removidos_lru'] == 1
+
+    def test_ttl_e_cache_negativo(self):
+        """Testa que 'não encontrado' é memorizado com TTL próprio e que entradas expiram"""
+        from src.catalogo.cache import CacheProdutos
+
+        cache = CacheProdutos(ttl=60, ttl_negativo=10, usar_redis=False)
+        with patch('src.catalogo.cache.time.time', return_value=1000):
+            cache.guardar('1', {'codigo': '1'})
+            cache.guardar('404', None)
+
+        with patch('src.catalogo.cache.time.time', return_value=1005):
+            assert cache.obter('404') == (True, None)
+        with patch('src.catalogo.cache.time.time', return_value=1020):
+            assert cache.obter('404') == (False, None)
+            assert cache.obter('1') == (True, {'codigo': '1'})
+
+        estatisticas = cache.estatisticas()
+        assert (estatisticas['hits'], estatisticas['hits_negativos'], estatisticas['expirados']) == (1, 1, 1)
+
+    def test_busca_unica_e_erro_nao_memorizado(self):
+        """Testa que a mesma chave é buscada uma vez e que exceções não ficam no cache"""
+        from src.catalogo.cache import CacheProdutos
+
+        cache = CacheProdutos(usar_redis=False)
+        buscas = []
+
+        def buscar():
+            buscas.append(1)
+            if len(buscas) == 1:
+                raise RuntimeError('portal indisponível')
+            return {'codigo': '1'}
+
+        with pytest.raises(RuntimeError):
+            cache.obter_ou_buscar('1', buscar)
+        assert cache.obter_ou_buscar('1', buscar) == {'codigo': '1'}
+        assert cache.obter_ou_buscar('1', buscar) == {'codigo': '1'}
+        assert len(buscas) == 2
+
+
+class TestHistoricoPrecos:
+    """Testes do histórico de preço/estoque (src/catalogo/historico.py)"""
+
+    def coletar(self, historico, produtos, escopo=''):
+        historico.iniciar_coleta(escopo)
+        historico.registrar(produtos)
+        return historico.concluir_coleta()
+
+    def test_serie_de_preco_de_um_produto(self, tmp_path):
+        """Testa que cada coleta acrescenta uma observação, sem sobrescrever"""
+        from src.catalogo import HistoricoPrecos
+
+        historico = HistoricoPrecos(diretorio=tmp_path)
+        self.coletar(historico, [{'codigo': 1, 'preco_fabrica': '10.5', 'estoque': 3},
+                                 {'codigo': 2, 'preco_fabrica': 1.0, 'estoque': 1}])
+        resumo = self.coletar(historico, [{'codigo': 1, 'preco_fabrica': 11.0, 'estoque': 3},
+                                          {'codigo': 1, 'preco_fabrica': 99.0, 'estoque': 0}])
+
+        serie = historico.historico('1')
+
+        assert resumo['produtos'] == 1
+        assert [(s['preco_fabrica'], s['estoque']) for s in serie] == [(10.5, 3), (11.0, 3)]
+        assert serie[0]['data'] == resumo['particao']
+        assert (tmp_path / f"{resumo['particao']}.db").exists()
+        assert historico.historico('1', desde='2999-01-01') == []
+        historico.fechar()
+
+    def test_estoque_alterado_nas_ultimas_coletas(self, tmp_path):
+        """Testa a consulta de mudanças pelo índice, limitada às N últimas coletas"""
+        from src.catalogo import HistoricoPrecos
+
+        historico = HistoricoPrecos(diretorio=tmp_path)
+        self.coletar(historico, [{'codigo': 'A', 'estoque': 5}, {'codigo': 'B', 'estoque': 1},
+                                 {'codigo': 'C', 'estoque': 2, 'preco_fabrica': 1.0}])
+        self.coletar(historico, [{'codigo': 'A', 'estoque': 4}, {'codigo': 'B', 'estoque': 1},
+                                 {'codigo': 'C', 'estoque': 2, 'preco_fabrica': 2.0}])
+        self.coletar(historico, [{'codigo': 'A', 'estoque': 4}, {'codigo': 'B', 'estoque': 0}])
+
+        assert [p['codigo'] for p in historico.estoque_alterado(ultimas=1)] == ['B']
+
+        alterados = historico.estoque_alterado(ultimas=2)
+        assert [(p['codigo'], p['estoque']) for p in alterados] == [('A', 4), ('B', 0)]
+        assert alterados[0]['alteracoes'][0]['de'] == 5
+
+        assert [p['codigo'] for p in historico.preco_alterado(ultimas=3)] == ['C']
+        assert historico.estoque_alterado(ultimas=3, escopo='outro') == []
+        historico.fechar()
+
+    def test_pipeline_registra_antes_do_delta(self, tmp_path, monkeypatch):
+        """Testa que o pipeline grava todos os itens, exceto os removidos emitidos pelo delta"""
+        from src.catalogo.delta import REMOVIDO
+        from src.catalogo import HistoricoPrecos
+        from src.scrapy_servimed.pipelines import HistoricoPipeline
+        from unittest.mock import Mock
+
+        monkeypatch.setattr('src.catalogo.historico.HISTORICO_DIR', tmp_path)
+        spider = Mock(escopo='dipirona')
+        pipeline = HistoricoPipeline(batch_size=2)
+        pipeline.open_spider(spider)
+        for codigo in ('1', '2', '3'):
+            pipeline.process_item({'codigo': codigo, 'preco_fabrica': 1.0, 'estoque': 1}, spider)
+        pipeline.process_item({'codigo': '4', 'estoque': 0, 'alteracao': REMOVIDO}, spider)
+        pipeline.close_spider(spider)
+
+        historico = HistoricoPrecos(diretorio=tmp_path)
+        assert historico.coletas()[0]['total'] == 3
+        assert historico.coletas()[0]['escopo'] == 'dipirona'
+        assert historico.historico('4') == []
+        historico.fechar()
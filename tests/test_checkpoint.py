@@ -0,0 +1,148 @@
+"""
+Testes para o checkpoint de coleta (src/coleta/checkpoint.py)
+"""
+import pytest
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.coleta import CheckpointColeta
+
+
+class TestCheckpointColeta:
+    """Testes do registro de páginas e cursor"""
+
+    def test_registra_e_recarrega(self, tmp_path):
+        """Testa que páginas e cursor sobrevivem a uma nova instância"""
+        checkpoint = CheckpointColeta('original', 'dipirona 500mg', diretorio=tmp_path)
+        checkpoint.definir_cursor(25, 60)
+        checkpoint.registrar_pagina(2, [{'codigo': 2}])
+        checkpoint.registrar_pagina(1, [{'codigo': 1}])
+
+        retomado = CheckpointColeta('original', 'dipirona 500mg', diretorio=tmp_path)
+        assert retomado.carregar() is True
+        assert retomado.paginas_concluidas == {1, 2}
+        assert retomado.total_paginas() == 3
+        assert retomado.paginas_pendentes(3) == [3]
+        assert list(retomado.produtos()) == [{'codigo': 1}, {'codigo': 2}]
+
+    def test_linha_truncada_e_ignorada(self, tmp_path):
+        """Testa que uma escrita interrompida não invalida o checkpoint"""
+        checkpoint = CheckpointColeta('scrapy', diretorio=tmp_path)
+        checkpoint.registrar_pagina(1, [{'codigo': 1}])
+        with open(checkpoint.arquivo_paginas, 'a', encoding='utf-8') as f:
+            f.write('{"pagina": 2, "produtos": [{"cod')
+
+        assert checkpoint.carregar() is True
+        assert checkpoint.paginas_concluidas == {1}
+
+    def test_tamanho_de_pagina_diferente_recomeca(self, tmp_path):
+        """Testa que páginas de outro tamanho não são reaproveitadas"""
+        checkpoint = CheckpointColeta('scrapy', diretorio=tmp_path)
+        checkpoint.definir_cursor(25, 100)
+        checkpoint.registrar_pagina(1, [{'codigo': 1}])
+
+        checkpoint.carregar()
+        checkpoint.definir_cursor(50, 100)
+
+        assert checkpoint.paginas_concluidas == set()
+        assert CheckpointColeta('scrapy', diretorio=tmp_path).carregar() is False
+
+    def test_execucoes_simultaneas_nao_se_apagam(self, tmp_path):
+        """Testa que cada execução tem seus arquivos e só a completa remove os seus"""
+        primeira = CheckpointColeta('scrapy', 'dipirona', diretorio=tmp_path)
+        segunda = CheckpointColeta('scrapy', 'dipirona', diretorio=tmp_path)
+        primeira.registrar_pagina(1, [{'codigo': 1}])
+        segunda.registrar_pagina(1, [{'codigo': 2}])
+
+        segunda.concluir()
+
+        assert primeira.arquivo_paginas.exists()
+        retomada = CheckpointColeta('scrapy', 'dipirona', diretorio=tmp_path)
+        assert retomada.carregar() is True
+        assert retomada.execucao == primeira.execucao
+        assert list(retomada.produtos()) == [{'codigo': 1}]
+
+    def test_coleta_completa_remove_execucoes_paradas(self, tmp_path):
+        """Testa que uma coleta completa substitui execuções interrompidas antes dela"""
+        interrompida = CheckpointColeta('scrapy', 'dipirona', diretorio=tmp_path)
+        interrompida.definir_cursor(25, 60)
+        interrompida.registrar_pagina(1, [{'codigo': 1}])
+        time.sleep(0.01)
+
+        completa = CheckpointColeta('scrapy', 'dipirona', diretorio=tmp_path)
+        completa.registrar_pagina(1, [{'codigo': 1}])
+        completa.concluir()
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_nao_persistente_nao_grava_arquivos(self, tmp_path):
+        """Testa que buscas de uma página controlam as páginas só em memória"""
+        checkpoint = CheckpointColeta('original', 'dipirona', diretorio=tmp_path, persistente=False)
+        checkpoint.definir_cursor(25, 60)
+        checkpoint.registrar_pagina(1, [{'codigo': 1}])
+        checkpoint.concluir()
+
+        assert checkpoint.paginas_concluidas == set()
+        assert list(tmp_path.iterdir()) == []
+        assert checkpoint.carregar() is False
+
+
+class TestScraperOriginalResume:
+    """Testes da retomada no sistema original"""
+
+    @patch('src.servimed_scraper.scraper.DELAY_BETWEEN_REQUESTS', 0)
+    @patch('src.servimed_scraper.scraper.PAGINAS_SIMULTANEAS', 1)
+    def test_resume_busca_apenas_paginas_pendentes(self, tmp_path, monkeypatch):
+        """Testa que a coleta retomada não refaz páginas concluídas"""
+        from src.servimed_scraper.scraper import ServimedScraperCompleto
+
+        monkeypatch.setattr('src.coleta.checkpoint.CHECKPOINT_DIR', tmp_path)
+
+        def pagina(numero):
+            return {'lista': [{'codigoExterno': numero}], 'totalRegistros': 3, 'registrosPorPagina': 1}
+
+        # Primeira execução cai na página 3
+        scraper = ServimedScraperCompleto()
+        with patch.object(scraper, 'search_products', side_effect=[pagina(1), pagina(2), None]):
+            scraper.get_all_products()
+
+        scraper = ServimedScraperCompleto()
+        with patch.object(scraper, 'search_products', side_effect=[pagina(3)]) as mock_search:
+            produtos = scraper.get_all_products(resume=True)
+
+        mock_search.assert_called_once_with('', 3)
+        assert [p['codigo'] for p in produtos] == [1, 2, 3]
+        assert list(tmp_path.iterdir()) == []
+
+    @patch('src.servimed_scraper.scraper.DELAY_BETWEEN_REQUESTS', 0)
+    def test_paginas_simultaneas_em_ordem_e_retomada(self, tmp_path, monkeypatch):
+        """Testa que o modo simultâneo remonta as páginas em ordem e retoma só as que falharam"""
+        from src.servimed_scraper.scraper import ServimedScraperCompleto
+
+        monkeypatch.setattr('src.coleta.checkpoint.CHECKPOINT_DIR', tmp_path)
+
+        def buscar(filtro, page, falhar=()):
+            # Páginas iniciais demoram mais: terminam fora de ordem
+            time.sleep(0.01 * (8 - page))
+            if page in falhar:
+                return None
+            return {'lista': [{'codigoExterno': page}], 'totalRegistros': 8, 'registrosPorPagina': 1}
+
+        scraper = ServimedScraperCompleto()
+        with patch.object(scraper, 'search_products', side_effect=lambda f, p: buscar(f, p, falhar={5})):
+            produtos = scraper.get_all_products(paginas_simultaneas=4)
+
+        assert [p['codigo'] for p in produtos] == [1, 2, 3, 4, 6, 7, 8]
+
+        scraper = ServimedScraperCompleto()
+        with patch.object(scraper, 'search_products', side_effect=buscar) as mock_search:
+            produtos = scraper.get_all_products(resume=True, paginas_simultaneas=4)
+
+        mock_search.assert_called_once_with('', 5)
+        assert [p['codigo'] for p in produtos] == list(range(1, 9))
+        assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,85 @@
+"""
+Testes para o pool de conexões compartilhado (src/rede/conexoes.py)
+"""
+import pytest
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.rede import conexoes
+from src.rede.conexoes import RegistroConexoes, nova_sessao
+
+
+class _KeepAlive(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor():
+    """Servidor HTTP local com keep-alive"""
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAlive)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def registro(monkeypatch):
+    """Registro isolado do restante do processo"""
+    novo = RegistroConexoes(tamanho_padrao=2, tamanhos={'peapi.servimed.com.br': 16})
+    monkeypatch.setattr(conexoes, 'registro', novo)
+    yield novo
+    novo.limpar()
+
+
+class TestRegistroConexoes:
+    """Testes do registro de pools por host"""
+
+    def test_sessoes_compartilham_conexao(self, servidor, registro):
+        """Testa que duas sessões (dois clientes) reutilizam a mesma conexão keep-alive"""
+        for _ in range(3):
+            assert nova_sessao().get(f'{servidor}/a').status_code == 200
+        nova_sessao().close()
+        assert nova_sessao().get(f'{servidor}/b').status_code == 200
+
+        estatisticas = conexoes.estatisticas_conexoes()[servidor]
+        assert estatisticas == {'tamanho_pool': 2, 'requisicoes': 4, 'conexoes_novas': 1, 'reutilizadas': 3}
+
+    def test_toda_sessao_passa_pelo_orcamento(self, servidor, registro):
+        """Testa que o adaptador das sessões consome o orçamento com a conta do cabeçalho loggeduser"""
+        sessao = nova_sessao()
+        sessao.headers['loggeduser'] = '22850'
+
+        with patch('src.rede.conexoes.limitar') as mock_limitar, patch('src.rede.conexoes.recuar') as mock_recuar:
+            assert sessao.get(f'{servidor}/a').status_code == 200
+
+        mock_limitar.assert_called_once_with(f'{servidor}/a', '22850')
+        assert mock_recuar.call_args[0][:2] == (f'{servidor}/a', 200)
+
+    def test_tamanho_por_host(self, registro):
+        """Testa o tamanho configurado por host e o adaptador único por host"""
+        adaptador = registro.adaptador('https://peapi.servimed.com.br/api/x')
+
+        assert adaptador is registro.adaptador('https://peapi.servimed.com.br/api/y')
+        assert adaptador._pool_maxsize == 16
+        assert registro.adaptador('https://desafio.cotefacil.net/produto')._pool_maxsize == 2
+
+    def test_tamanhos_por_host_do_ambiente(self):
+        """Testa a leitura de POOL_CONEXOES_HOSTS"""
+        assert conexoes._tamanhos_por_host('a.com=4, b.com = 8,invalido') == {'a.com': 4, 'b.com': 8}
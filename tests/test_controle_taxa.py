@@ -0,0 +1,59 @@
+"""
+Testes para o controle adaptativo de taxa (src/coleta/controle_taxa.py)
+"""
+import pytest
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.coleta.controle_taxa import ControladorTaxa, controlador_para
+
+
+class TestControladorTaxa:
+    """Testes do ajuste AIMD de concorrência e intervalo"""
+
+    def test_respostas_saudaveis_aumentam_concorrencia(self):
+        """Testa o aumento aditivo e a redução do intervalo com respostas rápidas"""
+        controlador = ControladorTaxa(concorrencia=1, maximo=4, intervalo=0.0, latencia_alvo=5)
+
+        for _ in range(10):
+            controlador.liberar(controlador.adquirir(), 200)
+
+        assert 3 <= controlador.concorrencia <= 4
+        assert controlador.estatisticas()['ok'] == 10
+
+    @pytest.mark.parametrize('status', [403, 429, 500, None])
+    def test_recuo_em_bloqueio_ou_erro(self, status):
+        """Testa que 403/429/5xx/erro de rede cortam a concorrência e dobram o intervalo"""
+        controlador = ControladorTaxa(concorrencia=8, maximo=8, intervalo=0.2)
+
+        controlador.liberar(controlador.adquirir(), status)
+
+        assert controlador.concorrencia == 4
+        assert controlador.intervalo == pytest.approx(0.4)
+
+    def test_limita_requisicoes_em_voo(self):
+        """Testa que adquirir() bloqueia além da concorrência atual"""
+        controlador = ControladorTaxa(concorrencia=1, maximo=1, intervalo=0.0)
+        inicio = controlador.adquirir()
+        adquiridos = []
+
+        thread = threading.Thread(target=lambda: adquiridos.append(controlador.adquirir()))
+        thread.start()
+        time.sleep(0.05)
+        assert adquiridos == []
+
+        controlador.liberar(inicio, 200)
+        thread.join(timeout=1)
+        assert len(adquiridos) == 1
+
+    def test_um_controlador_por_host(self):
+        """Testa que spider e sistema original compartilham o controlador do host"""
+        assert controlador_para('https://peapi.servimed.com.br/api/x') is \
+            controlador_para('https://peapi.servimed.com.br/api/y?p=1')
+        assert controlador_para('https://peapi.servimed.com.br') is not \
+            controlador_para('https://desafio.cotefacil.net')
@@ -0,0 +1,252 @@
+"""
+Testes para a coleta em etapas encadeadas (src/nivel2/etapas.py)
+"""
+import json
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.nivel2 import etapas
+from src.nivel2.celery_app import app
+
+
+class TestPlanejamento:
+    """Testes da divisão em fatias e da montagem da cadeia"""
+
+    def test_dividir_paginas(self):
+        """Testa intervalos de páginas respeitando max_pages"""
+        assert etapas.dividir_paginas(7, None, 3) == [[1, 3], [4, 6], [7, 7]]
+        assert etapas.dividir_paginas(100, 5, 20) == [[1, 5]]
+        assert etapas.dividir_paginas(2, 0, 20) == [[1, 2]]
+
+    def test_fatias_para_as_vagas_de_coleta(self):
+        """Testa o tamanho das fatias: todas as vagas ocupadas, dentro dos limites"""
+        with patch.object(etapas, 'COLETA_PAGINAS_POR_FATIA', 20), \
+             patch.object(etapas, 'COLETA_PAGINAS_MIN_FATIA', 5):
+            assert etapas.paginas_por_fatia(100, 1) == 20
+            assert etapas.paginas_por_fatia(100, 8) == 13
+            assert etapas.paginas_por_fatia(12, 8) == 5
+            assert etapas.paginas_por_fatia(3, 8) == 5
+
+    def test_vagas_dos_workers_da_fila_de_coleta(self):
+        """Testa a soma da concorrência dos workers que consomem a fila de coleta"""
+        inspecao = Mock()
+        inspecao.active_queues.return_value = {
+            'coleta@a': [{'name': etapas.FILA_COLETA}],
+            'coleta@b': [{'name': etapas.FILA_COLETA}],
+            'envio@c': [{'name': 'outra'}],
+        }
+        inspecao.stats.return_value = {w: {'pool': {'max-concurrency': 4}} for w in ('coleta@a', 'coleta@b', 'envio@c')}
+
+        with patch.object(app.control, 'inspect', return_value=inspecao):
+            assert etapas.vagas_coleta() == 8
+
+        inspecao.active_queues.return_value = None
+        with patch.object(app.control, 'inspect', return_value=inspecao):
+            assert etapas.vagas_coleta() == 1
+
+    def test_delta_e_resume_usam_a_tarefa_unica(self):
+        """Testa que a cadeia só é usada quando pedida e sem delta/resume"""
+        from src.nivel2.queue_client import TaskQueueClient
+
+        cliente = TaskQueueClient()
+        with patch.object(app, 'send_task') as mock_send_task:
+            cliente.enqueue_scraping_task('u', 's', framework='scrapy')
+            cliente.enqueue_scraping_task('u', 's', framework='scrapy', encadeado=True)
+            cliente.enqueue_scraping_task('u', 's', framework='scrapy', encadeado=True, resume=True)
+            cliente.enqueue_scraping_task('u', 's', framework='scrapy', encadeado=True, delta=True)
+
+        assert [chamada[0][0] for chamada in mock_send_task.call_args_list] == [
+            'src.nivel2.tasks.processar_scraping_simple', 'src.nivel2.etapas.processar_coleta_encadeada',
+            'src.nivel2.tasks.processar_scraping_simple', 'src.nivel2.tasks.processar_scraping_simple']
+
+    def test_coordenador_repassa_resume_para_a_tarefa_unica(self):
+        """Testa que o coordenador não ignora o resume: se substitui pela tarefa única"""
+        task_data = {'filtro': 'a', 'resume': True}
+
+        with patch.object(etapas.processar_coleta_encadeada, 'replace') as mock_replace, \
+             patch('src.servimed_scraper.scraper.ServimedScraperCompleto') as mock_scraper_class:
+            etapas.processar_coleta_encadeada.apply(args=[task_data])
+
+        assinatura = mock_replace.call_args[0][0]
+        assert assinatura.task == 'src.nivel2.tasks.processar_scraping_simple'
+        assert assinatura.args == (task_data,)
+        mock_scraper_class.assert_not_called()
+
+    def test_montar_cadeia(self):
+        """Testa chord das fatias -> exportação -> envio, cada etapa na sua fila"""
+        fatias = [{'filtro': 'a', 'inicio': 1, 'fim': 1, 'arquivo': 'f0'},
+                  {'filtro': 'b', 'inicio': 1, 'fim': 1, 'arquivo': 'f1'}]
+
+        cadeia = etapas.montar_cadeia({'callback_url': 'https://api.teste', 'exportar': 'arrow'}, fatias, 'c1')
+
+        # O envio entra no corpo do chord, depois da exportação
+        exportacao, envio = cadeia.body.tasks
+        assert [tarefa.task for tarefa in cadeia.tasks] == ['src.nivel2.etapas.coletar_fatia'] * 2
+        assert cadeia.tasks[0].kwargs == {'framework': 'scrapy'}
+        assert exportacao.task == 'src.nivel2.etapas.exportar_coleta'
+        assert exportacao.kwargs == {'coleta_id': 'c1', 'escopo': 'a|b', 'exportar': 'arrow'}
+        assert envio.task == 'src.nivel2.etapas.enviar_coleta'
+        assert envio.kwargs == {'callback_url': 'https://api.teste'}
+        assert set(app.conf.task_routes) == {
+            'src.nivel2.etapas.processar_coleta_encadeada', 'src.nivel2.etapas.coletar_fatia',
+            'src.nivel2.etapas.exportar_coleta', 'src.nivel2.etapas.enviar_coleta'}
+
+
+class TestEtapas:
+    """Testes das etapas de exportação e envio"""
+
+    def test_exportar_junta_fatias_sem_repetir(self, tmp_path):
+        """Testa a junção das fatias: um produto por código, com os termos somados"""
+        fatias = []
+        for indice, linhas in enumerate([
+            [{'codigo': '1', 'descricao': 'A', 'filtros': ['a']}, {'codigo': '2', 'descricao': 'B', 'filtros': ['a']}],
+            [{'codigo': '2', 'descricao': 'B', 'filtros': ['b']}, {'codigo': '3', 'descricao': 'C', 'filtros': ['b']}],
+        ]):
+            arquivo = tmp_path / 'c1' / f'fatia_{indice:04d}.jsonl'
+            arquivo.parent.mkdir(exist_ok=True)
+            arquivo.write_text(''.join(json.dumps(linha) + '\n' for linha in linhas), encoding='utf-8')
+            fatias.append({'arquivo': str(arquivo), 'completa': indice == 0})
+
+        with patch.object(etapas, 'COLETA_ARTEFATOS_DIR', tmp_path), \
+             patch('src.catalogo.historico.HISTORICO_ENABLED', False):
+            resultado = etapas.exportar_coleta.apply(args=[fatias], kwargs={'coleta_id': 'c1'}).get()
+
+        produtos = [json.loads(linha) for linha in Path(resultado['arquivo']).read_text(encoding='utf-8').splitlines()]
+        assert [produto['codigo'] for produto in produtos] == ['1', '2', '3']
+        assert produtos[1]['filtros'] == ['a', 'b']
+        assert resultado['fatias_incompletas'] == 1
+        assert not any(Path(fatia['arquivo']).exists() for fatia in fatias)
+
+    @patch('src.scrapy_wrapper.ScrapyServimedWrapper')
+    def test_fatia_com_checkpoint_da_coleta(self, mock_wrapper_class, tmp_path):
+        """Testa que a fatia retoma o checkpoint próprio, no diretório da coleta"""
+        mock_wrapper_class.return_value.crawl.return_value = {
+            'success': True, 'produtos': [{'codigo': '1'}], 'stats': {}}
+        arquivo = tmp_path / 'c1' / 'fatia_0003.jsonl'
+        fatia = {'filtro': 'a', 'inicio': 7, 'fim': 9, 'arquivo': str(arquivo)}
+
+        resultado = etapas.coletar_fatia.apply(args=[fatia]).get()
+
+        kwargs = mock_wrapper_class.return_value.crawl.call_args[1]
+        assert kwargs['diretorio_checkpoint'] == tmp_path / 'c1' / 'checkpoints'
+        assert kwargs['execucao'] == 'fatia_0003'
+        assert kwargs['resume'] is True
+        assert resultado['completa'] is True
+        assert resultado['total'] == 1
+
+    @patch('src.nivel2.etapas.coletar_paginas_original')
+    @patch('src.scrapy_wrapper.ScrapyServimedWrapper')
+    def test_fatia_usa_sistema_original_quando_o_scrapy_falha(self, mock_wrapper_class, mock_original, tmp_path):
+        """Testa o fallback da tarefa única: esgotadas as tentativas do Scrapy, o sistema original coleta a fatia"""
+        crawl = mock_wrapper_class.return_value.crawl
+        crawl.return_value = {'success': False, 'error': 'Timeout de 300s na coleta'}
+        mock_original.return_value = [{'codigo': '1', 'filtros': ['a']}]
+        arquivo = tmp_path / 'c1' / 'fatia_0000.jsonl'
+        fatia = {'filtro': 'a', 'inicio': 1, 'fim': 4, 'arquivo': str(arquivo)}
+
+        resultado = etapas.coletar_fatia.apply(args=[fatia]).get()
+
+        assert crawl.call_count == etapas.TENTATIVAS_ETAPA + 1
+        mock_original.assert_called_once_with('a', 1, 4)
+        assert resultado['completa'] is True
+        assert resultado['framework'] == 'original'
+        assert json.loads(arquivo.read_text(encoding='utf-8'))['codigo'] == '1'
+
+    @patch('src.nivel2.etapas.coletar_paginas_original', side_effect=RuntimeError('falha na página 2'))
+    @patch('src.scrapy_wrapper.ScrapyServimedWrapper')
+    def test_fatia_com_erro_nao_derruba_a_coleta(self, mock_wrapper_class, mock_original, tmp_path):
+        """Testa que, sem Scrapy nem sistema original, a fatia volta incompleta em vez de falhar o chord"""
+        mock_wrapper_class.return_value.crawl.return_value = {'success': False, 'error': 'Timeout de 300s na coleta'}
+        arquivo = tmp_path / 'c1' / 'fatia_0000.jsonl'
+        fatia = {'filtro': 'a', 'inicio': 1, 'fim': 4, 'arquivo': str(arquivo)}
+
+        resultado = etapas.coletar_fatia.apply(args=[fatia]).get()
+
+        assert resultado['completa'] is False
+        assert resultado['total'] == 0
+        assert resultado['paginas_pendentes'] == 4
+        assert 'Timeout' in resultado['erro'] and 'página 2' in resultado['erro']
+        # Arquivo vazio: a exportação junta as demais fatias normalmente
+        assert arquivo.read_text(encoding='utf-8') == ''
+
+    @patch('src.nivel2.etapas.coletar_paginas_original', return_value=[])
+    @patch('src.scrapy_wrapper.ScrapyServimedWrapper')
+    def test_fatia_framework_original(self, mock_wrapper_class, mock_original, tmp_path):
+        """Testa que o framework pedido pelo cliente chega à fatia: 'original' não usa o Scrapy"""
+        fatia = {'filtro': 'a', 'inicio': 1, 'fim': 1, 'arquivo': str(tmp_path / 'fatia_0000.jsonl')}
+
+        resultado = etapas.coletar_fatia.apply(args=[fatia], kwargs={'framework': 'original'}).get()
+
+        mock_wrapper_class.return_value.crawl.assert_not_called()
+        assert resultado['completa'] is True
+
+    def test_exportar_falha_sem_nenhuma_fatia(self, tmp_path):
+        """Testa que a cadeia falha (sem novas tentativas) quando todas as fatias falharam"""
+        arquivo = tmp_path / 'c1' / 'fatia_0000.jsonl'
+        arquivo.parent.mkdir()
+        arquivo.write_text('', encoding='utf-8')
+        fatias = [{'arquivo': str(arquivo), 'completa': False, 'erro': 'Erro no Scrapy: Timeout'}]
+
+        with patch.object(etapas, 'COLETA_ARTEFATOS_DIR', tmp_path):
+            resultado = etapas.exportar_coleta.apply(args=[fatias], kwargs={'coleta_id': 'c1'})
+
+        assert isinstance(resultado.result, etapas.ColetaSemProdutos)
+        assert not (tmp_path / 'c1' / 'produtos.jsonl').exists()
+
+    @patch('src.catalogo.HistoricoPrecos')
+    def test_coleta_parcial_fora_do_historico(self, mock_historico_class, tmp_path):
+        """Testa que uma coleta com fatias incompletas não vira snapshot no histórico de preços"""
+        arquivo = tmp_path / 'c1' / 'fatia_0000.jsonl'
+        arquivo.parent.mkdir()
+        arquivo.write_text('{"codigo": "1"}\n', encoding='utf-8')
+        fatias = [{'arquivo': str(arquivo), 'completa': False, 'paginas_pendentes': 1}]
+
+        with patch.object(etapas, 'COLETA_ARTEFATOS_DIR', tmp_path), \
+             patch('src.catalogo.historico.HISTORICO_ENABLED', True):
+            resultado = etapas.exportar_coleta.apply(args=[fatias], kwargs={'coleta_id': 'c1'}).get()
+
+        mock_historico_class.assert_not_called()
+        assert resultado['historico'] is None
+        assert resultado['fatias_incompletas'] == 1
+
+    @patch('src.api_client.callback_client.CallbackAPIClient')
+    def test_envio_de_coleta_parcial(self, mock_client_class, tmp_path):
+        """Testa que o envio bem-sucedido de uma coleta com fatias incompletas não é 'success'"""
+        arquivo = tmp_path / 'produtos.jsonl'
+        arquivo.write_text('{"codigo": "1"}\n', encoding='utf-8')
+        api_client = mock_client_class.return_value
+        api_client.authenticate.return_value = True
+        api_client.send_products_chunked.return_value = {'success': True, 'lotes': [{'lote': 0, 'status': 'ok'}]}
+        exportacao = {'coleta_id': 'c1', 'arquivo': str(arquivo), 'total': 1, 'fatias': 2,
+                      'fatias_incompletas': 1, 'arquivo_colunar': None}
+
+        resultado = etapas.enviar_coleta.apply(args=[exportacao]).get()
+
+        assert resultado['status'] == 'partial'
+        assert resultado['api_response'] is True
+
+    @patch('src.api_client.callback_client.CallbackAPIClient')
+    def test_envio_repete_apenas_lotes_que_falharam(self, mock_client_class, tmp_path):
+        """Testa que a nova tentativa do envio pula os lotes já aceitos"""
+        arquivo = tmp_path / 'produtos.jsonl'
+        arquivo.write_text('{"codigo": "1"}\n', encoding='utf-8')
+
+        api_client = mock_client_class.return_value
+        api_client.authenticate.return_value = True
+        api_client.send_products_chunked.side_effect = [
+            {'success': False, 'lotes': [{'lote': 0, 'status': 'ok'}, {'lote': 1, 'status': 'erro'}]},
+            {'success': True, 'lotes': [{'lote': 0, 'status': 'pulado'}, {'lote': 1, 'status': 'ok'}]},
+        ]
+        exportacao = {'coleta_id': 'c1', 'arquivo': str(arquivo), 'total': 1, 'fatias': 1,
+                      'fatias_incompletas': 0, 'arquivo_colunar': None}
+
+        resultado = etapas.enviar_coleta.apply(args=[exportacao]).get()
+
+        assert resultado['status'] == 'success'
+        assert api_client.send_products_chunked.call_count == 2
+        assert api_client.send_products_chunked.call_args_list[1][1]['pular_lotes'] == {0}
@@ -27,6 +27,9 @@ class TestMainSimple:
         """Testa função executar_nivel_1 básica"""
         args = Mock()
         args.filtro = "test"
+        args.filtros = None
+        args.arquivo_filtros = None
+        args.exportar = None
         args.max_pages = 1
         
         # Mock básico
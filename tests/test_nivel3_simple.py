@@ -71,6 +71,26 @@ class TestPedidoQueueClientSimple:
         call_args = mock_send_task.call_args[1]['args'][0]  # args parameter
         assert call_args['callback_url'] == "https://custom.callback.url"
     
+    @patch('src.pedido_queue_client.app.send_task')
+    def test_enqueue_pedidos_lote(self, mock_send_task):
+        """Testa enfileiramento de vários pedidos numa única tarefa"""
+        client = PedidoQueueClient()
+        
+        mock_task = Mock()
+        mock_task.id = "test-task-lote"
+        mock_send_task.return_value = mock_task
+        
+        pedidos = [
+            {"id_pedido": "P1", "produtos": [{"codigo": "444212", "quantidade": 1}]},
+            {"id_pedido": "P2", "produtos": [{"codigo": "444212", "quantidade": 2}]},
+        ]
+        
+        result = client.enqueue_pedidos_lote("user@test.com", "password", pedidos)
+        
+        assert result == "test-task-lote"
+        assert mock_send_task.call_args[0][0] == 'src.nivel3.tasks.processar_pedidos_lote'
+        assert mock_send_task.call_args[1]['args'][0]['pedidos'] == pedidos
+    
     @patch('src.pedido_queue_client.app.AsyncResult')
     def test_get_status_task_pending(self, mock_async_result_class):
         """Testa obtenção de status de tarefa pendente"""
@@ -201,3 +221,290 @@ class TestPedidoQueueClientMain:
                 except SystemExit:
                     # SystemExit é normal em scripts CLI
                     pass
+
+
+class TestPedidoClientVerificacao:
+    """Testes da verificação em lote de produtos (src/nivel3/pedido_client.py)"""
+    
+    @pytest.fixture
+    def client(self, tmp_path):
+        from src.nivel3.pedido_client import PedidoClient
+        from src.catalogo import CatalogoIndex
+        from src.catalogo.cache import CacheProdutos
+        
+        client = PedidoClient()
+        client.catalogo = CatalogoIndex(db_path=tmp_path / "catalogo.db")
+        client.cache = CacheProdutos(usar_redis=False)
+        return client
+    
+    def test_verificar_produtos_deduplica_buscas(self, client):
+        """Cada código distinto é buscado uma única vez"""
+        client.catalogo.atualizar([{'codigo': '111', 'gtin': '789111', 'descricao': 'No catálogo'}])
+        produtos = [
+            {'codigo': '111', 'quantidade': 1},
+            {'codigo': '222', 'quantidade': 1},
+            {'codigo': '222', 'quantidade': 3},
+            {'codigo': '', 'gtin': '789333', 'quantidade': 1},
+        ]
+        
+        with patch.object(client, '_buscar_produto_remoto',
+                          side_effect=lambda item, fw: {'codigo': item.get('codigo') or '333',
+                                                        'verificado_via': 'scrapy'}) as mock_busca:
+            resolvidos = client.verificar_produtos(produtos)
+        
+        assert mock_busca.call_count == 2
+        assert resolvidos['111']['verificado_via'] == 'catalogo'
+        assert resolvidos['222']['verificado_via'] == 'scrapy'
+        assert 'gtin:789333' in resolvidos
+    
+    def test_buscar_produto_por_codigo_memoriza(self, client):
+        """Código repetido (encontrado ou não) não dispara nova busca"""
+        with patch.object(client, '_buscar_codigo',
+                          side_effect=lambda codigo: {'codigo': codigo} if codigo == '111' else None) as mock_busca:
+            for _ in range(3):
+                assert client.buscar_produto_por_codigo('111') == {'codigo': '111'}
+                assert client.buscar_produto_por_codigo('999') is None
+        
+        assert mock_busca.call_count == 2
+        assert client.cache.estatisticas()['hits'] == 2
+    
+    @patch('src.servimed_scraper.scraper.ServimedScraperCompleto.search_products')
+    def test_so_nao_encontrado_confirmado_vai_para_o_cache(self, mock_search, client):
+        """Falha ou resultado incompleto da busca não vão para o cache negativo"""
+        bruto = {'codigoExterno': 111, 'codigoBarras': '789111', 'descricao': 'Outro'}
+        mock_search.side_effect = [
+            None,                                            # erro HTTP
+            {'lista': [bruto], 'totalRegistros': 40},        # produto pode estar em outra página
+            {'lista': [], 'totalRegistros': 0},              # confirmado: não existe
+        ]
+        
+        assert client.buscar_produto_por_codigo('999') is None
+        assert client.buscar_produto_por_codigo('999') is None
+        assert client.buscar_produto_por_codigo('999') is None
+        assert client.buscar_produto_por_codigo('999') is None
+        
+        assert mock_search.call_count == 3
+        assert client.cache.estatisticas()['hits_negativos'] == 1
+    
+    @patch('src.scrapy_wrapper.ScrapyServimedWrapper')
+    def test_scrapy_decide_sem_repetir_a_busca(self, mock_wrapper_class, client):
+        """A coleta Scrapy decide pelo próprio totalRegistros; o portal só é consultado se ela falhar"""
+        outro = {'codigo': '111', 'gtin': '789111'}
+        crawl = mock_wrapper_class.return_value.crawl
+        crawl.side_effect = [
+            {'success': True, 'produtos': [outro], 'stats': {'coleta/total_registros': 1}},
+            {'success': True, 'produtos': [outro], 'stats': {'coleta/total_registros': 40}},
+            {'success': False, 'error': 'Timeout'},
+        ]
+        
+        with patch.object(client, '_buscar_no_portal', return_value={'codigo': '999'}) as mock_portal:
+            # Todos os resultados vieram na página 1: não existe
+            assert client._buscar_produto_remoto({'codigo': '999'}, 'scrapy') is None
+            # Há mais páginas: incerto, não vai para o cache negativo
+            with pytest.raises(LookupError):
+                client._buscar_produto_remoto({'codigo': '999'}, 'scrapy')
+            mock_portal.assert_not_called()
+            
+            # Só a falha da coleta usa a busca do sistema original
+            assert client._buscar_produto_remoto({'codigo': '999'}, 'scrapy')['verificado_via'] == 'original'
+            mock_portal.assert_called_once()
+    
+    def test_realizar_pedido_reutiliza_resolvidos(self, client):
+        """realizar_pedido não busca novamente produtos já verificados"""
+        client.access_token = 'token'
+        client.client_id = '267511'
+        client.logged_user = '22850'
+        
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'executado': 'Ok'}
+        
+        produtos = [{'codigo': '444212', 'quantidade': 2}]
+        resolvidos = {'444212': {'codigo': '444212', 'preco_fabrica': 10.0, 'descricao': 'X'}}
+        with patch.object(client, 'buscar_produto_por_codigo') as mock_buscar, \
+             patch.object(client.session, 'post', return_value=mock_response):
+            codigo = client.realizar_pedido(produtos, resolvidos)
+            repetido = client.realizar_pedido(produtos, resolvidos)
+        
+        mock_buscar.assert_not_called()
+        assert codigo.startswith('SERVIMED_')
+        # Pedidos iguais no mesmo minuto recebem códigos distintos
+        assert codigo != repetido
+
+
+class TestProcessarPedidosLote:
+    """Testes da tarefa de pedidos em lote (src/nivel3/tasks.py)"""
+    
+    @patch('src.nivel3.tasks.fazer_patch_pedido', return_value=True)
+    @patch('src.nivel3.tasks.gerar_pedido_aleatorio_api', side_effect=['9001', '9002', '9003'])
+    @patch('src.nivel3.tasks.CallbackAPIClient')
+    @patch('src.nivel3.tasks.PedidoClient')
+    def test_lote_compartilha_verificacao_e_api(self, mock_pedido_class, mock_api_class,
+                                                mock_gerar, mock_patch):
+        """Uma verificação e uma autenticação na API para o lote; resultado por pedido"""
+        from src.nivel3.tasks import processar_pedidos_lote
+        
+        pedido_client = mock_pedido_class.return_value
+        pedido_client.verificar_produtos.return_value = {'111': {'codigo': '111', 'preco_fabrica': 1.0}}
+        pedido_client.authenticate.return_value = True
+        pedido_client.realizar_pedido.side_effect = lambda produtos, resolvidos: (
+            None if produtos[0]['codigo'] == '999' else f"SERVIMED_{produtos[0]['quantidade']}")
+        pedido_client.cache.estatisticas.return_value = {}
+        mock_api_class.return_value.authenticate.return_value = True
+        
+        resultado = processar_pedidos_lote.apply(args=[{
+            'pedidos': [
+                {'id_pedido': 'P1', 'produtos': [{'codigo': '111', 'quantidade': 1}]},
+                {'id_pedido': 'P2', 'produtos': [{'codigo': '111', 'quantidade': 2}]},
+                {'id_pedido': 'P3', 'produtos': [{'codigo': '999', 'quantidade': 1}]},
+            ]
+        }]).get()
+        
+        pedido_client.verificar_produtos.assert_called_once()
+        assert len(pedido_client.verificar_produtos.call_args[0][0]) == 3
+        mock_api_class.return_value.authenticate.assert_called_once()
+        
+        assert resultado['status'] == 'partial'
+        assert resultado['pedidos_ok'] == 2
+        assert resultado['pedidos']['P1']['codigo_pedido_servimed'] == 'SERVIMED_1'
+        assert resultado['pedidos']['P2']['patch_enviado'] is True
+        assert resultado['pedidos']['P3']['status'] == 'error'
+        # Pedido aleatório criado em paralelo fica registrado no erro
+        assert resultado['pedidos']['P3']['pedido_aleatorio_api'] in ('9001', '9002', '9003')
+    
+    @patch('src.nivel3.tasks.PEDIDO_LOTE_WORKERS', 2)
+    @patch('src.nivel3.tasks.fazer_patch_pedido', return_value=True)
+    @patch('src.nivel3.tasks.gerar_pedido_aleatorio_api', return_value='9001')
+    @patch('src.nivel3.tasks.CallbackAPIClient')
+    @patch('src.nivel3.tasks.PedidoClient')
+    def test_lote_com_sessao_por_thread(self, mock_pedido_class, mock_api_class, mock_gerar, mock_patch):
+        """Cada thread de transmissão usa o próprio PedidoClient (requests.Session não é thread-safe)"""
+        import threading
+        from src.nivel3.tasks import processar_pedidos_lote
+        
+        threads_por_cliente = {}
+        
+        def novo_cliente():
+            cliente = Mock()
+            cliente.verificar_produtos.return_value = {}
+            cliente.authenticate.return_value = True
+            cliente.cache.estatisticas.return_value = {}
+            threads = threads_por_cliente.setdefault(id(cliente), set())
+            cliente.realizar_pedido.side_effect = lambda produtos, resolvidos: (
+                threads.add(threading.get_ident()) or 'SERVIMED_1')
+            return cliente
+        mock_pedido_class.side_effect = novo_cliente
+        mock_api_class.return_value.authenticate.return_value = True
+        
+        resultado = processar_pedidos_lote.apply(args=[{
+            'pedidos': [{'id_pedido': f'P{i}', 'produtos': [{'codigo': '111', 'quantidade': 1}]} for i in range(6)]
+        }]).get()
+        
+        assert resultado['pedidos_ok'] == 6
+        usados = [threads for threads in threads_por_cliente.values() if threads]
+        # Verificação + no máximo um cliente por thread de transmissão
+        assert 1 <= len(usados) <= 2
+        assert all(len(threads) == 1 for threads in usados)
+        assert mock_pedido_class.call_count == len(usados) + 1
+    
+    @patch('src.nivel3.tasks.CallbackAPIClient')
+    @patch('src.nivel3.tasks.PedidoClient')
+    def test_lote_com_id_pedido_repetido(self, mock_pedido_class, mock_api_class):
+        """ids repetidos rejeitam o lote antes de qualquer pedido; sem id vale a posição"""
+        from src.nivel3.tasks import processar_pedidos_lote
+        
+        resultado = processar_pedidos_lote.apply(args=[{
+            'pedidos': [
+                {'id_pedido': 'P1', 'produtos': [{'codigo': '111', 'quantidade': 1}]},
+                {'id_pedido': 'pedido_3', 'produtos': [{'codigo': '111', 'quantidade': 1}]},
+                {'produtos': [{'codigo': '111', 'quantidade': 1}]},
+            ]
+        }]).get()
+        
+        assert resultado['status'] == 'error'
+        assert 'pedido_3' in resultado['error']
+        mock_pedido_class.return_value.realizar_pedido.assert_not_called()
+    
+    def test_endpoint_pedido_aleatorio_memorizado(self):
+        """Endpoint que funcionou é tentado primeiro nas chamadas seguintes"""
+        from src.nivel3 import tasks
+        
+        api_client = Mock()
+        api_client.base_url = 'https://api.teste'
+        
+        def responder(metodo, endpoint, **kwargs):
+            resposta = Mock()
+            resposta.status_code = 201 if endpoint == '/pedido/gerar' else 404
+            resposta.json.return_value = {'id': 77}
+            return resposta
+        
+        api_client.request.side_effect = responder
+        
+        with patch.dict(tasks._endpoint_pedido_aleatorio, clear=True):
+            assert tasks.gerar_pedido_aleatorio_api(api_client) == '77'
+            assert api_client.request.call_count == 3
+            
+            api_client.request.reset_mock()
+            assert tasks.gerar_pedido_aleatorio_api(api_client) == '77'
+            api_client.request.assert_called_once()
+            assert api_client.request.call_args[0][1] == '/pedido/gerar'
+    
+    @patch('src.nivel3.tasks.fazer_patch_pedido', return_value=True)
+    @patch('src.nivel3.tasks.CallbackAPIClient')
+    @patch('src.nivel3.tasks.PedidoClient')
+    def test_pedido_aleatorio_em_paralelo_com_servimed(self, mock_pedido_class, mock_api_class, mock_patch):
+        """Pedido aleatório é gerado durante a transmissão; só o PATCH espera o Servimed"""
+        import threading
+        from src.nivel3.tasks import processar_pedido_completo
+        
+        aleatorio_gerado = threading.Event()
+        
+        def gerar(api_client):
+            aleatorio_gerado.set()
+            return '9001'
+        
+        def realizar(produtos, resolvidos):
+            # Só conclui se o lado Cotefácil já rodou em paralelo
+            assert aleatorio_gerado.wait(timeout=5)
+            return 'SERVIMED_1'
+        
+        pedido_client = mock_pedido_class.return_value
+        pedido_client.verificar_produtos.return_value = {}
+        pedido_client.authenticate.return_value = True
+        pedido_client.realizar_pedido.side_effect = realizar
+        pedido_client.cache.estatisticas.return_value = {}
+        mock_api_class.return_value.authenticate.return_value = True
+        
+        with patch('src.nivel3.tasks.gerar_pedido_aleatorio_api', side_effect=gerar):
+            resultado = processar_pedido_completo.apply(args=[{
+                'id_pedido': 'P1', 'produtos': [{'codigo': '111', 'quantidade': 1}]
+            }]).get()
+        
+        assert resultado['status'] == 'success'
+        assert resultado['pedido_aleatorio_api'] == '9001'
+        mock_patch.assert_called_once()
+        assert mock_patch.call_args[0][2]['codigo_confirmacao'] == 'SERVIMED_1'
+    
+    @patch('src.nivel3.tasks.fazer_patch_pedido', return_value=True)
+    @patch('src.nivel3.tasks.gerar_pedido_aleatorio_api', return_value='9001')
+    @patch('src.nivel3.tasks.CallbackAPIClient')
+    @patch('src.nivel3.tasks.PedidoClient')
+    def test_falha_servimed_informa_pedido_aleatorio(self, mock_pedido_class, mock_api_class,
+                                                    mock_gerar, mock_patch):
+        """Falha no portal depois do pedido aleatório criado: id órfão vai no resultado de erro"""
+        from src.nivel3.tasks import processar_pedido_completo
+        
+        pedido_client = mock_pedido_class.return_value
+        pedido_client.verificar_produtos.return_value = {}
+        pedido_client.authenticate.return_value = True
+        pedido_client.realizar_pedido.return_value = None
+        pedido_client.cache.estatisticas.return_value = {}
+        mock_api_class.return_value.authenticate.return_value = True
+        
+        resultado = processar_pedido_completo.apply(args=[{
+            'id_pedido': 'P1', 'produtos': [{'codigo': '111', 'quantidade': 1}]
+        }]).get()
+        
+        assert resultado['status'] == 'error'
+        assert resultado['pedido_aleatorio_api'] == '9001'
+        mock_patch.assert_not_called()
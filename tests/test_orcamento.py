@@ -0,0 +1,126 @@
+"""
+Testes para o orçamento de taxa do cluster (src/rede/orcamento.py)
+"""
+import importlib
+import os
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.rede.orcamento import OrcamentoTaxa, limitar, recuar
+
+
+def orcamento_com(esperas, **kwargs):
+    """Orçamento sobre um cliente Redis simulado; o script devolve as esperas em ms"""
+    cliente = Mock()
+    cliente.register_script.return_value = Mock(side_effect=esperas)
+    return OrcamentoTaxa('peapi.servimed.com.br', cliente=cliente, **kwargs), cliente
+
+
+class TestOrcamentoTaxa:
+    """Testes do token bucket compartilhado no Redis"""
+
+    @patch('src.rede.orcamento.time.sleep')
+    def test_aguarda_a_espera_indicada_pelo_redis(self, mock_sleep):
+        """Testa que a ficha negada espera o tempo devolvido pelo script e tenta de novo"""
+        orcamento, cliente = orcamento_com([250, 0], taxa=4, capacidade=2)
+
+        esperado = orcamento.adquirir()
+
+        assert esperado == pytest.approx(0.25)
+        mock_sleep.assert_called_once_with(0.25)
+        script = cliente.register_script.return_value
+        assert script.call_args[1] == {'keys': ['servimed:orcamento:peapi.servimed.com.br',
+                                                'servimed:orcamento:peapi.servimed.com.br:pausa'],
+                                       'args': [4, 2]}
+        assert orcamento.estatisticas() == {'taxa': 4, 'fichas': 1, 'espera': 0.25, 'falhas': 0}
+
+    @patch('src.rede.orcamento.time.sleep')
+    def test_redis_fora_do_ar_nao_para_a_coleta(self, mock_sleep):
+        """Testa que erros do Redis liberam as requisições (só o controle local vale)"""
+        orcamento, _ = orcamento_com(ConnectionError('recusada'), taxa=2)
+
+        assert orcamento.adquirir() == 0.0
+        assert orcamento.adquirir() == 0.0
+        # Depois da falha o Redis só é consultado de novo após INTERVALO_RECONEXAO
+        assert orcamento.estatisticas()['falhas'] == 1
+        mock_sleep.assert_not_called()
+
+    def test_pausa_compartilhada(self):
+        """Testa que o Retry-After vira uma chave com validade, vista por todos os workers"""
+        orcamento, cliente = orcamento_com([], taxa=2)
+
+        orcamento.pausar(1.5)
+        orcamento.pausar(0)
+
+        cliente.set.assert_called_once_with('servimed:orcamento:peapi.servimed.com.br:pausa', '1', px=1500)
+
+    def test_taxa_invalida(self):
+        """Testa que o orçamento exige taxa positiva"""
+        with pytest.raises(ValueError):
+            OrcamentoTaxa('x', taxa=0, cliente=Mock())
+
+
+class TestLimitar:
+    """Testes dos orçamentos por conta e por host aplicados a cada requisição"""
+
+    @patch('src.rede.orcamento.COLETA_ORCAMENTO_HOSTS', {'peapi.servimed.com.br'})
+    @patch('src.rede.orcamento.orcamento_para')
+    def test_conta_antes_do_host(self, mock_orcamento_para):
+        """Testa que a requisição consome a ficha da conta e depois a do host"""
+        ordem = []
+        orcamentos = {}
+
+        def orcamento_para(nome, taxa, capacidade):
+            orcamento = orcamentos.setdefault(nome, Mock())
+            orcamento.adquirir.side_effect = lambda: ordem.append(nome) or 0.1
+            return orcamento
+        mock_orcamento_para.side_effect = orcamento_para
+
+        esperado = limitar('https://peapi.servimed.com.br/api/carrinho/oculto?siteVersion=1', '22850')
+
+        assert ordem == ['peapi.servimed.com.br:conta:22850', 'peapi.servimed.com.br']
+        assert esperado == pytest.approx(0.2)
+
+        # Sem conta, só o orçamento do host
+        ordem.clear()
+        limitar('https://peapi.servimed.com.br/', None)
+        assert ordem == ['peapi.servimed.com.br']
+
+    @patch('src.rede.orcamento.COLETA_ORCAMENTO_HOSTS', {'peapi.servimed.com.br'})
+    @patch('src.rede.orcamento.orcamento_para')
+    def test_outros_hosts_nao_sao_limitados(self, mock_orcamento_para):
+        """Testa que a API de callback e outros hosts não consomem fichas"""
+        assert limitar('https://desafio.cotefacil.net/oauth/token', '22850') == 0.0
+        recuar('https://desafio.cotefacil.net/produto', 429, '5')
+
+        mock_orcamento_para.assert_not_called()
+
+    @patch('src.rede.orcamento.COLETA_ORCAMENTO_HOSTS', {'peapi.servimed.com.br'})
+    @patch('src.rede.orcamento.orcamento_para')
+    def test_retry_after_pausa_o_host(self, mock_orcamento_para):
+        """Testa que só 403/429 com Retry-After numérico pausam o orçamento do host"""
+        recuar('https://peapi.servimed.com.br/api', 429, '2')
+        recuar('https://peapi.servimed.com.br/api', 500, '2')
+        recuar('https://peapi.servimed.com.br/api', 403, None)
+        recuar('https://peapi.servimed.com.br/api', 403, 'Wed, 21 Oct 2026 07:28:00 GMT')
+
+        pausar = mock_orcamento_para.return_value.pausar
+        assert pausar.call_args_list[0][0] == (2.0,)
+        assert pausar.call_count == 1
+    
+    def test_hosts_padrao_do_base_url(self):
+        """Testa que, sem COLETA_ORCAMENTO_HOSTS, o host limitado é o da API em BASE_URL"""
+        from src.rede import orcamento
+        
+        try:
+            with patch.dict(os.environ, {'BASE_URL': 'https://api.homologacao.teste:8443', 'COLETA_ORCAMENTO_HOSTS': ''}):
+                assert importlib.reload(orcamento).COLETA_ORCAMENTO_HOSTS == {'api.homologacao.teste'}
+            with patch.dict(os.environ, {'COLETA_ORCAMENTO_HOSTS': 'a.teste, b.teste'}):
+                assert importlib.reload(orcamento).COLETA_ORCAMENTO_HOSTS == {'a.teste', 'b.teste'}
+        finally:
+            importlib.reload(orcamento)
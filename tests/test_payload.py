@@ -0,0 +1,60 @@
+"""
+Testes para o payload da busca de produtos (src/coleta/payload.py)
+"""
+import json
+import pytest
+import sys
+from pathlib import Path
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.coleta.payload import PayloadBusca
+
+
+class TestPayloadBusca:
+    """Testes do corpo pré-codificado"""
+
+    def test_corpo_equivale_ao_payload_completo(self):
+        """Testa que os bytes montados são o JSON esperado, com filtro e página primeiro"""
+        payload = PayloadBusca(cliente_id=267511, codigo_usuario='22850', users='518565, 267511')
+
+        dados = json.loads(payload.corpo(7, 'dipirona "500"'))
+
+        assert list(dados)[:3] == ['filtro', 'pagina', 'registrosPorPagina']
+        assert dados['filtro'] == 'dipirona "500"'
+        assert dados['pagina'] == 7
+        assert dados['clienteId'] == 267511
+        assert dados['codigoUsuario'] == 22850
+        assert dados['users'] == [518565, 267511]
+        assert len(dados) == 22
+
+    def test_contas_diferentes_no_mesmo_processo(self):
+        """Testa que cada conta tem seu próprio payload"""
+        conta_a = PayloadBusca(1, 10, [1])
+        conta_b = PayloadBusca(2, 20, [2])
+
+        assert json.loads(conta_a.corpo(1))['clienteId'] == 1
+        assert json.loads(conta_b.corpo(1))['clienteId'] == 2
+
+    def test_do_ambiente(self, monkeypatch):
+        """Testa que os identificadores vêm do .env quando não informados"""
+        monkeypatch.setenv('CLIENT_ID', '123')
+        monkeypatch.setenv('LOGGED_USER', '456')
+        monkeypatch.setenv('USERS', '7,8')
+
+        dados = PayloadBusca.do_ambiente().dados(1)
+
+        assert (dados['clienteId'], dados['codigoUsuario'], dados['users']) == (123, 456, [7, 8])
+
+    def test_do_ambiente_sem_conta_falha_cedo(self, monkeypatch):
+        """Testa que a conta ausente no .env é erro imediato, não uma busca com clienteId 0"""
+        monkeypatch.setenv('CLIENT_ID', '123')
+        monkeypatch.delenv('LOGGED_USER', raising=False)
+        monkeypatch.delenv('USERS', raising=False)
+
+        with pytest.raises(ValueError, match='LOGGED_USER, USERS'):
+            PayloadBusca.do_ambiente()
+
+        # Informados explicitamente, dispensam o .env
+        assert PayloadBusca.do_ambiente(codigo_usuario=456, users=[7]).dados(1)['codigoUsuario'] == 456
@@ -0,0 +1,51 @@
+"""
+Testes para o registro compacto de produto (src/coleta/produto.py)
+"""
+import json
+import pytest
+import sys
+from pathlib import Path
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.coleta.produto import Produto, ProdutoOriginal, para_json
+
+
+class TestProduto:
+    """Testes do registro com __slots__"""
+
+    def test_acesso_como_dict(self):
+        """Testa que o registro se comporta como o dict que substitui"""
+        produto = Produto(gtin='789', codigo='A1', descricao='DIPIRONA', preco_fabrica=1.5, estoque=3)
+
+        assert produto == {'gtin': '789', 'codigo': 'A1', 'descricao': 'DIPIRONA',
+                           'preco_fabrica': 1.5, 'estoque': 3}
+        assert produto['gtin_ean'] == '789'
+        assert produto.get('filtros') is None
+        assert 'filtros' not in produto
+        assert {**produto, 'verificado_via': 'scrapy'}['codigo'] == 'A1'
+        assert not hasattr(produto, '__dict__')
+
+        produto['filtros'] = ['dipirona']
+        assert produto['filtros'] == ['dipirona']
+        with pytest.raises(KeyError):
+            produto['url'] = 'x'
+
+    def test_sistema_original_e_json(self):
+        """Testa o formato do sistema original (gtin_ean, data_coleta) e a serialização"""
+        produto = ProdutoOriginal.de_mapping({'gtin_ean': '789', 'codigo': 1, 'descricao': 'X',
+                                              'preco_fabrica': None, 'estoque': None,
+                                              'data_coleta': '2025-01-01 10:00:00'})
+
+        dados = json.loads(json.dumps([produto], default=para_json))
+
+        assert dados == [{'gtin_ean': '789', 'codigo': 1, 'descricao': 'X', 'preco_fabrica': None,
+                          'estoque': None, 'data_coleta': '2025-01-01 10:00:00'}]
+
+    def test_descricoes_internadas(self):
+        """Testa que descrições iguais de produtos diferentes são o mesmo objeto"""
+        a = Produto.de_mapping(json.loads('{"codigo": 1, "descricao": "PARACETAMOL 750MG"}'))
+        b = Produto.de_mapping(json.loads('{"codigo": 2, "descricao": "PARACETAMOL 750MG"}'))
+
+        assert a['descricao'] is b['descricao']
@@ -143,3 +143,124 @@ class TestScrapyWrapperIntegration:
         
         # Deve funcionar mesmo com parâmetros None
         assert result is not None
+
+
+class TestScrapyWrapperInProcess:
+    """Testes da coleta em processo (reactor compartilhado)"""
+    
+    @patch('src.scrapy_wrapper._ReactorThread.get')
+    def test_crawl_retorna_itens_em_memoria(self, mock_get):
+        """Testa que crawl retorna os produtos sem ler arquivo"""
+        from src.scrapy_wrapper import _ColetorItens
+        
+        coletor = _ColetorItens()
+        coletor.item_scraped({'gtin': '789', 'codigo': '444212', 'descricao': 'Produto',
+                              'preco_fabrica': 10.0, 'estoque': 2, 'url': 'x'}, spider=None)
+        mock_get.return_value.crawl.return_value = (coletor, {'item_scraped_count': 1})
+        
+        wrapper = ScrapyServimedWrapper()
+        result = wrapper.crawl("444212", 1)
+        
+        assert result['success'] is True
+        assert result['total'] == 1
+        assert result['produtos'][0]['codigo'] == '444212'
+        assert 'url' not in result['produtos'][0]
+        assert result['stats'] == {'item_scraped_count': 1}
+    
+    @patch('src.scrapy_wrapper._ReactorThread.get')
+    def test_crawl_falha(self, mock_get):
+        """Testa que erros na coleta viram resultado sem sucesso"""
+        mock_get.return_value.crawl.side_effect = RuntimeError("falhou")
+        
+        wrapper = ScrapyServimedWrapper()
+        result = wrapper.crawl("teste", 1)
+        
+        assert result['success'] is False
+        assert 'falhou' in result['error']
+
+
+class TestArquivosDeExecucao:
+    """Testes da limpeza dos arquivos de resultados por execução"""
+    
+    def test_limpar_execucoes_antigas(self, tmp_path, monkeypatch):
+        """Testa que só os arquivos além da retenção são removidos"""
+        import os
+        import time
+        from src import scrapy_wrapper
+        
+        monkeypatch.setattr(scrapy_wrapper, 'EXECUCOES_DIR', tmp_path)
+        antigo = tmp_path / 'servimed_produtos_scrapy_a.jsonl'
+        recente = tmp_path / 'servimed_produtos_scrapy_b.jsonl'
+        for arquivo in (antigo, recente):
+            arquivo.write_text('{}\n', encoding='utf-8')
+        os.utime(antigo, (time.time() - 7200, time.time() - 7200))
+        
+        assert scrapy_wrapper.limpar_execucoes(3600) == 1
+        assert list(tmp_path.iterdir()) == [recente]
+    
+    @patch('src.api_client.callback_client.CallbackAPIClient')
+    @patch('src.scrapy_wrapper._ReactorThread.get')
+    def test_tarefa_nao_deixa_arquivo_da_execucao(self, mock_get, mock_client_class, tmp_path, monkeypatch):
+        """Testa que processar_scraping_simple remove o arquivo da execução depois do envio"""
+        from src import scrapy_wrapper
+        from src.nivel2.tasks import processar_scraping_simple
+        
+        monkeypatch.setattr(scrapy_wrapper, 'EXECUCOES_DIR', tmp_path)
+        
+        def crawl(spider, timeout, arquivo_resultados, **kwargs):
+            arquivo = Path(f'{arquivo_resultados}.jsonl')
+            arquivo.write_text('{"codigo": "1"}\n', encoding='utf-8')
+            coletor = scrapy_wrapper._ColetorItens()
+            coletor.item_scraped({'codigo': '1'}, spider=None)
+            return coletor, {'export/arquivo': str(arquivo)}
+        mock_get.return_value.crawl.side_effect = crawl
+        api_client = mock_client_class.return_value
+        api_client.authenticate.return_value = True
+        api_client.send_products_chunked.return_value = {'success': True, 'lotes_ok': 1, 'total_lotes': 1}
+        
+        resultado = processar_scraping_simple.apply(args=[{'filtro': 'x', 'callback_url': 'https://api.teste'}]).get()
+        
+        assert resultado['status'] == 'success'
+        assert resultado['arquivo_local'] is None
+        assert list(tmp_path.iterdir()) == []
+        
+        # Envio com erro: o arquivo também não fica
+        api_client.authenticate.return_value = False
+        resultado = processar_scraping_simple.apply(args=[{'filtro': 'x', 'callback_url': 'https://api.teste'}]).get()
+        
+        assert resultado['status'] == 'error'
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestScrapyWrapperStreaming:
+    """Testes da leitura incremental dos resultados"""
+    
+    def test_iter_produtos_json_e_jsonl(self, tmp_path):
+        """Testa que os dois formatos produzem os mesmos produtos"""
+        from src.coleta import iter_produtos
+        
+        produtos = [{'codigo': '1'}, {'codigo': '2'}]
+        arquivo_json = tmp_path / 'produtos.json'
+        arquivo_json.write_text(json.dumps({'metadata': {}, 'produtos': produtos}), encoding='utf-8')
+        arquivo_jsonl = tmp_path / 'produtos.jsonl'
+        arquivo_jsonl.write_text('\n'.join(json.dumps(p) for p in produtos) + '\n\n', encoding='utf-8')
+        
+        assert list(iter_produtos(arquivo_json)) == produtos
+        assert list(iter_produtos(arquivo_jsonl)) == produtos
+    
+    def test_get_results_prefere_jsonl_mais_recente(self, tmp_path, monkeypatch):
+        """Testa que get_results lê o JSONL quando ele é o resultado mais recente"""
+        import src.scrapy_wrapper as modulo
+        
+        arquivo_jsonl = tmp_path / 'servimed_produtos_scrapy.jsonl'
+        arquivo_jsonl.write_text('{"codigo": "9"}\n', encoding='utf-8')
+        monkeypatch.setattr(modulo, 'ARQUIVO_JSON', tmp_path / 'servimed_produtos_scrapy.json')
+        monkeypatch.setattr(modulo, 'ARQUIVO_JSONL', arquivo_jsonl)
+        
+        wrapper = ScrapyServimedWrapper()
+        result = wrapper.get_results()
+        
+        assert result['success'] is True
+        assert result['produtos'] == [{'codigo': '9'}]
+        assert result['metadata']['formato'] == 'jsonl'
+        assert list(wrapper.iter_results()) == [{'codigo': '9'}]
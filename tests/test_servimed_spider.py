@@ -0,0 +1,344 @@
+"""
+Testes para o spider Scrapy (src/scrapy_servimed/spiders/servimed_spider.py)
+"""
+import json
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+# Adicionar src ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import scrapy
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import TextResponse
+
+from src.scrapy_servimed.spiders.servimed_spider import ServimedProductsSpider
+from src.scrapy_servimed.middlewares import ServimedSessionMiddleware
+from src.coleta import CheckpointColeta
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_temporario(tmp_path, monkeypatch):
+    """Checkpoints dos testes ficam no diretório temporário"""
+    monkeypatch.setattr('src.coleta.checkpoint.CHECKPOINT_DIR', tmp_path / 'checkpoints')
+    return tmp_path / 'checkpoints'
+
+
+@pytest.fixture(autouse=True)
+def conta_servimed(monkeypatch):
+    """Conta da busca definida sem depender do .env local"""
+    monkeypatch.setenv('CLIENT_ID', '267511')
+    monkeypatch.setenv('LOGGED_USER', '22850')
+    monkeypatch.setenv('USERS', '518565,267511')
+
+
+def fazer_resposta(spider, page, quantidade, total_registros, filtro=None):
+    """Cria uma resposta fake da API com `quantidade` produtos"""
+    lista = [
+        {
+            'codigoBarras': f'789{page:04d}{i:04d}',
+            'codigoExterno': page * 1000 + i,
+            'descricao': f'Produto {page}-{i}',
+            'precoVenda': '10.5',
+            'quantidadeEstoque': '3'
+        }
+        for i in range(quantidade)
+    ]
+    body = json.dumps({'lista': lista, 'totalRegistros': total_registros, 'registrosPorPagina': 25})
+    request = spider.build_page_request(page, filtro)
+    return TextResponse(url=request.url, body=body.encode(), encoding='utf-8', request=request)
+
+
+class TestServimedSpiderFanOut:
+    """Testes do agendamento paralelo de páginas"""
+    
+    def test_primeira_pagina_agenda_restantes(self):
+        """Página 1 agenda todas as páginas restantes de uma vez"""
+        spider = ServimedProductsSpider(filtro='', max_pages=0)
+        
+        resultados = list(spider.parse_products(fazer_resposta(spider, 1, 25, 100)))
+        requests = [r for r in resultados if isinstance(r, scrapy.Request)]
+        
+        assert len(resultados) - len(requests) == 25
+        assert [r.meta['page'] for r in requests] == [2, 3, 4]
+        # Páginas menores têm prioridade maior
+        assert requests[0].priority > requests[-1].priority
+    
+    def test_total_de_registros_nas_estatisticas(self):
+        """totalRegistros da primeira página fica nas estatísticas (buscas pontuais decidem o não encontrado)"""
+        spider = ServimedProductsSpider(filtro='', max_pages=1)
+        spider.crawler = Mock()
+        
+        list(spider.parse_products(fazer_resposta(spider, 1, 25, 100)))
+        
+        spider.crawler.stats.inc_value.assert_called_once_with('coleta/total_registros', 100)
+    
+    def test_max_pages_limita_agendamento(self):
+        """max_pages limita as páginas agendadas"""
+        spider = ServimedProductsSpider(filtro='', max_pages=2)
+        
+        resultados = list(spider.parse_products(fazer_resposta(spider, 1, 25, 100)))
+        paginas = [r.meta['page'] for r in resultados if isinstance(r, scrapy.Request)]
+        
+        assert paginas == [2]
+    
+    def test_paginas_seguintes_nao_agendam(self):
+        """Somente a primeira página faz o fan-out"""
+        spider = ServimedProductsSpider(filtro='', max_pages=0)
+        
+        resultados = list(spider.parse_products(fazer_resposta(spider, 2, 25, 100)))
+        
+        assert not any(isinstance(r, scrapy.Request) for r in resultados)
+    
+    def test_pagina_curta_encerra_cauda(self):
+        """Página incompleta marca o fim e descarta páginas posteriores"""
+        spider = ServimedProductsSpider(filtro='', max_pages=0)
+        
+        list(spider.parse_products(fazer_resposta(spider, 3, 10, 100)))
+        assert spider.ultima_pagina_de('') == 3
+        
+        # Página 4 já estava em voo: resposta é descartada
+        assert list(spider.parse_products(fazer_resposta(spider, 4, 25, 100))) == []
+    
+    def test_middleware_ignora_paginas_apos_fim(self):
+        """Requisições pendentes após o fim do catálogo não são baixadas"""
+        spider = ServimedProductsSpider(filtro='', max_pages=0)
+        spider.marcar_ultima_pagina(3)
+        middleware = ServimedSessionMiddleware()
+        
+        assert middleware.process_request(spider.build_page_request(3), spider) is None
+        with pytest.raises(IgnoreRequest):
+            middleware.process_request(spider.build_page_request(4), spider)
+
+
+class TestServimedSpiderCheckpoint:
+    """Testes da retomada de coleta a partir do checkpoint"""
+    
+    def test_paginas_concluidas_sao_registradas(self):
+        """Cada página processada entra no checkpoint com o cursor da página 1"""
+        spider = ServimedProductsSpider(filtro='dipirona', max_pages=0)
+        
+        list(spider.parse_products(fazer_resposta(spider, 1, 25, 100)))
+        list(spider.parse_products(fazer_resposta(spider, 2, 25, 100)))
+        
+        checkpoint = CheckpointColeta('scrapy', 'dipirona')
+        assert checkpoint.carregar() is True
+        assert checkpoint.paginas_concluidas == {1, 2}
+        assert checkpoint.total_paginas() == 4
+        assert len(list(checkpoint.produtos())) == 50
+    
+    def test_resume_agenda_somente_paginas_pendentes(self):
+        """Com resume, os produtos salvos são reemitidos e só as páginas faltantes são baixadas"""
+        anterior = ServimedProductsSpider(filtro='', max_pages=0)
+        list(anterior.parse_products(fazer_resposta(anterior, 1, 25, 100)))
+        list(anterior.parse_products(fazer_resposta(anterior, 3, 25, 100)))
+        anterior.closed('shutdown')
+        
+        spider = ServimedProductsSpider(filtro='', max_pages=0, resume='true')
+        resultados = list(spider.start_requests())
+        requests = [r for r in resultados if isinstance(r, scrapy.Request)]
+        
+        assert len(resultados) - len(requests) == 50
+        assert [r.meta['page'] for r in requests] == [2, 4]
+    
+    def test_coleta_completa_remove_checkpoint(self, checkpoint_temporario):
+        """O checkpoint é removido quando todas as páginas foram concluídas"""
+        spider = ServimedProductsSpider(filtro='', max_pages=0)
+        list(spider.parse_products(fazer_resposta(spider, 1, 25, 30)))
+        list(spider.parse_products(fazer_resposta(spider, 2, 5, 30)))
+        
+        spider.closed('finished')
+        
+        assert list(checkpoint_temporario.iterdir()) == []
+    
+    def test_fatia_retoma_a_propria_execucao(self, tmp_path, checkpoint_temporario):
+        """Fatias de uma coleta encadeada usam diretório e execução fixos, sem adotar outras execuções"""
+        diretorio = tmp_path / 'c1' / 'checkpoints'
+        outra = ServimedProductsSpider(filtro='', max_pages=4, pagina_inicial=3, fatia=True,
+                                       diretorio_checkpoint=str(diretorio), execucao='fatia_0001')
+        list(outra.parse_products(fazer_resposta(outra, 3, 25, 100)))
+        
+        anterior = ServimedProductsSpider(filtro='', max_pages=4, pagina_inicial=3, fatia=True,
+                                          diretorio_checkpoint=str(diretorio), execucao='fatia_0002')
+        list(anterior.parse_products(fazer_resposta(anterior, 4, 25, 100)))
+        
+        spider = ServimedProductsSpider(filtro='', max_pages=4, pagina_inicial=3, fatia=True, resume='true',
+                                        diretorio_checkpoint=str(diretorio), execucao='fatia_0002')
+        requests = [r for r in spider.start_requests() if isinstance(r, scrapy.Request)]
+        
+        assert spider.estado().checkpoint.paginas_concluidas == {4}
+        assert [r.meta['page'] for r in requests] == [3]
+        # Nada vai para o CHECKPOINT_DIR global
+        assert list(checkpoint_temporario.glob('*')) == []
+
+
+class TestServimedSpiderVariosFiltros:
+    """Testes da coleta de vários termos na mesma execução"""
+    
+    def test_filtros_de_lista_e_arquivo(self, tmp_path):
+        """Termos da lista e do arquivo são unidos sem repetição, ignorando comentários"""
+        arquivo = tmp_path / 'termos.txt'
+        arquivo.write_text('# analgésicos\ndipirona\n\nparacetamol\n', encoding='utf-8')
+        
+        spider = ServimedProductsSpider(filtros='dipirona, ibuprofeno', arquivo_filtros=str(arquivo))
+        
+        assert spider.filtros == ['dipirona', 'ibuprofeno', 'paracetamol']
+        assert spider.escopo == 'dipirona|ibuprofeno|paracetamol'
+        assert [r.meta['filtro'] for r in spider.start_requests()] == spider.filtros
+    
+    def test_produto_repetido_e_emitido_uma_vez(self):
+        """Código encontrado por dois termos gera um item com os dois termos"""
+        spider = ServimedProductsSpider(filtros=['dipirona', 'analgesico'], max_pages=0)
+        
+        primeiros = list(spider.parse_products(fazer_resposta(spider, 1, 10, 10, 'dipirona')))
+        segundos = list(spider.parse_products(fazer_resposta(spider, 1, 10, 10, 'analgesico')))
+        
+        assert len(primeiros) == 10
+        assert segundos == []
+        assert all(item['filtros'] == ['dipirona', 'analgesico'] for item in primeiros)
+    
+    def test_fim_do_catalogo_por_termo(self):
+        """Cada termo tem sua própria última página e a coleta só completa com todos"""
+        spider = ServimedProductsSpider(filtros=['a', 'b'], max_pages=0)
+        middleware = ServimedSessionMiddleware()
+        
+        list(spider.parse_products(fazer_resposta(spider, 1, 10, 10, 'a')))
+        
+        assert spider.ultima_pagina_de('a') == 1
+        assert spider.coleta_completa() is False
+        with pytest.raises(IgnoreRequest):
+            middleware.process_request(spider.build_page_request(2, 'a'), spider)
+        assert middleware.process_request(spider.build_page_request(2, 'b'), spider) is None
+        
+        list(spider.parse_products(fazer_resposta(spider, 1, 5, 5, 'b')))
+        assert spider.coleta_completa() is True
+
+
+class TestServimedPipelineJsonl:
+    """Testes da exportação em streaming (JSON Lines)"""
+    
+    def test_jsonl_grava_em_lotes_e_renomeia(self, tmp_path, monkeypatch):
+        """Testa que os lotes vão para o temporário e o arquivo final só aparece no fechamento"""
+        from src.scrapy_servimed.pipelines import ServimedPipeline
+        from src.coleta import iter_produtos
+        
+        monkeypatch.chdir(tmp_path)
+        spider = Mock()
+        spider.name = 'servimed_products'
+        pipeline = ServimedPipeline(formato='jsonl', flush_every=2)
+        pipeline.open_spider(spider)
+        
+        for i in range(3):
+            pipeline.process_item({'gtin': f'789{i}', 'codigo': str(i + 1), 'descricao': f'Produto {i}',
+                                   'preco_fabrica': '1.5', 'estoque': '2', 'url': 'x'}, spider)
+        
+        # Um lote completo já em disco, nada mantido em memória
+        assert pipeline.arquivo_tmp.read_text(encoding='utf-8').count('\n') == 2
+        assert pipeline.produtos == []
+        assert not (tmp_path / 'data' / 'servimed_produtos_scrapy.jsonl').exists()
+        
+        pipeline.close_spider(spider)
+        
+        produtos = list(iter_produtos(tmp_path / 'data' / 'servimed_produtos_scrapy.jsonl'))
+        assert [p['codigo'] for p in produtos] == ['1', '2', '3']
+        assert produtos[0] == {'gtin': '7890', 'codigo': '1', 'descricao': 'Produto 0',
+                               'preco_fabrica': 1.5, 'estoque': 2}
+        assert list((tmp_path / 'data').glob('*.tmp')) == []
+    
+    def test_arquivo_da_execucao(self, tmp_path):
+        """Testa que coletas em processo gravam no arquivo da execução e o informam nas estatísticas"""
+        from src.scrapy_servimed.pipelines import ServimedPipeline
+        
+        stats = Mock()
+        spider = Mock(fatia=False, arquivo_resultados=str(tmp_path / 'execucoes' / 'coleta_1'))
+        pipeline = ServimedPipeline(formato='jsonl', stats=stats)
+        pipeline.open_spider(spider)
+        pipeline.process_item({'gtin': '789', 'codigo': '1', 'descricao': 'Produto'}, spider)
+        pipeline.close_spider(spider)
+        
+        arquivo = tmp_path / 'execucoes' / 'coleta_1.jsonl'
+        assert arquivo.read_text(encoding='utf-8').count('\n') == 1
+        stats.set_value.assert_called_once_with('export/arquivo', str(arquivo))
+        
+        # Sem arquivo (busca pontual): nada é gravado
+        spider.arquivo_resultados = False
+        pipeline = ServimedPipeline(formato='jsonl', stats=stats)
+        pipeline.open_spider(spider)
+        pipeline.process_item({'gtin': '789', 'codigo': '2', 'descricao': 'Produto'}, spider)
+        pipeline.close_spider(spider)
+        
+        assert pipeline.arquivo_tmp is None
+
+
+class TestColunarPipeline:
+    """Testes do snapshot colunar (Parquet / Arrow IPC)"""
+    
+    @pytest.mark.parametrize('formato', ['parquet', 'arrow'])
+    def test_snapshot_tipado(self, formato, tmp_path, monkeypatch):
+        """Testa que o snapshot tem colunas tipadas e o timestamp da coleta"""
+        pa = pytest.importorskip('pyarrow')
+        import pyarrow.parquet as pq
+        from src.scrapy_servimed.pipelines import ColunarPipeline
+        
+        monkeypatch.chdir(tmp_path)
+        spider = Mock(exportar=formato)
+        pipeline = ColunarPipeline(lote=2)
+        pipeline.open_spider(spider)
+        
+        for i in range(3):
+            pipeline.process_item({'gtin': f'789{i}', 'codigo': i + 1, 'descricao': f'Produto {i}',
+                                   'preco_fabrica': 1.5 if i else None, 'estoque': 2}, spider)
+        # Removidos emitidos pelo DeltaPipeline não entram no snapshot
+        pipeline.process_item({'codigo': 9, 'estoque': 0, 'alteracao': 'removido'}, spider)
+        pipeline.spider_closed(spider, 'finished')
+        
+        arquivo = tmp_path / 'data' / f'servimed_produtos_scrapy.{formato}'
+        if formato == 'parquet':
+            tabela = pq.read_table(arquivo)
+        else:
+            tabela = pa.ipc.open_file(pa.memory_map(str(arquivo))).read_all()
+        
+        assert tabela.column_names == ['gtin', 'codigo', 'descricao', 'preco_fabrica', 'estoque', 'coletado_em']
+        assert tabela.schema.field('estoque').type == pa.int64()
+        assert tabela.column('codigo').to_pylist() == ['1', '2', '3']
+        assert tabela.column('preco_fabrica').to_pylist() == [None, 1.5, 1.5]
+        assert len(set(tabela.column('coletado_em').to_pylist())) == 1
+        assert list((tmp_path / 'data').glob('*.tmp')) == []
+    
+    def test_desligado_sem_formato(self, tmp_path, monkeypatch):
+        """Testa que sem setting nem argumento do spider nada é gravado"""
+        pytest.importorskip('pyarrow')
+        from src.scrapy_servimed.pipelines import ColunarPipeline
+        
+        monkeypatch.chdir(tmp_path)
+        spider = Mock(exportar='')
+        pipeline = ColunarPipeline()
+        pipeline.open_spider(spider)
+        pipeline.process_item({'codigo': '1'}, spider)
+        pipeline.spider_closed(spider, 'finished')
+        
+        assert not (tmp_path / 'data').exists()
+    
+    def test_coleta_interrompida_nao_publica(self, tmp_path, monkeypatch):
+        """Testa que uma coleta encerrada sem 'finished' descarta o snapshot"""
+        pytest.importorskip('pyarrow')
+        from src.scrapy_servimed.pipelines import ColunarPipeline
+        
+        monkeypatch.chdir(tmp_path)
+        spider = Mock(exportar='parquet')
+        pipeline = ColunarPipeline()
+        pipeline.open_spider(spider)
+        pipeline.process_item({'codigo': '1'}, spider)
+        pipeline.spider_closed(spider, 'shutdown')
+        
+        assert list((tmp_path / 'data').iterdir()) == []
+    
+    def test_roda_antes_do_delta(self):
+        """Testa que o snapshot vê os produtos antes do DeltaPipeline descartar os inalterados"""
+        from src.scrapy_servimed import settings
+        
+        pipelines = settings.ITEM_PIPELINES
+        assert (pipelines['src.scrapy_servimed.pipelines.ColunarPipeline']
+                < pipelines['src.scrapy_servimed.pipelines.DeltaPipeline'])